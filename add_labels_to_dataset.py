@@ -2,9 +2,13 @@ import argparse
 import os
 
 import pandas as pd
+import pyarrow.parquet as pq
 from icecream import ic
 
-from src.utils import clean_up, parquet_exists, read_data, read_model_predictions
+from src.label_store import LabelStore, run_metadata
+from src.settings import ROW_ID_COLUMN
+from src.telemetry import RunReport
+from src.utils import clean_up
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -24,21 +28,33 @@ def parse_arguments() -> argparse.Namespace:
 
 
 def main(args: argparse.Namespace) -> None:
-    if parquet_exists("./data/output/"):
-        df = pd.read_parquet("./data/output/labeled_dataset.parquet")
-    else:
-        df = read_data()
+    predictions_path = f"./data/labeled_data_{args.model_name}.parquet"
+    if not os.path.exists(predictions_path):
+        raise FileNotFoundError(
+            f"Predictions file for {args.model_name} not found at {predictions_path}"
+        )
 
-    predictions_df = read_model_predictions(args.model_name)
-    df[f"{args.model_name}_prediction"] = predictions_df[f"{args.model_name}_prediction"]
-    ic(df.columns)
+    report = RunReport("add_labels_to_dataset", args.model_name)
 
-    df.to_parquet("./data/output/labeled_dataset.parquet", index=False)
+    # only the row ids and the columns of the model are read, not the whole dataset
+    with report.stage("data_load"):
+        schema = pq.read_schema(predictions_path)
+        names = schema.names
+        label_columns = [name for name in names if name.startswith(f"{args.model_name}_")]
+        labels = pd.read_parquet(predictions_path, columns=[ROW_ID_COLUMN] + label_columns)
+    ic(labels.columns)
+
+    label_store = LabelStore()
+    with report.stage("save"):
+        label_store.add(args.model_name, labels, metadata=run_metadata(schema))
+    report.advance(len(labels))
 
     clean_up(args.model_name)
 
     print("Predictions have been added to the dataset.")
-    print("Merged dataset saved at ./data/output/labeled_dataset.parquet")
+    print(f"Labels saved at {label_store.path(args.model_name)}")
+
+    report.save(f"./data/output/run_report_add_labels_{args.model_name}.json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from icecream import ic
+
+import filter_dataset
+from benchmarks.bench_pipeline import COLUMNS, FakeModel, FakeModelLoader, make_dataset
+from src.stub_server import StubServer
+from src.telemetry import RunReport
+
+DEFAULT_ITEMS_PER_PROMPT = [1, 2, 4, 8, 16]
+
+
+def run_multi_item(
+    df: pd.DataFrame,
+    model_name: str,
+    model_loader: filter_dataset.ModelLoader,
+    items_per_prompt: List[int],
+    label_column: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Labels the same rows once per number of items per prompt and compares the labels with
+    the single-row labels and, if given, with reference labels.
+
+    Args:
+        df (pd.DataFrame): Rows with the text pairs.
+        model_name (str): Name of the model.
+        model_loader (filter_dataset.ModelLoader): Loader that holds the model across runs.
+        items_per_prompt (List[int]): Numbers of items per prompt to compare. Single-row
+            prompts are always run first as the baseline.
+        label_column (Optional[str], optional): Column of `df` with reference labels. Defaults
+            to None.
+
+    Returns:
+        List[Dict[str, Any]]: Results with one entry per number of items per prompt.
+    """
+    results = []
+    baseline = None
+
+    for k in sorted(set(items_per_prompt) | {1}):
+        report = RunReport("bench_multi_item", model_name)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = filter_dataset.generate_output(
+                model_name,
+                df[COLUMNS].copy(),
+                COLUMNS,
+                model_loader=model_loader,
+                report=report,
+                items_per_prompt=k,
+            )
+        elapsed = time.perf_counter() - start
+
+        labels = output[f"{model_name}_prediction"].to_numpy()
+        if baseline is None:
+            baseline = labels
+
+        counters = report.counters
+        results.append(
+            {
+                "items_per_prompt": k,
+                "wall_time": elapsed,
+                "rows_per_second": len(df) / elapsed if elapsed > 0 else float("inf"),
+                "prompt_tokens_per_row": counters.get("prompt_tokens", 0) / len(df),
+                "fallback_rows": counters.get("multi_item_fallback_rows", 0),
+                "agreement_with_single_row": float((labels == baseline).mean()),
+                "accuracy": (
+                    float((labels == df[label_column].to_numpy()).mean())
+                    if label_column is not None
+                    else None
+                ),
+            }
+        )
+
+    return results
+
+
+def main(args: argparse.Namespace) -> None:
+    # set in the __main__ block of filter_dataset.py
+    filter_dataset.USE_TQDM = False
+    ic.disable()
+
+    if args.input is not None:
+        df = pd.read_parquet(args.input).head(args.rows)
+    else:
+        df = make_dataset(args.rows)
+
+    with contextlib.ExitStack() as stack:
+        if args.backend == "stub":
+            # requests go through the OpenAI compatible backend, so the latency per request
+            # and the prompt tokens reported by the server are measured as for a real server
+            server = stack.enter_context(StubServer(latency=args.latency))
+            loader = filter_dataset.ModelLoader(
+                args.model_name, backend="openai", api_base=server.base_url, api_model="stub"
+            )
+        elif args.backend == "fake":
+            loader = FakeModelLoader(args.model_name, FakeModel(args.latency))
+        else:
+            loader = filter_dataset.ModelLoader(
+                args.model_name,
+                backend=args.backend,
+                api_base=args.api_base,
+                api_model=args.api_model,
+            )
+        stack.callback(loader.close)
+
+        results = run_multi_item(
+            df, args.model_name, loader, args.items_per_prompt, label_column=args.label_column
+        )
+
+    print(f"Multi-item prompts of {args.model_name} on {len(df)} rows:")
+    for result in results:
+        accuracy = result["accuracy"]
+        print(
+            f"K={result['items_per_prompt']:>3}: {result['rows_per_second']:>10,.1f} rows/s, "
+            f"{result['prompt_tokens_per_row']:>8,.1f} prompt tokens/row, "
+            f"agreement {result['agreement_with_single_row']:.1%}"
+            + (f", accuracy {accuracy:.1%}" if accuracy is not None else "")
+            + f", {result['fallback_rows']} fallback rows"
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "model_name": args.model_name,
+                "backend": args.backend,
+                "rows": len(df),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput and the labels of multi-item prompts per number of "
+        "items per prompt."
+    )
+    parser.add_argument("--model_name", type=str, default="gemma-2b", help="Model name.")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=["stub", "fake"] + filter_dataset.BACKENDS,
+        default="stub",
+        help="'stub' sends the requests to a local stub server, 'fake' calls a fake model "
+        "directly, 'vllm' and 'openai' label with the real model.",
+    )
+    parser.add_argument("--api_base", type=str, default=filter_dataset.API_BASE_URL)
+    parser.add_argument("--api_model", type=str, default=None)
+    parser.add_argument(
+        "--items_per_prompt",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ITEMS_PER_PROMPT,
+        help="Numbers of items per prompt to compare.",
+    )
+    parser.add_argument("--rows", type=int, default=1_000, help="Number of rows.")
+    parser.add_argument(
+        "--input",
+        type=str,
+        default=None,
+        help="Parquet file with before_revision and after_revision columns. Defaults to "
+        "synthetic revision pairs.",
+    )
+    parser.add_argument(
+        "--label_column",
+        type=str,
+        default=None,
+        help="Column of --input with reference labels for the accuracy.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated latency per request of the stub server or per prompt of the fake model.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./benchmarks/results/multi_item.json",
+        help="Path of the JSON results.",
+    )
+    main(parser.parse_args())
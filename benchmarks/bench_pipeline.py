@@ -0,0 +1,287 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from icecream import ic
+
+import add_labels_to_dataset
+import combine_labels
+import filter_dataset
+from benchmarks.bench_rules import make_pairs
+from src.backends import OpenAICompatibleBackend, to_request_output
+from src.checkpoint import CheckpointStore
+from src.settings import COMBINE_CHUNK_SIZE
+from src.stub_server import StubServer
+from src.telemetry import peak_rss_mb
+
+COLUMNS = ["before_revision", "after_revision"]
+DEFAULT_ROWS = [1_000, 10_000, 100_000]
+DEFAULT_MODELS = ["gemma-2b", "gemma-2-9b"]
+
+
+class FakeModel:
+    """Deterministic stand-in for `flex_infer.VLLM` that answers like the stub server and
+    sleeps `latency` seconds per prompt to simulate the GPU time."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    def generate(
+        self,
+        prompts: List[str],
+        generation_params: Any,
+        choices: Optional[List[str]] = None,
+        system_prompt: Optional[str] = None,
+        use_tqdm: bool = False,
+        return_type: str = "str",
+    ) -> List[Any]:
+        if self.latency:
+            time.sleep(self.latency * len(prompts))
+
+        logprobs = getattr(generation_params, "logprobs", None)
+        responses = [
+            StubServer.completion(
+                {
+                    "messages": [{"content": system_prompt or ""}, {"content": prompt}],
+                    "guided_choice": choices,
+                    "logprobs": bool(logprobs),
+                    "top_logprobs": logprobs or 0,
+                }
+            )
+            for prompt in prompts
+        ]
+
+        if return_type == "str":
+            return [response["choices"][0]["message"]["content"] for response in responses]
+        return [to_request_output(response) for response in responses]
+
+
+class FakeModelLoader(filter_dataset.ModelLoader):
+    """Model loader that returns the given model instead of loading one."""
+
+    def __init__(self, model_name: str, model: Any) -> None:
+        super().__init__(model_name)
+        self.model = model
+
+    def __call__(self) -> Any:
+        return self.model
+
+
+def make_dataset(num_rows: int, duplicate_ratio: float = 0.1, seed: int = 42) -> pd.DataFrame:
+    """Samples revision pairs from the prompt examples and makes all but `duplicate_ratio` of the
+    rows unique, so that duplicate collapsing does not hide the per-row cost."""
+    df = make_pairs(num_rows, seed=seed)
+
+    rng = np.random.default_rng(seed)
+    unique = rng.random(num_rows) >= duplicate_ratio
+    suffix = pd.Series(np.arange(num_rows), dtype="string").radd(" #")
+    df.loc[unique, "after_revision"] = df.loc[unique, "after_revision"] + suffix[unique]
+
+    return df
+
+
+def run_pipeline(
+    num_rows: int,
+    models: List[str],
+    latency: float = 0.0,
+    chunk_size: Optional[int] = None,
+    dedup: str = "exact",
+    http: bool = False,
+    work_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Runs filter, add_labels and combine for every model on a synthetic dataset and measures
+    the wall time, throughput and peak RSS of each stage.
+
+    Args:
+        num_rows (int): Number of rows of the synthetic dataset.
+        models (List[str]): Models to run in the given order.
+        latency (float, optional): Simulated model latency per prompt in seconds. Defaults to
+            0.0.
+        chunk_size (Optional[int], optional): Chunk size for streaming, None for the in-memory
+            path. Defaults to None.
+        dedup (str, optional): Duplicate collapsing mode. Defaults to "exact".
+        http (bool, optional): Send the requests to a local stub server through the OpenAI
+            compatible backend instead of calling the fake model directly. Defaults to False.
+        work_dir (Optional[str], optional): Directory for the data files. Defaults to a
+            temporary directory.
+
+    Returns:
+        Dict[str, Any]: Results with one entry per stage.
+    """
+    # set in the __main__ blocks of the scripts
+    filter_dataset.USE_TQDM = False
+    ic.disable()
+
+    cwd = os.getcwd()
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        for sub_dir in ["input", "output", "checkpoints"]:
+            os.makedirs(os.path.join(work_dir, "data", sub_dir), exist_ok=True)
+        os.chdir(work_dir)
+        stack.callback(os.chdir, cwd)
+
+        make_dataset(num_rows).to_parquet("./data/input/synthetic.parquet", index=False)
+
+        if http:
+            server = stack.enter_context(StubServer(latency=latency))
+
+        stages = []
+        for model_name in models:
+            if http:
+                model = OpenAICompatibleBackend(server.base_url, model_name)
+                stack.callback(model.close)
+            else:
+                model = FakeModel(latency)
+            loader = FakeModelLoader(model_name, model)
+            checkpoint = CheckpointStore(model_name, "benchmark", "./data/checkpoints")
+
+            def run_filter() -> None:
+                if chunk_size is not None:
+                    filter_dataset.generate_output_streaming(
+                        model_name,
+                        COLUMNS,
+                        chunk_size,
+                        checkpoint,
+                        dedup=dedup,
+                        model_loader=loader,
+                        read_columns=COLUMNS,
+                    )
+                else:
+                    df = filter_dataset.read_data(columns=COLUMNS)
+                    output = filter_dataset.generate_resumable_output(
+                        model_name, df, COLUMNS, checkpoint, dedup=dedup, model_loader=loader
+                    )
+                    filter_dataset.save_output(output, model_name)
+                checkpoint.clear()
+
+            stages.append(measure(f"filter:{model_name}", num_rows, run_filter))
+            stages.append(
+                measure(
+                    f"add_labels:{model_name}",
+                    num_rows,
+                    lambda: add_labels_to_dataset.main(argparse.Namespace(model_name=model_name)),
+                )
+            )
+
+        combine_args = argparse.Namespace(
+            policy="or",
+            weights=None,
+            threshold=0.5,
+            p_bad_threshold=None,
+            input="./data/input",
+            chunk_size=COMBINE_CHUNK_SIZE,
+        )
+        stages.append(measure("combine", num_rows, lambda: combine_labels.main(combine_args)))
+
+    return {
+        "rows": num_rows,
+        "models": models,
+        "latency": latency,
+        "chunk_size": chunk_size,
+        "dedup": dedup,
+        "http": http,
+        "wall_time": sum(stage["wall_time"] for stage in stages),
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in stages),
+        "stages": stages,
+    }
+
+
+def measure(name: str, num_rows: int, fn) -> Dict[str, Any]:
+    """Runs `fn` with the output of the scripts suppressed and measures it."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "stage": name,
+        "wall_time": elapsed,
+        "rows_per_second": num_rows / elapsed if elapsed > 0 else float("inf"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    models = args.models.split(",")
+    results = []
+
+    for num_rows in args.rows:
+        # a fresh process per size, so that the peak RSS is not carried over from larger runs
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(
+                run_pipeline,
+                num_rows,
+                models,
+                latency=args.latency,
+                chunk_size=args.chunk_size,
+                dedup=args.dedup,
+                http=args.http,
+            ).result()
+        results.append(result)
+
+        print(f"{num_rows:>10,} rows: {result['wall_time']:.2f}s, {result['peak_rss_mb']:.0f} MB")
+        for stage in result["stages"]:
+            print(
+                f"{stage['stage']:>24}: {stage['rows_per_second']:>14,.0f} rows/s "
+                f"({stage['wall_time']:.2f}s, {stage['peak_rss_mb']:.0f} MB)"
+            )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the filter, add_labels and combine pipeline with a fake model."
+    )
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Dataset sizes to benchmark."
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        default=",".join(DEFAULT_MODELS),
+        help="Comma separated models that are run in the given order.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated model latency per prompt."
+    )
+    parser.add_argument(
+        "--chunk_size", type=int, default=None, help="Stream the dataset in chunks of this size."
+    )
+    parser.add_argument("--dedup", type=str, choices=filter_dataset.DEDUP_MODES, default="exact")
+    parser.add_argument(
+        "--http",
+        action="store_true",
+        help="Send requests to a local stub server through the OpenAI compatible backend.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./benchmarks/results/pipeline.json",
+        help="Path of the JSON results.",
+    )
+    main(parser.parse_args())
@@ -0,0 +1,52 @@
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.bench_pipeline import make_dataset
+from filter_dataset import get_prompts, iter_prompts
+from src.prompt_components import CLASSIFY_PROMPT
+from src.settings import PROMPT_BATCH_SIZE
+from src.utils import batched
+
+COLUMNS = ["before_revision", "after_revision"]
+
+
+def measure(name: str, num_rows: int, fn) -> None:
+    """Prints the wall time and the peak of the memory allocated while running `fn`."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    num_prompts = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert num_prompts == num_rows
+    print(f"{name:>10}: {peak / 2**20:>10,.1f} MB peak, {num_rows / elapsed:>12,.0f} prompts/s")
+
+
+def main(args: argparse.Namespace) -> None:
+    df = make_dataset(args.rows)
+
+    def materialized() -> int:
+        return len(get_prompts(df, COLUMNS, CLASSIFY_PROMPT))
+
+    def lazy() -> int:
+        return sum(
+            len(window)
+            for window in batched(iter_prompts(df, COLUMNS, CLASSIFY_PROMPT), args.batch_size)
+        )
+
+    print(f"Building {args.rows} prompts of {len(CLASSIFY_PROMPT)} characters ...")
+    measure("list", args.rows, materialized)
+    measure("lazy", args.rows, lazy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the memory of a materialized prompt list with lazy prompt windows."
+    )
+    parser.add_argument("--rows", type=int, default=200_000, help="Number of rows.")
+    parser.add_argument(
+        "--batch_size", type=int, default=PROMPT_BATCH_SIZE, help="Prompts per window."
+    )
+    main(parser.parse_args())
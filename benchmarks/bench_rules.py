@@ -0,0 +1,70 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.rules import RULES, apply_rules, to_string_array
+
+EXAMPLE_PAIRS = [
+    (
+        "The space betweend the planets is vast. Th distance can be million miles.",
+        "The space between the planets is vast. The distance can be millions of miles.",
+    ),
+    (
+        "In space, no sounds can heard. Because thers no aire for the sound waves.",
+        "In space no heard, because no sound. Sound waves.",
+    ),
+    (
+        "In at , , defeated the Netherlands to win the , and was defeated by the Netherlands.",
+        "on Sundayon SaturdayIn at , , defeated the Netherlands to win the , and was defeated.",
+    ),
+    (
+        "Yesterday, football club (BVB) sacked manager .",
+        "File photo of Peter Stöger in 2011Yesterday, football club (BVB) sacked manager .",
+    ),
+    (
+        "Due to lack of playing time , he moved to Portuguese club .",
+        "With limited playing time with Barcelona , he moved to Portuguese club .",
+    ),
+    ("(GEO New GO GO GO ------C.J !", "(GEO News) GO GO GO ------C.J !"),
+]
+
+
+def make_pairs(num_rows: int, seed: int = 42) -> pd.DataFrame:
+    """Samples revision pairs from the examples of the classification prompt."""
+    rng = np.random.default_rng(seed)
+    choice = rng.integers(0, len(EXAMPLE_PAIRS), size=num_rows)
+    before, after = zip(*EXAMPLE_PAIRS)
+
+    return pd.DataFrame(
+        {
+            "before_revision": np.array(before, dtype=object)[choice],
+            "after_revision": np.array(after, dtype=object)[choice],
+        }
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    df = make_pairs(args.rows)
+    columns = ["before_revision", "after_revision"]
+    before = to_string_array(df[columns[0]])
+    after = to_string_array(df[columns[1]])
+
+    print(f"Benchmarking pre-filter rules on {args.rows} rows ...")
+    for rule in RULES.values():
+        start = time.perf_counter()
+        matched = rule.matches(before, after).sum()
+        elapsed = time.perf_counter() - start
+        print(f"{rule.name:>18}: {args.rows / elapsed:>14,.0f} rows/s ({matched} matched)")
+
+    start = time.perf_counter()
+    decided = apply_rules(df, columns, list(RULES.values())).notna().sum()
+    elapsed = time.perf_counter() - start
+    print(f"{'all rules':>18}: {args.rows / elapsed:>14,.0f} rows/s ({decided} decided)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pre-filter rules on CPU.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of rows.")
+    main(parser.parse_args())
@@ -1,7 +1,25 @@
+import argparse
 import os
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.label_store import (
+    LABELS,
+    PREDICTION_SUFFIX,
+    PROBABILITY_SUFFIX,
+    LabelStore,
+    label_mask,
+)
+from src.settings import COMBINE_CHUNK_SIZE, ROW_ID_COLUMN
+from src.telemetry import RunReport
+from src.utils import ParquetAppender, iter_data
+
+POLICIES = ["or", "majority", "weighted"]
 
 
 def load_labeled_data(file_path: str = "data/output/labeled_dataset.parquet") -> pd.DataFrame:
@@ -26,7 +44,8 @@ def load_labeled_data(file_path: str = "data/output/labeled_dataset.parquet") ->
 
 def find_label_columns(df: pd.DataFrame) -> List[str]:
     """
-    Identifies the columns in the DataFrame that contain labels ("good" or "bad") in the first row.
+    Identifies the columns in the DataFrame that contain labels ("good" or "bad") in their first
+    non-missing value. Models of an ensemble leave rows that were already labeled as bad empty.
 
     Args:
         df (pd.DataFrame): The input DataFrame with data.
@@ -35,37 +54,281 @@ def find_label_columns(df: pd.DataFrame) -> List[str]:
         ValueError: If the DataFrame is empty.
 
     Returns:
-        List[str]: A list of column names where the first row contains "good" or "bad".
+        List[str]: A list of column names where the first value contains "good" or "bad".
     """
     if len(df) == 0:
         raise ValueError("No data found in the dataset.")
 
     labels = ["good", "bad"]
-    first_row = df.iloc[0]
 
     columns = []
     for col in df.columns:
-        if first_row[col] in labels:
+        first_valid = df[col].first_valid_index()
+        if first_valid is not None and df.at[first_valid, col] in labels:
             columns.append(col)
 
     return columns
 
 
-def main() -> None:
-    dataset = load_labeled_data()
+def parse_weights(value: Optional[str]) -> Dict[str, float]:
+    """Parses model weights of the form "model_a=2,model_b=0.5".
+
+    Args:
+        value (Optional[str]): Comma separated model=weight pairs.
+
+    Raises:
+        ValueError: If a pair is malformed.
+
+    Returns:
+        Dict[str, float]: Weight per model name.
+    """
+    if not value:
+        return {}
+
+    weights = {}
+    for pair in value.split(","):
+        model_name, _, weight = pair.partition("=")
+        if not model_name or not weight:
+            raise ValueError(f"Invalid weight {pair}, expected <model_name>=<weight>")
+        weights[model_name.strip()] = float(weight)
+
+    return weights
+
+
+def probability_column(label_column: str) -> str:
+    return label_column[: -len(PREDICTION_SUFFIX)] + PROBABILITY_SUFFIX
+
+
+def count_votes(
+    labels: pa.Table,
+    label_columns: List[str],
+    weights: Optional[Dict[str, float]] = None,
+    p_bad_threshold: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Counts the (weighted) bad votes and all votes per row. Missing labels are not counted.
+
+    Args:
+        labels (pa.Table): Table with the label columns.
+        label_columns (List[str]): Prediction columns, named `<model_name>_prediction`.
+        weights (Optional[Dict[str, float]], optional): Weight per model name, 1 by default.
+            Defaults to None.
+        p_bad_threshold (Optional[float], optional): Models that were run in scoring mode vote
+            bad if their probability of the bad label is at least this threshold, instead of
+            using their label. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Bad votes and all votes per row.
+    """
+    weights = weights or {}
+    bad_votes = np.zeros(labels.num_rows)
+    votes = np.zeros(labels.num_rows)
+
+    for column in label_columns:
+        weight = weights.get(column[: -len(PREDICTION_SUFFIX)], 1.0)
+        values = labels[column]
+        if p_bad_threshold is not None and probability_column(column) in labels.column_names:
+            p_bad = labels[probability_column(column)]
+            is_bad = pc.fill_null(pc.greater_equal(p_bad, p_bad_threshold), False)
+            is_bad = is_bad.to_numpy(zero_copy_only=False)
+        else:
+            # dictionary encoded labels are compared on their codes
+            is_bad = label_mask(values, "bad")
+        bad_votes += weight * is_bad
+        votes += weight * pc.is_valid(values).to_numpy(zero_copy_only=False)
+
+    return bad_votes, votes
+
+
+def vote(
+    bad_votes: np.ndarray, votes: np.ndarray, policy: str = "or", threshold: float = 0.5
+) -> np.ndarray:
+    """Decides which rows are bad.
+
+    Args:
+        bad_votes (np.ndarray): (Weighted) bad votes per row.
+        votes (np.ndarray): (Weighted) votes per row.
+        policy (str, optional): "or" labels a row as bad if any model labeled it as bad,
+            "majority" and "weighted" if the bad votes are at least `threshold` of all votes.
+            Defaults to "or".
+        threshold (float, optional): Share of the votes needed for bad. Defaults to 0.5.
+
+    Raises:
+        ValueError: If the policy is not supported.
+
+    Returns:
+        np.ndarray: Boolean mask of the bad rows.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Policy {policy} not supported.")
+
+    if policy == "or":
+        return bad_votes > 0
+
+    return (bad_votes > 0) & (bad_votes >= threshold * votes)
+
+
+def iter_labeled_chunks(
+    chunk_size: int,
+    label_store: LabelStore,
+    path: str = "data/output/labeled_dataset.parquet",
+    with_probabilities: bool = False,
+    input_path: str = "./data/input",
+) -> Tuple[List[str], Iterator[Tuple[pd.DataFrame, pa.Table]]]:
+    """Streams the dataset together with the prediction columns of all models.
+
+    The prediction columns are taken from the metadata of the label store. Without stored
+    labels, the labeled dataset at `path` is read and its `*_prediction` columns are used.
+
+    Args:
+        chunk_size (int): Number of rows per chunk.
+        label_store (LabelStore): Store with the labels of all models.
+        path (str, optional): Path of the labeled dataset without label store. Defaults to
+            "data/output/labeled_dataset.parquet".
+        with_probabilities (bool, optional): Also read the probability columns of the models
+            that were run in scoring mode. Defaults to False.
+        input_path (str, optional): Path of a dataset file, a directory or a glob pattern.
+            Defaults to "./data/input".
+
+    Raises:
+        FileNotFoundError: If there are neither stored labels nor a labeled dataset.
+
+    Returns:
+        Tuple[List[str], Iterator[Tuple[pd.DataFrame, pa.Table]]]: The prediction columns and
+            an iterator over the data of each chunk and its labels.
+    """
+    if label_store.models():
+        label_columns = label_store.prediction_columns()
+        read_columns = list(label_columns)
+        if with_probabilities:
+            stored = set(label_store.label_columns())
+            read_columns += [
+                probability_column(column)
+                for column in label_columns
+                if probability_column(column) in stored
+            ]
+
+        def chunks() -> Iterator[Tuple[pd.DataFrame, pa.Table]]:
+            for chunk in iter_data(chunk_size, input_path):
+                row_ids = chunk[ROW_ID_COLUMN].to_numpy()
+                yield chunk, label_store.read_table(read_columns, row_ids)
+
+        return label_columns, chunks()
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No dataset found at {path}")
+
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    label_columns = [name for name in names if name.endswith(PREDICTION_SUFFIX)]
+    data_columns = [name for name in names if name not in label_columns]
+    read_columns = list(label_columns)
+    if with_probabilities:
+        read_columns += [
+            probability_column(column)
+            for column in label_columns
+            if probability_column(column) in names
+        ]
+
+    def legacy_chunks() -> Iterator[Tuple[pd.DataFrame, pa.Table]]:
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            table = pa.Table.from_batches([batch])
+            yield table.select(data_columns).to_pandas(), table.select(read_columns)
+
+    return label_columns, legacy_chunks()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Simple argument parser for the script."""
+    parser = argparse.ArgumentParser(
+        description="Combines the labels of all models into a quality label and writes the "
+        "combined and the filtered dataset."
+    )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        choices=POLICIES,
+        default="or",
+        help="How the labels are combined: bad if any model says bad (or), if at least "
+        "--threshold of the models say bad (majority) or of their --weights (weighted).",
+    )
+    parser.add_argument(
+        "--weights",
+        type=str,
+        default=None,
+        help="Model weights for the weighted policy, e.g. gemma-2b=1,gemma-2-27b=2. Models "
+        "without a weight have weight 1.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="Share of the (weighted) votes needed to label a row as bad.",
+    )
+    parser.add_argument(
+        "--p_bad_threshold",
+        type=float,
+        default=None,
+        help="Models that were run with --scoring vote bad if their probability of the bad "
+        "label is at least this threshold, instead of using their label.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=str,
+        default="./data/input",
+        help="Dataset file, directory or glob pattern of the labeled input dataset.",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=COMBINE_CHUNK_SIZE,
+        help="Number of rows that are combined and written at once.",
+    )
+
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    report = RunReport("combine_labels")
+    weights = parse_weights(args.weights) if args.policy == "weighted" else {}
+    label_columns, chunks = iter_labeled_chunks(
+        args.chunk_size,
+        LabelStore(),
+        with_probabilities=args.p_bad_threshold is not None,
+        input_path=args.input,
+    )
+    print(f"Combining {', '.join(label_columns)} with the {args.policy} policy ...")
+
+    counts = {"good": 0, "bad": 0}
+    with (
+        ParquetAppender("data/output/combined_dataset.parquet") as combined,
+        ParquetAppender("data/output/filtered_dataset.parquet") as filtered,
+    ):
+        for chunk, labels in report.timed("data_load", chunks):
+            with report.stage("vote"):
+                bad_votes, votes = count_votes(labels, label_columns, weights, args.p_bad_threshold)
+                is_bad = vote(bad_votes, votes, args.policy, args.threshold)
 
-    label_columns = find_label_columns(dataset)
+            with report.stage("save"):
+                filtered.write(chunk[~is_bad])
+                chunk["quality_label"] = pd.Categorical.from_codes(
+                    is_bad.astype(np.int8), categories=LABELS
+                )
+                combined.write(chunk)
+            report.advance(len(chunk))
 
-    # create a mask where any column in label_columns contains 'bad'
-    bad_mask = dataset[label_columns].eq("bad").any(axis=1)
-    final_label = ["bad" if is_bad else "good" for is_bad in bad_mask]
+            counts["bad"] += int(is_bad.sum())
+            counts["good"] += int((~is_bad).sum())
 
-    dataset["quality_label"] = final_label
-    dataset.drop(columns=label_columns, inplace=True)
+    print("Quality labels", counts)
+    print("Saved data/output/combined_dataset.parquet and data/output/filtered_dataset.parquet")
 
-    dataset.to_parquet("data/output/combined_dataset.parquet")
+    report.count("good", counts["good"])
+    report.count("bad", counts["bad"])
+    report.save("data/output/run_report_combine.json")
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_arguments()
+    main(args)
     print("Done.")
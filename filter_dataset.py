@@ -1,38 +1,101 @@
 import argparse
+import json
 import os
-from typing import List
+from contextlib import closing
+from functools import partial
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from flex_infer import VLLM, GenerationParams
 from icecream import ic
 
+from src import prompt_components
+from src.cache import PredictionCache, config_fingerprint, prediction_key
+from src.checkpoint import CheckpointStore, run_fingerprint
+from src.confidence import CascadeStage, bad_probability, label_margins, score_choices
+from src.dedup import DEDUP_MODES, collapse_duplicates, pair_fingerprints
+from src.distill import DistillStage
+from src.guide_cache import GuideCache, guide_key, tokenizer_fingerprint
+from src.label_store import PROBABILITY_SUFFIX, LabelStore, encode_labels
+from src.multi_item import build_prompt, label_choices, parse_labels, split_items
+from src.pipeline import SerialExecutor, prefetch
 from src.prompt_components import CLASSIFY_PROMPT, SYSTEM_PROMPT
-from src.settings import MAX_TOKENS, RANDOM_SEED
+from src.rules import DEFAULT_RULES, Rule, apply_rules, get_rules
+from src.telemetry import RunReport, count_output_tokens
+from src.sharding import remove_shard, shard_mask, shard_path, write_manifest
+from src.settings import (
+    API_BASE_URL,
+    API_MAX_CONCURRENCY,
+    CASCADE_MARGIN_THRESHOLD,
+    CHECKPOINT_INTERVAL,
+    DISTILL_CONFIDENCE_THRESHOLD,
+    DISTILL_SAMPLE_SIZE,
+    DRY_RUN_PROMPT_TOKENS_PER_SECOND,
+    MAX_TOKENS,
+    MULTI_ITEM_MAX_GUIDED_ITEMS,
+    MULTI_ITEM_TOKENS_PER_ITEM,
+    NUM_LOGPROBS,
+    PIPELINE_DEPTH,
+    PREDICTION_CACHE_MAX_ENTRIES,
+    PREDICTION_CACHE_PATH,
+    PROMPT_BATCH_SIZE,
+    RANDOM_SEED,
+    ROW_ID_COLUMN,
+    SCORING_MAX_TOKENS,
+    SPOOL_DIR,
+    WORKER_CHUNK_SIZE,
+    WORKER_POLL_INTERVAL,
+)
+from src.token_lengths import (
+    LENGTH_POLICIES,
+    LengthPolicy,
+    count_tokens,
+    get_max_model_len,
+    load_tokenizer,
+    text_token_budget,
+)
 from src.utils import (
+    ParquetAppender,
+    batched,
     clean_up,
+    Filter,
+    count_rows,
+    iter_data,
+    parse_filter,
     read_data,
     save_output,
 )
+from src.worker import run_worker
 
+# flex_infer imports vLLM and torch, so it is only imported once a model is loaded
+if TYPE_CHECKING:
+    from flex_infer import VLLM
 
-def load_model(model_name: str, seed: int = 42) -> VLLM:
-    """Load the specified model with optional seed.
+    from src.backends import GenerationSettings, OpenAICompatibleBackend, VLLMBackend
+
+ANSWER_CHOICES = ["good", "bad"]
+# prompts of a window of rows and their prediction cache keys, None without cache
+PromptWindow = Tuple[List[str], Optional[List[str]]]
+BACKENDS = ["vllm", "openai"]
+
+
+def get_model_settings(model_name: str, seed: int = 42) -> Dict[str, Any]:
+    """Get the settings used to load the specified model.
 
     Args:
-        model_name (str): Name of the model to load.
+        model_name (str): Name of the model.
         seed (int, optional): Random seed for reproducibility. Defaults to 42.
 
     Raises:
         ValueError: If the model name is not supported.
 
     Returns:
-        VLLM: Loaded model instance.
+        Dict[str, Any]: Keyword arguments for the VLLM constructor.
     """
-    print(f"Loading model {model_name} ...")
     model_settings = {
         "seed": seed,
         "quant": None,
-        "max_logprobs": 4,
+        "max_logprobs": NUM_LOGPROBS,
         "num_gpus": 1,
     }
 
@@ -69,9 +132,468 @@ def load_model(model_name: str, seed: int = 42) -> VLLM:
     else:
         raise ValueError(f"Model {model_name} not supported.")
 
+    return model_settings
+
+
+def load_model(model_name: str, seed: int = 42) -> "VLLM":
+    """Load the specified model with optional seed.
+
+    Args:
+        model_name (str): Name of the model to load.
+        seed (int, optional): Random seed for reproducibility. Defaults to 42.
+
+    Raises:
+        ValueError: If the model name is not supported.
+
+    Returns:
+        VLLM: Loaded model instance.
+    """
+    from flex_infer import VLLM
+
+    model_settings = get_model_settings(model_name, seed=seed)
+
+    print(f"Loading model {model_name} ...")
     return VLLM(**model_settings)
 
 
+def get_max_tokens(scoring: bool = False, items_per_prompt: int = 1) -> int:
+    """Maximal number of generated tokens for a prompt with `items_per_prompt` text pairs."""
+    if scoring:
+        return SCORING_MAX_TOKENS
+    return max(MAX_TOKENS, MULTI_ITEM_TOKENS_PER_ITEM * items_per_prompt)
+
+
+def get_generation_params(
+    temp: float = 0.0, with_margins: bool = False, scoring: bool = False, items_per_prompt: int = 1
+) -> "GenerationSettings":
+    """Create the generation parameters for labeling. They do not depend on the backend, so
+    neither flex_infer nor vLLM is needed to create them.
+
+    Args:
+        temp (float, optional): Temperature for generation. Defaults to 0.0.
+        with_margins (bool, optional): Request the logprobs needed for the label margins.
+            Defaults to False.
+        scoring (bool, optional): Generate a single token with logprobs, see `score_choices`.
+            Defaults to False.
+        items_per_prompt (int, optional): Number of text pairs per prompt, see
+            `generate_multi_item`. Defaults to 1.
+
+    Returns:
+        GenerationSettings: Generation parameters.
+    """
+    from src.backends import GenerationSettings
+
+    return GenerationSettings(
+        temperature=temp,
+        seed=RANDOM_SEED,
+        max_tokens=get_max_tokens(scoring, items_per_prompt),
+        logprobs=NUM_LOGPROBS if with_margins or scoring else None,
+    )
+
+
+def load_api_backend(
+    model_name: str,
+    base_url: str = API_BASE_URL,
+    api_model: Optional[str] = None,
+    max_concurrency: int = API_MAX_CONCURRENCY,
+) -> "OpenAICompatibleBackend":
+    """Connect to an OpenAI compatible server that serves the specified model.
+
+    Args:
+        model_name (str): Name of the model, used to look up its prompt format.
+        base_url (str, optional): Base URL of the API. Defaults to API_BASE_URL.
+        api_model (Optional[str], optional): Name of the model on the server. Defaults to the
+            model path from the model settings.
+        max_concurrency (int, optional): Maximum number of requests in flight. Defaults to
+            API_MAX_CONCURRENCY.
+
+    Returns:
+        OpenAICompatibleBackend: Backend with the same `generate` interface as VLLM.
+    """
+    from src.backends import OpenAICompatibleBackend
+
+    model_settings = get_model_settings(model_name)
+
+    print(f"Connecting to {base_url} for model {model_name} ...")
+    return OpenAICompatibleBackend(
+        base_url,
+        api_model or model_settings["model_path"],
+        max_concurrency=max_concurrency,
+        merge_system_prompt=model_settings["prompt_format"] == "gemma",
+    )
+
+
+class ModelLoader:
+    """Loads a model on first use and returns the same instance afterwards, so that runs in which
+    every prediction is already known never load the model.
+
+    Args:
+        model_name (str): Name of the model to load.
+        seed (int, optional): Random seed for reproducibility. Defaults to RANDOM_SEED.
+        backend (str, optional): "vllm" to load the model locally or "openai" to send requests
+            to an OpenAI compatible server. Defaults to "vllm".
+        api_base (str, optional): Base URL of the API for the "openai" backend. Defaults to
+            API_BASE_URL.
+        api_model (Optional[str], optional): Name of the model on the server. Defaults to None.
+        max_concurrency (int, optional): Maximum number of requests in flight for the "openai"
+            backend. Defaults to API_MAX_CONCURRENCY.
+        guide_cache (Optional[GuideCache], optional): Persistent cache for the compiled guides
+            of the "vllm" backend. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        seed: int = RANDOM_SEED,
+        backend: str = "vllm",
+        api_base: str = API_BASE_URL,
+        api_model: Optional[str] = None,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        guide_cache: Optional[GuideCache] = None,
+    ) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend {backend} not supported.")
+
+        self.model_name = model_name
+        self.seed = seed
+        self.backend = backend
+        self.api_base = api_base
+        self.api_model = api_model
+        self.max_concurrency = max_concurrency
+        self.guide_cache = guide_cache
+        self._model: Optional[Union["VLLMBackend", "OpenAICompatibleBackend"]] = None
+        self._guide_key: Optional[str] = None
+
+    def __call__(self) -> Union["VLLMBackend", "OpenAICompatibleBackend"]:
+        if self._model is None:
+            if self.backend == "openai":
+                self._model = load_api_backend(
+                    self.model_name, self.api_base, self.api_model, self.max_concurrency
+                )
+            else:
+                if self.guide_cache is not None:
+                    self._use_guide_cache()
+                from src.backends import VLLMBackend
+
+                self._model = VLLMBackend(load_model(self.model_name, seed=self.seed))
+        return self._model
+
+    def _use_guide_cache(self) -> None:
+        # outlines reads the cache directory when it is imported, i.e. with the model. There is
+        # one entry per tokenizer: outlines keys every compiled guide by its choices within the
+        # directory, so the guides of the single labels and of all multi-item prompt sizes
+        # share the entry
+        model_path = get_model_settings(self.model_name)["model_path"]
+        self._guide_key = guide_key(tokenizer_fingerprint(model_path))
+        cache_dir = self.guide_cache.acquire(self._guide_key, {"model_name": self.model_name})
+        os.environ["OUTLINES_CACHE_DIR"] = cache_dir
+        print(f"Using guide cache directory: {cache_dir}")
+
+    def close(self) -> None:
+        """Closes the connections of the "openai" backend if it was used and releases the guide
+        cache entry of the "vllm" backend."""
+        if self.backend == "openai" and self._model is not None:
+            self._model.close()
+            self._model = None
+        if self._guide_key is not None:
+            self.guide_cache.release(self._guide_key)
+            self._guide_key = None
+
+
+def select_shard(df: pd.DataFrame, num_shards: int, shard_index: int) -> pd.DataFrame:
+    """Keeps the rows of the given shard of a DataFrame with row ids.
+
+    Args:
+        df (pd.DataFrame): DataFrame with a row id column.
+        num_shards (int): Total number of shards.
+        shard_index (int): Index of the shard, see `shard_mask`.
+
+    Returns:
+        pd.DataFrame: Rows of the shard in their original order.
+    """
+    if num_shards == 1:
+        return df
+
+    mask = shard_mask(df[ROW_ID_COLUMN].to_numpy(), num_shards, shard_index)
+    return df[mask].reset_index(drop=True)
+
+
+def get_run_settings(
+    with_margins: bool = False,
+    scoring: bool = False,
+    items_per_prompt: int = 1,
+    dedup: str = "exact",
+) -> Dict[str, Any]:
+    """Settings besides the prompt that change the outputs of a run, for the run fingerprint.
+    Default values are left out, so that runs with the default settings keep their fingerprint.
+
+    Args:
+        with_margins (bool, optional): Whether a margin column is stored, e.g. also for a
+            cascade. Defaults to False.
+        scoring (bool, optional): Whether the labels are scored from a single token. Defaults
+            to False.
+        items_per_prompt (int, optional): Number of text pairs per prompt. Defaults to 1.
+        dedup (str, optional): Duplicate collapsing mode. Defaults to "exact".
+
+    Returns:
+        Dict[str, Any]: The settings that differ from the defaults.
+    """
+    settings = {
+        "with_margins": with_margins,
+        "scoring": scoring,
+        "items_per_prompt": items_per_prompt,
+        "dedup": dedup,
+    }
+    defaults = {"with_margins": False, "scoring": False, "items_per_prompt": 1, "dedup": "exact"}
+
+    return {key: value for key, value in settings.items() if value != defaults[key]}
+
+
+def get_run_metadata(
+    model_name: str, template: str, settings: Optional[Dict[str, Any]] = None
+) -> Dict[str, str]:
+    """Metadata of a run that is stored with its labels, see `src.label_store.run_metadata`.
+
+    Args:
+        model_name (str): Name of the model.
+        template (str): Prompt template.
+        settings (Optional[Dict[str, Any]], optional): Settings of the run, see
+            `get_run_settings`. Defaults to None.
+
+    Returns:
+        Dict[str, str]: Model name, prompt template and run fingerprint.
+    """
+    return {
+        "model_name": model_name,
+        "template": template,
+        "fingerprint": run_fingerprint(
+            model_name, template, SYSTEM_PROMPT, RANDOM_SEED, settings=settings
+        ),
+    }
+
+
+def get_cache_fingerprint(
+    model_name: str, temp: float = 0.0, scoring: bool = False, items_per_prompt: int = 1
+) -> str:
+    """Fingerprint of everything besides the prompt that determines a prediction.
+
+    Args:
+        model_name (str): Name of the model.
+        temp (float, optional): Temperature for generation. Defaults to 0.0.
+        scoring (bool, optional): Whether the labels are scored from a single token. Defaults
+            to False.
+        items_per_prompt (int, optional): Number of text pairs per prompt, since the label of
+            a pair depends on the other pairs of its prompt. Defaults to 1.
+
+    Returns:
+        str: Configuration fingerprint for the prediction cache.
+    """
+    config = {
+        "model_settings": get_model_settings(model_name, seed=RANDOM_SEED),
+        "system_prompt": SYSTEM_PROMPT,
+        "generation_params": {
+            "temperature": temp,
+            "seed": RANDOM_SEED,
+            "max_tokens": SCORING_MAX_TOKENS if scoring else MAX_TOKENS,
+        },
+        "choices": ANSWER_CHOICES,
+    }
+    # single-row prompts keep the fingerprint of earlier runs
+    if items_per_prompt > 1:
+        config["items_per_prompt"] = items_per_prompt
+
+    return config_fingerprint(config)
+
+
+def get_length_policy(model_name: str, template: str, policy: str) -> LengthPolicy:
+    """Create a length policy with the tokenizer and context length of the specified model.
+
+    Args:
+        model_name (str): Name of the model.
+        template (str): Prompt template.
+        policy (str): "truncate" or "skip", see `LengthPolicy`.
+
+    Returns:
+        LengthPolicy: Length policy for the model.
+    """
+    model_settings = get_model_settings(model_name, seed=RANDOM_SEED)
+    tokenizer = load_tokenizer(model_settings["model_path"])
+    max_model_len = get_max_model_len(model_settings)
+    max_text_tokens = text_token_budget(
+        tokenizer, template, SYSTEM_PROMPT, max_model_len, MAX_TOKENS
+    )
+
+    return LengthPolicy(tokenizer, max_text_tokens, policy=policy, max_model_len=max_model_len)
+
+
+def estimate_prompt_tokens_per_second(
+    model_name: str, path: str = "./data/run_report_filter_{}.json"
+) -> Tuple[float, str]:
+    """Estimates the prompt throughput of a model from the run report of its last run.
+
+    Args:
+        model_name (str): Name of the model.
+        path (str, optional): File path template of the run report. Defaults to
+            "./data/run_report_filter_{}.json".
+
+    Returns:
+        Tuple[float, str]: Prompt tokens per second of generation time and the source of the
+            estimate, the report path or "default".
+    """
+    report_path = path.format(model_name)
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+        prompt_tokens = report.get("counters", {}).get("prompt_tokens", 0)
+        generation_time = report.get("stages", {}).get("generation", {}).get("seconds", 0.0)
+        if prompt_tokens and generation_time:
+            return prompt_tokens / generation_time, report_path
+
+    return float(DRY_RUN_PROMPT_TOKENS_PER_SECOND), "default"
+
+
+def dry_run(
+    model_name: str,
+    columns_to_use: List[str],
+    template: str,
+    chunk_size: Optional[int] = None,
+    dedup: str = "exact",
+    rules: Optional[List[Rule]] = None,
+    skip_row_ids: Optional[np.ndarray] = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    tokenizer: Optional[Any] = None,
+    max_model_len: Optional[int] = None,
+    input_path: str = "./data/input",
+    filters: Optional[List[Filter]] = None,
+    path: str = "./data/dry_run_{}.json",
+) -> Dict[str, Any]:
+    """Plans a run without loading the model. The dataset is read and the rows the run would
+    label are tokenized with the tokenizer of the model to report the prefill tokens, the rows
+    that exceed the context and the estimated runtime.
+
+    The prompt tokens of a row are the tokens of its two texts plus the tokens of the empty
+    template and the system prompt.
+
+    Args:
+        model_name (str): Name of the model.
+        columns_to_use (List[str]): Columns to use for generating prompts.
+        template (str): Template for generating prompts.
+        chunk_size (Optional[int], optional): Read the dataset in chunks of this size. Defaults
+            to None.
+        dedup (str, optional): Duplicate collapsing mode, see `collapse_duplicates`. Defaults to
+            "exact".
+        rules (Optional[List[Rule]], optional): Pre-filter rules. Defaults to None.
+        skip_row_ids (Optional[np.ndarray], optional): Row ids that are not labeled. Defaults to
+            None.
+        num_shards (int, optional): Total number of shards. Defaults to 1.
+        shard_index (int, optional): Index of the shard to plan. Defaults to 0.
+        tokenizer (Optional[Any], optional): Tokenizer of the model. Defaults to the tokenizer
+            loaded from the model path.
+        max_model_len (Optional[int], optional): Context length of the model. Defaults to the
+            context length in the model settings or config.
+        input_path (str, optional): Path of a dataset file, a directory or a glob pattern.
+            Defaults to "./data/input".
+        filters (Optional[List[Filter]], optional): Only rows that match all filters are
+            planned. Defaults to None.
+        path (str, optional): File path template for the plan. Defaults to
+            "./data/dry_run_{}.json".
+
+    Returns:
+        Dict[str, Any]: The plan.
+    """
+    model_settings = get_model_settings(model_name, seed=RANDOM_SEED)
+    if tokenizer is None:
+        tokenizer = load_tokenizer(model_settings["model_path"])
+    if max_model_len is None:
+        max_model_len = get_max_model_len(model_settings)
+
+    fixed_tokens = int(count_tokens(tokenizer, [template.format("", ""), SYSTEM_PROMPT]).sum())
+    max_text_tokens = text_token_budget(
+        tokenizer, template, SYSTEM_PROMPT, max_model_len, MAX_TOKENS
+    )
+
+    chunks = (
+        iter_data(chunk_size, input_path, columns_to_use, filters)
+        if chunk_size is not None
+        else [read_data(input_path, columns_to_use, filters)]
+    )
+    counters = dict.fromkeys(
+        ["rows", "decided_by_rules", "skipped", "duplicates", "rows_to_label", "over_length"], 0
+    )
+    prefill_tokens, max_prompt_tokens = 0, 0
+    seen = np.array([], dtype=np.uint64)
+
+    for chunk in chunks:
+        chunk = select_shard(chunk, num_shards, shard_index)
+        counters["rows"] += len(chunk)
+
+        if rules:
+            decided = apply_rules(chunk, columns_to_use, rules).notna().to_numpy()
+            counters["decided_by_rules"] += int(decided.sum())
+            chunk = chunk[~decided]
+        if skip_row_ids is not None:
+            skipped = chunk[ROW_ID_COLUMN].isin(skip_row_ids).to_numpy()
+            counters["skipped"] += int(skipped.sum())
+            chunk = chunk[~skipped]
+
+        if dedup != "none" and len(chunk):
+            # duplicates are collapsed across chunks, as the prediction cache would in a run
+            fingerprints = pair_fingerprints(chunk, columns_to_use, dedup == "normalized")
+            _, first_positions = np.unique(fingerprints, return_index=True)
+            first_positions = np.sort(first_positions)
+            new = ~np.isin(fingerprints[first_positions], seen)
+            unique_positions = first_positions[new]
+            seen = np.union1d(seen, fingerprints[unique_positions])
+            counters["duplicates"] += len(chunk) - len(unique_positions)
+            chunk = chunk.iloc[unique_positions]
+
+        if dedup == "near" and len(chunk):
+            # near duplicates are only collapsed within a chunk, as in a run
+            unique_chunk, _ = collapse_duplicates(chunk, columns_to_use, mode=dedup)
+            counters["duplicates"] += len(chunk) - len(unique_chunk)
+            chunk = unique_chunk
+
+        before, after = columns_to_use
+        text_tokens = count_tokens(
+            tokenizer, chunk[before].fillna("").astype(str).tolist()
+        ) + count_tokens(tokenizer, chunk[after].fillna("").astype(str).tolist())
+
+        counters["rows_to_label"] += len(chunk)
+        counters["over_length"] += int((text_tokens > max_text_tokens).sum())
+        prefill_tokens += int(text_tokens.sum()) + fixed_tokens * len(chunk)
+        if len(chunk):
+            max_prompt_tokens = max(max_prompt_tokens, int(text_tokens.max()) + fixed_tokens)
+
+    tokens_per_second, estimate_source = estimate_prompt_tokens_per_second(model_name)
+
+    plan = {
+        "model_name": model_name,
+        "num_shards": num_shards,
+        "shard_index": shard_index,
+        **counters,
+        "prefill_tokens": prefill_tokens,
+        "max_prompt_tokens": max_prompt_tokens,
+        "max_model_len": max_model_len,
+        "max_text_tokens": max_text_tokens,
+        "prompt_tokens_per_second": tokens_per_second,
+        "estimate_source": estimate_source,
+        "estimated_seconds": prefill_tokens / tokens_per_second,
+    }
+
+    print(f"Dry run of {model_name}:")
+    for key, value in plan.items():
+        print(f"  {key}: {value}")
+
+    plan_path = path.format(model_name)
+    os.makedirs(os.path.dirname(plan_path) or ".", exist_ok=True)
+    with open(plan_path, "w") as f:
+        json.dump(plan, f, indent=2)
+    print(f"Saved dry run to {plan_path}")
+
+    return plan
+
+
 def parse_arguments() -> argparse.Namespace:
     """Simple argument parser for the script."""
     parser = argparse.ArgumentParser(
@@ -84,6 +606,232 @@ def parse_arguments() -> argparse.Namespace:
         required=True,
         help="The model name. It is required to run the experiment and to save the data.",
     )
+    parser.add_argument(
+        "--chunk_size",
+        "-c",
+        type=int,
+        default=None,
+        help="Stream the input in chunks of this many rows and append each labeled chunk to the "
+        "output. By default the whole dataset is loaded into memory.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=str,
+        default="./data/input",
+        help="Dataset file, directory or glob pattern of CSV or Parquet files that are read as "
+        "one dataset.",
+    )
+    parser.add_argument(
+        "--filter",
+        type=parse_filter,
+        action="append",
+        dest="filters",
+        default=None,
+        help="Only label the rows that match the filter, e.g. --filter 'lang == en'. Can be "
+        "repeated; Parquet row groups that cannot match are not read.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume from the last checkpoint of a run with the same model, prompt template "
+        "and seed and only label the rows that are not yet labeled.",
+    )
+    parser.add_argument(
+        "--checkpoint_interval",
+        type=int,
+        default=CHECKPOINT_INTERVAL,
+        help="Number of labeled rows between two checkpoints.",
+    )
+    parser.add_argument(
+        "--dedup",
+        type=str,
+        choices=DEDUP_MODES,
+        default="exact",
+        help="Send duplicate text pairs to the model only once. 'normalized' also treats pairs "
+        "that only differ in whitespace or case as duplicates, 'near' clusters near-duplicate "
+        "pairs with MinHash and stores the row id of the labeled representative of each row in "
+        "a <model_name>_cluster column.",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Label obvious rows with heuristic rules and only send the remaining rows to the "
+        "model. The deciding stage of each row is stored in a <model_name>_stage column.",
+    )
+    parser.add_argument(
+        "--prefilter_rules",
+        type=str,
+        default=",".join(DEFAULT_RULES),
+        help="Comma separated list of pre-filter rules applied in order. Defaults to all "
+        "rules that label rows as bad.",
+    )
+    parser.add_argument(
+        "--length_policy",
+        type=str,
+        choices=LENGTH_POLICIES,
+        default="none",
+        help="Tokenize the prompts, submit them ordered by length and truncate or skip rows "
+        "that do not fit into the context length of the model.",
+    )
+    parser.add_argument(
+        "--store_margins",
+        action="store_true",
+        help="Generate with logprobs and store the logprob margin of each label in a "
+        "<model_name>_margin column, e.g. for the first model of a cascade.",
+    )
+    parser.add_argument(
+        "--scoring",
+        action="store_true",
+        help="Generate a single token and read the label from the logprobs of the choices. "
+        "Stores the probability of the bad label in a <model_name>_p_bad column.",
+    )
+    parser.add_argument(
+        "--items_per_prompt",
+        type=int,
+        default=1,
+        help="Pack this many text pairs into one prompt that asks for a numbered label per "
+        "pair, so that the instructions are prefilled once per prompt. Rows whose answer "
+        "cannot be parsed are labeled with single-row prompts. Not supported with "
+        "--store_margins, --scoring and --cascade_from.",
+    )
+    parser.add_argument(
+        "--cascade_from",
+        type=str,
+        default=None,
+        help="Name of a cheaper model that was run with --store_margins. Its labels are kept "
+        "if their margin reaches --cascade_threshold and only the remaining rows are labeled "
+        "with this model.",
+    )
+    parser.add_argument(
+        "--cascade_threshold",
+        type=float,
+        default=CASCADE_MARGIN_THRESHOLD,
+        help="Minimal logprob margin to keep a label of the --cascade_from model.",
+    )
+    parser.add_argument(
+        "--ensemble",
+        action="store_true",
+        help="Only label rows that no model in ./data/output/labels has labeled as bad. Since a "
+        "single bad label makes the combined label bad, the skipped rows cannot change the "
+        "combined result.",
+    )
+    parser.add_argument(
+        "--distill",
+        action="store_true",
+        help="Label a sample of --distill_sample_size rows with the model, train a hashed "
+        "n-gram classifier on these labels and let it label the remaining rows. Rows below "
+        "--distill_threshold are still labeled by the model.",
+    )
+    parser.add_argument(
+        "--distill_sample_size",
+        type=int,
+        default=DISTILL_SAMPLE_SIZE,
+        help="Number of rows labeled by the model to train the classifier of --distill.",
+    )
+    parser.add_argument(
+        "--distill_threshold",
+        type=float,
+        default=DISTILL_CONFIDENCE_THRESHOLD,
+        help="Minimal probability of a label of the --distill classifier to keep it.",
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        help="Split the dataset into this many shards by a hash of the row id. Each shard is "
+        "labeled by a separate run and the shards are reassembled with merge_shards.py.",
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        default=0,
+        help="Index of the shard to label, between 0 and --num_shards - 1.",
+    )
+    parser.add_argument(
+        "--progress_interval",
+        type=float,
+        default=None,
+        help="Print the progress and the estimated remaining time every this many seconds.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=BACKENDS,
+        default="vllm",
+        help="Load the model locally with vLLM or send requests to an OpenAI compatible server.",
+    )
+    parser.add_argument(
+        "--api_base",
+        type=str,
+        default=API_BASE_URL,
+        help="Base URL of the OpenAI compatible server.",
+    )
+    parser.add_argument(
+        "--api_model",
+        type=str,
+        default=None,
+        help="Name of the model on the server. Defaults to the model path of the model name.",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=API_MAX_CONCURRENCY,
+        help="Maximum number of requests in flight to the server.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Do not read from or write to the persistent prediction cache.",
+    )
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        default=PREDICTION_CACHE_MAX_ENTRIES,
+        help="Maximum number of predictions kept in the cache before the least recently used "
+        "entries are evicted.",
+    )
+    parser.add_argument(
+        "--no_guide_cache",
+        action="store_true",
+        help="Do not reuse the compiled guided decoding indexes of previous jobs.",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Keep the model loaded and label the jobs of the spool directory one after "
+        "another, see submit_job.py.",
+    )
+    parser.add_argument(
+        "--spool_dir",
+        type=str,
+        default=None,
+        help="Spool directory of the worker. Defaults to ./data/spool/<model_name>.",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=WORKER_POLL_INTERVAL,
+        help="Seconds the worker waits before looking for new jobs again.",
+    )
+    parser.add_argument(
+        "--exit_when_idle",
+        action="store_true",
+        help="Stop the worker once no job is pending.",
+    )
+    parser.add_argument(
+        "--pipeline_depth",
+        type=int,
+        default=PIPELINE_DEPTH,
+        help="Number of chunks and prompt windows that are read and built ahead of inference "
+        "and written behind it in background threads. 0 runs the stages one after another.",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only tokenize the rows the run would label and report the prefill tokens, "
+        "over-length rows and estimated runtime without loading the model.",
+    )
 
     return parser.parse_args()
 
@@ -94,6 +842,15 @@ def generate_output(
     columns_to_use: List[str],
     temp: float = 0.0,
     template: str = CLASSIFY_PROMPT,
+    model_loader: Optional[ModelLoader] = None,
+    cache: Optional[PredictionCache] = None,
+    with_margins: bool = False,
+    scoring: bool = False,
+    prompt_batch_size: int = PROMPT_BATCH_SIZE,
+    report: Optional[RunReport] = None,
+    prompt_windows: Optional[Iterable[PromptWindow]] = None,
+    items_per_prompt: int = 1,
+    length_policy: Optional[LengthPolicy] = None,
 ) -> pd.DataFrame:
     """Generate model predictions and append them to the DataFrame.
 
@@ -103,40 +860,871 @@ def generate_output(
         columns_to_use (List[str]): Columns to use for generating prompts.
         temp (float, optional): Temperature for generation. Defaults to 0.0.
         template (str, optional): Template for generating prompts. Defaults to CLASSIFY_PROMPT.
+        model_loader (Optional[ModelLoader], optional): Loader that holds the model across calls.
+            If None, a new loader is created. Defaults to None.
+        cache (Optional[PredictionCache], optional): Prediction cache that is consulted before
+            and populated after inference. Defaults to None.
+        with_margins (bool, optional): Generate with logprobs and add the logprob margin of each
+            label over the other label as `<model_name>_margin` column. Defaults to False.
+        scoring (bool, optional): Generate a single token and read the label from the logprobs
+            of the choices instead of generating the whole label. Implies `with_margins`.
+            Defaults to False.
+        prompt_batch_size (int, optional): Number of prompts that are built and sent to the
+            model at once. Defaults to PROMPT_BATCH_SIZE.
+        report (Optional[RunReport], optional): Report that records the stage timings and the
+            token counts. Defaults to None.
+        prompt_windows (Optional[Iterable[PromptWindow]], optional): Prompts and cache keys of
+            the rows, e.g. built ahead of inference, see `iter_prompt_windows`. Defaults to the
+            windows of `df`.
+        items_per_prompt (int, optional): Number of text pairs packed into one prompt, see
+            `generate_multi_item`. The single-row prompts of `template` are used for the cache
+            keys and as fallback. Defaults to 1.
+        length_policy (Optional[LengthPolicy], optional): Length policy whose tokenizer and
+            context length limit the pairs of a multi-item prompt. Defaults to None.
+
+    Raises:
+        ValueError: If several items per prompt are combined with margins or scoring.
 
     Returns:
         pd.DataFrame: DataFrame with generated predictions.
     """
-    model = load_model(model_name)
+    if items_per_prompt > 1 and (with_margins or scoring):
+        raise ValueError("Multi-item prompts do not support margins or scoring.")
 
-    generation_params = GenerationParams(
-        temperature=temp,
-        seed=RANDOM_SEED,
-        max_tokens=MAX_TOKENS,
-    )
+    if model_loader is None:
+        model_loader = ModelLoader(model_name)
+    if report is None:
+        report = RunReport("filter_dataset", model_name)
 
-    prompts = get_prompts(df, columns_to_use, template=template)
+    with_margins = with_margins or scoring
+    fingerprint = None
+    if cache is not None:
+        fingerprint = get_cache_fingerprint(
+            model_name, temp=temp, scoring=scoring, items_per_prompt=items_per_prompt
+        )
 
-    answer_choices = ["good", "bad"]
+    generation_params = None
 
-    print(f"Generating predictions for {len(prompts)} examples ...")
+    model_prediction: List[Optional[str]] = []
+    model_margin: List[Optional[float]] = []
 
-    model_prediction = model.generate(
-        prompts,
-        generation_params,
-        choices=answer_choices,
-        system_prompt=SYSTEM_PROMPT,
-        use_tqdm=USE_TQDM,
-        return_type="str",
-    )
+    if prompt_windows is None:
+        prompt_windows = iter_prompt_windows(
+            df, columns_to_use, template, prompt_batch_size, fingerprint
+        )
+
+    offset = 0
+    for prompts, keys in report.timed("prompt_build", prompt_windows):
+        window = df.iloc[offset : offset + len(prompts)]
+        offset += len(prompts)
+        window_prediction: List[Optional[str]] = [None] * len(prompts)
+        window_margin: List[Optional[float]] = [None] * len(prompts)
+        if cache is not None:
+            with report.stage("cache"):
+                cached = cache.get_many(keys, require_margin=with_margins)
+            for i, key in enumerate(keys):
+                if key in cached:
+                    window_prediction[i], window_margin[i] = cached[key]
+
+        missing = [i for i, prediction in enumerate(window_prediction) if prediction is None]
+
+        if missing:
+            with report.stage("model_load"):
+                model = model_loader()
+                if generation_params is None:
+                    generation_params = get_generation_params(temp, with_margins, scoring)
+
+            print(f"Generating predictions for {len(missing)} examples ...")
+
+            # request outputs include the token counts for the run report
+            with report.stage("generation"):
+                if items_per_prompt > 1:
+                    multi_predictions, outputs = generate_multi_item(
+                        model,
+                        window.iloc[missing],
+                        columns_to_use,
+                        [prompts[i] for i in missing],
+                        items_per_prompt,
+                        temp=temp,
+                        report=report,
+                        length_policy=length_policy,
+                    )
+                else:
+                    outputs = model.generate(
+                        [prompts[i] for i in missing],
+                        generation_params,
+                        choices=ANSWER_CHOICES,
+                        system_prompt=SYSTEM_PROMPT,
+                        use_tqdm=USE_TQDM,
+                        return_type="request_output",
+                    )
+
+            prompt_tokens, output_tokens = count_output_tokens(outputs)
+            report.count("generated_rows", len(missing))
+            report.count("prompt_tokens", prompt_tokens)
+            report.count("output_tokens", output_tokens)
+
+            if items_per_prompt > 1:
+                new_predictions, new_margins = multi_predictions, [None] * len(missing)
+            elif scoring:
+                new_predictions, new_margins = score_choices(outputs, ANSWER_CHOICES)
+            elif with_margins:
+                new_predictions, new_margins = label_margins(outputs, ANSWER_CHOICES)
+            else:
+                new_predictions = [output.outputs[0].text.strip() for output in outputs]
+                new_margins = [None] * len(outputs)
+
+            for i, prediction, margin in zip(missing, new_predictions, new_margins):
+                window_prediction[i] = prediction
+                window_margin[i] = margin
+
+            if cache is not None:
+                with report.stage("cache"):
+                    cache.put_many(
+                        {keys[i]: (window_prediction[i], window_margin[i]) for i in missing}
+                    )
+
+        model_prediction.extend(window_prediction)
+        model_margin.extend(window_margin)
 
     print("len(pred), len(df)", len(model_prediction), len(df))
 
     df[f"{model_name}_prediction"] = model_prediction
 
+    if with_margins:
+        df[f"{model_name}_margin"] = np.array(model_margin, dtype=np.float64)
+
     return df
 
 
+def generate_multi_item(
+    model: Any,
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    prompts: List[str],
+    items_per_prompt: int,
+    temp: float = 0.0,
+    report: Optional[RunReport] = None,
+    length_policy: Optional[LengthPolicy] = None,
+) -> Tuple[List[str], List[Any]]:
+    """Labels the rows with prompts that each hold `items_per_prompt` consecutive text pairs and
+    ask for one numbered label per pair, so that the instructions and examples are only
+    prefilled once per prompt. Up to MULTI_ITEM_MAX_GUIDED_ITEMS pairs per prompt, the answer is
+    restricted to the valid label combinations with guided decoding. The rows of a prompt whose
+    answer cannot be parsed are labeled again with their single-row prompts, as are rows that
+    do not fit into a multi-item prompt if a length policy with a context length is given.
+
+    Args:
+        model (Any): Model with the `generate` interface of `flex_infer.VLLM`.
+        df (pd.DataFrame): Rows to label.
+        columns_to_use (List[str]): Columns that make up the pair.
+        prompts (List[str]): Single-row prompts of the rows for the fallback.
+        items_per_prompt (int): Number of text pairs per prompt.
+        temp (float, optional): Temperature for generation. Defaults to 0.0.
+        report (Optional[RunReport], optional): Report that counts the multi-item prompts and
+            the rows of the fallback. Defaults to None.
+        length_policy (Optional[LengthPolicy], optional): Length policy whose tokenizer and
+            context length are used to split the prompts so that each prompt and its answer fit
+            into the context, see `split_items`. Defaults to None.
+
+    Returns:
+        Tuple[List[str], List[Any]]: The label of each row and the request outputs of all
+            prompts, e.g. for the token counts.
+    """
+    if report is None:
+        report = RunReport("filter_dataset")
+
+    if length_policy is not None and length_policy.max_model_len is not None:
+        groups, oversized = split_items(
+            length_policy.tokenizer,
+            df,
+            columns_to_use,
+            items_per_prompt,
+            length_policy.max_model_len,
+            SYSTEM_PROMPT,
+        )
+        if len(oversized):
+            print(f"Labeling {len(oversized)} examples that exceed a multi-item prompt alone ...")
+    else:
+        groups = [
+            np.arange(low, min(low + items_per_prompt, len(df)))
+            for low in range(0, len(df), items_per_prompt)
+        ]
+    predictions: List[Optional[str]] = [None] * len(df)
+    all_outputs: List[Any] = []
+
+    # prompts of the same size share their choices and generation params
+    for size in sorted({len(group) for group in groups}, reverse=True):
+        sized = [group for group in groups if len(group) == size]
+        outputs = model.generate(
+            [build_prompt(df.iloc[group], columns_to_use) for group in sized],
+            get_generation_params(temp, items_per_prompt=size),
+            choices=(
+                label_choices(size, ANSWER_CHOICES) if size <= MULTI_ITEM_MAX_GUIDED_ITEMS else None
+            ),
+            system_prompt=SYSTEM_PROMPT,
+            use_tqdm=USE_TQDM,
+            return_type="request_output",
+        )
+        all_outputs.extend(outputs)
+        report.count("multi_item_prompts", len(sized))
+
+        for group, output in zip(sized, outputs):
+            labels = parse_labels(output.outputs[0].text, size, ANSWER_CHOICES)
+            if labels is not None:
+                for i, label in zip(group, labels):
+                    predictions[i] = label
+
+    failed = [i for i, prediction in enumerate(predictions) if prediction is None]
+    if failed:
+        print(f"Falling back to single-row prompts for {len(failed)} examples ...")
+        outputs = model.generate(
+            [prompts[i] for i in failed],
+            get_generation_params(temp),
+            choices=ANSWER_CHOICES,
+            system_prompt=SYSTEM_PROMPT,
+            use_tqdm=USE_TQDM,
+            return_type="request_output",
+        )
+        all_outputs.extend(outputs)
+        report.count("multi_item_fallback_rows", len(failed))
+
+        for i, output in zip(failed, outputs):
+            predictions[i] = output.outputs[0].text.strip()
+
+    return predictions, all_outputs
+
+
+def generate_resumable_output(
+    model_name: str,
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    checkpoint: CheckpointStore,
+    completed: Optional[pd.DataFrame] = None,
+    checkpoint_interval: int = CHECKPOINT_INTERVAL,
+    temp: float = 0.0,
+    template: str = CLASSIFY_PROMPT,
+    model_loader: Optional[ModelLoader] = None,
+    cache: Optional[PredictionCache] = None,
+    dedup: str = "exact",
+    rules: Optional[List[Rule]] = None,
+    length_policy: Optional[LengthPolicy] = None,
+    with_margins: bool = False,
+    scoring: bool = False,
+    cascade: Optional[CascadeStage] = None,
+    distill: Optional[DistillStage] = None,
+    skip_row_ids: Optional[np.ndarray] = None,
+    report: Optional[RunReport] = None,
+    pipeline_depth: int = PIPELINE_DEPTH,
+    items_per_prompt: int = 1,
+) -> pd.DataFrame:
+    """Generate model predictions for all rows that are not yet completed and checkpoint them
+    every `checkpoint_interval` unique rows. Completed predictions are taken from the checkpoint
+    and duplicate text pairs are only sent to the model once.
+
+    Args:
+        model_name (str): Name of the model used for generating output.
+        df (pd.DataFrame): DataFrame with data and a row id column.
+        columns_to_use (List[str]): Columns to use for generating prompts.
+        checkpoint (CheckpointStore): Store for the completed predictions.
+        completed (Optional[pd.DataFrame], optional): Already completed outputs indexed by row
+            id, see `CheckpointStore.load`. Defaults to None.
+        checkpoint_interval (int, optional): Number of labeled rows between two checkpoints.
+            Defaults to CHECKPOINT_INTERVAL.
+        temp (float, optional): Temperature for generation. Defaults to 0.0.
+        template (str, optional): Template for generating prompts. Defaults to CLASSIFY_PROMPT.
+        model_loader (Optional[ModelLoader], optional): Loader that holds the model across calls.
+            If None, a new loader is created. Defaults to None.
+        cache (Optional[PredictionCache], optional): Prediction cache. Defaults to None.
+        dedup (str, optional): Duplicate collapsing mode, see `collapse_duplicates`. With
+            "near", the row id of the row whose label was copied to a row is stored in a
+            `<model_name>_cluster` column. Defaults to "exact".
+        rules (Optional[List[Rule]], optional): Pre-filter rules that label obvious rows before
+            the model. If given, the deciding stage of each row is stored in a
+            `<model_name>_stage` column. Defaults to None.
+        length_policy (Optional[LengthPolicy], optional): Orders the rows by token length and
+            truncates or skips rows that exceed the context. Skipped rows keep a missing
+            prediction. Defaults to None.
+        with_margins (bool, optional): Store the logprob margin of each label in a
+            `<model_name>_margin` column. Defaults to False.
+        scoring (bool, optional): Score the labels from a single generated token and store the
+            probability of the bad label in a `<model_name>_p_bad` column. Implies
+            `with_margins`. Defaults to False.
+        cascade (Optional[CascadeStage], optional): Previous cascade stage whose confident
+            labels are kept, so that only the remaining rows are sent to this model. Implies
+            `with_margins`. Defaults to None.
+        distill (Optional[DistillStage], optional): Classifier that is trained on the labels of
+            the model for a sample of the remaining rows once enough sample rows are labeled,
+            and keeps its confident labels for the other rows. Defaults to None.
+        skip_row_ids (Optional[np.ndarray], optional): Row ids that are not labeled and keep a
+            missing prediction, e.g. rows that previous models of an ensemble already labeled
+            as bad. Defaults to None.
+        report (Optional[RunReport], optional): Report that records the stage timings and the
+            progress. Defaults to None.
+        pipeline_depth (int, optional): Number of checkpoint batches whose prompts are built
+            in a background thread ahead of inference, 0 to build them in between. Defaults to
+            PIPELINE_DEPTH.
+        items_per_prompt (int, optional): Number of text pairs packed into one prompt, see
+            `generate_multi_item`. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: DataFrame with predictions.
+    """
+    if checkpoint_interval <= 0:
+        raise ValueError("checkpoint_interval must be a positive integer")
+
+    if model_loader is None:
+        model_loader = ModelLoader(model_name)
+    if report is None:
+        report = RunReport("filter_dataset", model_name)
+
+    with_margins = with_margins or scoring or cascade is not None
+
+    prediction_column = f"{model_name}_prediction"
+    margin_column = f"{model_name}_margin"
+    cluster_column = f"{model_name}_cluster"
+    output_columns = [prediction_column] + ([margin_column] if with_margins else [])
+    if dedup == "near":
+        output_columns.append(cluster_column)
+
+    if completed is None:
+        completed = pd.DataFrame(index=pd.Index([], name=ROW_ID_COLUMN))
+
+    outputs = completed.reindex(columns=output_columns).reindex(df[ROW_ID_COLUMN].to_numpy())
+    outputs.index = df.index
+    outputs[prediction_column] = outputs[prediction_column].astype(object)
+
+    stages = None
+    if rules or cascade is not None or distill is not None or skip_row_ids is not None:
+        stages = pd.Series("model", index=df.index, dtype=object)
+
+    skip = pd.Series(False, index=df.index)
+    if skip_row_ids is not None:
+        skip = df[ROW_ID_COLUMN].isin(skip_row_ids) & outputs[prediction_column].isna()
+        stages[skip] = "skipped"
+        print(f"Skipping {skip.sum()} examples that previous models labeled as bad ...")
+
+    if rules:
+        decided_by = apply_rules(df, columns_to_use, rules)
+        decided = decided_by.notna() & outputs[prediction_column].isna() & ~skip
+        outputs.loc[decided, prediction_column] = decided_by[decided].map(
+            {rule.name: rule.label for rule in rules}
+        )
+        stages[decided] = "rule:" + decided_by[decided]
+        if with_margins:
+            outputs.loc[decided, margin_column] = np.inf
+        print(f"Pre-filter rules labeled {decided.sum()} of {len(df)} examples ...")
+
+    if cascade is not None:
+        df[f"{cascade.model_name}_margin"] = cascade.margins(df[ROW_ID_COLUMN])
+
+        undecided = outputs[prediction_column].isna() & ~skip
+        labels, margins, cascade_stages = cascade.decide(df.loc[undecided, ROW_ID_COLUMN])
+        kept = labels.index[labels.notna()]
+        outputs.loc[kept, prediction_column] = labels[kept]
+        outputs.loc[kept, margin_column] = margins[kept]
+        stages[kept] = cascade_stages[kept]
+        print(
+            f"Kept {len(kept)} labels of {cascade.model_name} with a margin of at least "
+            f"{cascade.threshold} ..."
+        )
+
+    num_sampled = 0
+    if distill is not None:
+        # rows of a resumed run keep their sample, since the checkpoint has their labels. Sample
+        # rows without a good or bad label, e.g. skipped rows or unknown answers, are replaced
+        # by further rows until the sample is filled or the candidates run out
+        candidates = df.loc[stages == "model", ROW_ID_COLUMN]
+        sample = distill.select_sample(candidates)
+        while len(sample):
+            print(f"Labeling {len(sample)} examples to train the distilled classifier ...")
+            labeled = generate_resumable_output(
+                model_name,
+                df.loc[sample, [ROW_ID_COLUMN] + columns_to_use].copy(),
+                columns_to_use,
+                checkpoint,
+                completed=completed,
+                checkpoint_interval=checkpoint_interval,
+                temp=temp,
+                template=template,
+                model_loader=model_loader,
+                cache=cache,
+                dedup=dedup,
+                length_policy=length_policy,
+                with_margins=with_margins,
+                scoring=scoring,
+                report=report,
+                pipeline_depth=pipeline_depth,
+                items_per_prompt=items_per_prompt,
+            )
+            for column in output_columns:
+                outputs.loc[sample, column] = labeled[column].astype(outputs[column].dtype)
+            distill.add(labeled, columns_to_use, labeled[prediction_column])
+            num_sampled += len(sample)
+            candidates = candidates.drop(sample)
+            sample = distill.select_sample(candidates)
+
+        if not distill.trained and not distill.needed:
+            with report.stage("distill"):
+                evaluation = distill.fit(columns_to_use)
+            print(f"Trained the distilled classifier, held out evaluation: {evaluation}")
+
+        if distill.trained:
+            undecided = outputs[prediction_column].isna() & ~skip
+            with report.stage("distill"):
+                labels, margins = distill.decide(df.loc[undecided], columns_to_use)
+            kept = labels.index[labels.notna()]
+            outputs.loc[kept, prediction_column] = labels[kept]
+            if with_margins:
+                outputs.loc[kept, margin_column] = margins[kept]
+            stages[kept] = "distill"
+            report.count("distilled_rows", len(kept))
+            print(
+                f"Kept {len(kept)} of {undecided.sum()} labels of the distilled classifier with "
+                f"a probability of at least {distill.threshold} ..."
+            )
+
+    pending = df.loc[outputs[prediction_column].isna() & ~skip]
+
+    if len(pending) < len(df) - skip.sum():
+        print(
+            f"Skipping {len(df) - skip.sum() - len(pending)} examples that are already labeled ..."
+        )
+
+    unique_pending, codes = collapse_duplicates(pending, columns_to_use, mode=dedup)
+
+    if len(unique_pending) < len(pending):
+        dedup_ratio = 1 - len(unique_pending) / len(pending)
+        print(
+            f"Collapsed {len(pending)} examples to {len(unique_pending)} unique pairs "
+            f"(dedup ratio {dedup_ratio:.1%}) ..."
+        )
+
+    num_to_label = len(unique_pending)
+    if length_policy is not None:
+        unique_pending, permutation, num_to_label = length_policy.apply(
+            unique_pending, columns_to_use
+        )
+        inverse = np.empty_like(permutation)
+        inverse[permutation] = np.arange(len(permutation))
+        codes = inverse[codes]
+
+    if dedup == "near":
+        # every representative is labeled as its own cluster, the id is broadcast with its label
+        unique_pending = unique_pending.assign(
+            **{cluster_column: unique_pending[ROW_ID_COLUMN].to_numpy()}
+        )
+
+    skipped = codes >= num_to_label
+    if skipped.any():
+        skipped_ids = pending.loc[skipped, ROW_ID_COLUMN].tolist()
+        shown = ", ".join(map(str, skipped_ids[:20])) + (", ..." if len(skipped_ids) > 20 else "")
+        print(
+            f"Skipped {len(skipped_ids)} examples that do not fit into the context length "
+            f"(row ids: {shown}) ..."
+        )
+
+    # rows that are decided without the model count as done right away, the sample rows of the
+    # distilled classifier were counted when they were labeled
+    report.advance(len(df) - len(pending) - num_sampled + skipped.sum())
+
+    # group the pending rows by their representative to broadcast each batch of labels
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+
+    fingerprint = None
+    if cache is not None:
+        fingerprint = get_cache_fingerprint(
+            model_name, temp=temp, scoring=scoring, items_per_prompt=items_per_prompt
+        )
+
+    def build_batches() -> Iterator[Tuple[int, pd.DataFrame, List[PromptWindow]]]:
+        for start in range(0, num_to_label, checkpoint_interval):
+            batch = unique_pending.iloc[start : min(start + checkpoint_interval, num_to_label)]
+            windows = list(
+                iter_prompt_windows(batch, columns_to_use, template, fingerprint=fingerprint)
+            )
+            yield start, batch.copy(), windows
+
+    # the prompts of the next batches are built in a background thread during inference, the
+    # prompt_build stage only counts the time that inference waits for them
+    with closing(prefetch(build_batches(), pipeline_depth)) as batches:
+        for start, batch, windows in report.timed("prompt_build", batches):
+            batch = generate_output(
+                model_name,
+                batch,
+                columns_to_use,
+                temp=temp,
+                template=template,
+                model_loader=model_loader,
+                cache=cache,
+                with_margins=with_margins,
+                scoring=scoring,
+                report=report,
+                prompt_windows=windows,
+                items_per_prompt=items_per_prompt,
+                length_policy=length_policy,
+            )
+            low, high = np.searchsorted(sorted_codes, [start, start + len(batch)])
+            rows = pending.index[order[low:high]]
+            representatives = sorted_codes[low:high] - start
+
+            batch_outputs = pd.DataFrame(
+                {
+                    ROW_ID_COLUMN: pending.loc[rows, ROW_ID_COLUMN].to_numpy(),
+                    **{
+                        column: batch[column].to_numpy()[representatives]
+                        for column in output_columns
+                    },
+                }
+            )
+
+            with report.stage("save"):
+                checkpoint.save(batch_outputs)
+            for column in output_columns:
+                outputs.loc[rows, column] = batch_outputs[column].to_numpy()
+            report.advance(len(rows))
+
+    for column in output_columns:
+        df[column] = outputs[column]
+    df[prediction_column] = encode_labels(df[prediction_column])
+    if dedup == "near":
+        df[cluster_column] = df[cluster_column].astype("Int64")
+
+    if scoring:
+        df[f"{model_name}{PROBABILITY_SUFFIX}"] = bad_probability(
+            df[prediction_column], df[margin_column]
+        )
+
+    if stages is not None:
+        df[f"{model_name}_stage"] = stages
+
+    return df
+
+
+def generate_output_streaming(
+    model_name: str,
+    columns_to_use: List[str],
+    chunk_size: int,
+    checkpoint: CheckpointStore,
+    completed: Optional[pd.DataFrame] = None,
+    checkpoint_interval: int = CHECKPOINT_INTERVAL,
+    temp: float = 0.0,
+    template: str = CLASSIFY_PROMPT,
+    cache: Optional[PredictionCache] = None,
+    dedup: str = "exact",
+    rules: Optional[List[Rule]] = None,
+    length_policy: Optional[LengthPolicy] = None,
+    with_margins: bool = False,
+    scoring: bool = False,
+    cascade: Optional[CascadeStage] = None,
+    distill: Optional[DistillStage] = None,
+    skip_row_ids: Optional[np.ndarray] = None,
+    model_loader: Optional[ModelLoader] = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    report: Optional[RunReport] = None,
+    path: str = "./data/labeled_data_{}.parquet",
+    dir_path: str = "./data/input",
+    read_columns: Optional[List[str]] = None,
+    filters: Optional[List[Filter]] = None,
+    pipeline_depth: int = PIPELINE_DEPTH,
+    items_per_prompt: int = 1,
+) -> pd.Series:
+    """Label the input dataset chunk by chunk and append each labeled chunk to the output file.
+    The model is loaded once and peak memory depends on `chunk_size`, not on the dataset size.
+
+    Reading, labeling and writing overlap: the next chunks are read in a background thread and
+    labeled chunks are written in another one while the model labels the current chunk. Both
+    threads stay at most `pipeline_depth` chunks ahead or behind, and the chunks are written in
+    the input order.
+
+    Args:
+        model_name (str): Name of the model used for generating output.
+        columns_to_use (List[str]): Columns to use for generating prompts.
+        chunk_size (int): Number of rows to read, label and write at once.
+        checkpoint (CheckpointStore): Store for the completed predictions.
+        completed (Optional[pd.DataFrame], optional): Already completed outputs indexed by row
+            id, see `CheckpointStore.load`. Defaults to None.
+        checkpoint_interval (int, optional): Number of labeled rows between two checkpoints.
+            Defaults to CHECKPOINT_INTERVAL.
+        temp (float, optional): Temperature for generation. Defaults to 0.0.
+        template (str, optional): Template for generating prompts. Defaults to CLASSIFY_PROMPT.
+        cache (Optional[PredictionCache], optional): Prediction cache. Defaults to None.
+        dedup (str, optional): Duplicate collapsing mode, see `collapse_duplicates`. Defaults to
+            "exact".
+        rules (Optional[List[Rule]], optional): Pre-filter rules that label obvious rows before
+            the model. Defaults to None.
+        length_policy (Optional[LengthPolicy], optional): Orders the rows by token length and
+            handles rows that exceed the context. Defaults to None.
+        with_margins (bool, optional): Store the logprob margin of each label. Defaults to
+            False.
+        scoring (bool, optional): Score the labels from a single generated token and store
+            the probability of the bad label. Defaults to False.
+        cascade (Optional[CascadeStage], optional): Previous cascade stage whose confident
+            labels are kept. Defaults to None.
+        distill (Optional[DistillStage], optional): Classifier that is trained on the sample
+            rows of the first chunks and labels the rows of the later chunks. Defaults to None.
+        skip_row_ids (Optional[np.ndarray], optional): Row ids that are not labeled. Defaults to
+            None.
+        model_loader (Optional[ModelLoader], optional): Loader that holds the model across
+            chunks. Defaults to None.
+        num_shards (int, optional): Total number of shards. Defaults to 1.
+        shard_index (int, optional): Index of the shard to label, see `shard_mask`. Defaults to
+            0.
+        report (Optional[RunReport], optional): Report that records the stage timings and the
+            progress. Defaults to None.
+        path (str, optional): File path template for the output. Defaults to
+            "./data/labeled_data_{}.parquet".
+        dir_path (str, optional): Path of a dataset file, a directory or a glob pattern.
+            Defaults to "./data/input".
+        read_columns (Optional[List[str]], optional): Input columns to read and write to the
+            output in addition to the row id. Defaults to all columns.
+        filters (Optional[List[Filter]], optional): Only rows that match all filters are
+            labeled. Defaults to None.
+        pipeline_depth (int, optional): Number of chunks read ahead of and written behind
+            inference, and of prompt windows built ahead of it, 0 to run the stages one after
+            another. Defaults to PIPELINE_DEPTH.
+        items_per_prompt (int, optional): Number of text pairs packed into one prompt, see
+            `generate_multi_item`. Defaults to 1.
+
+    Returns:
+        pd.Series: Value counts of the predictions over all chunks.
+    """
+    if model_loader is None:
+        model_loader = ModelLoader(model_name)
+    if report is None:
+        report = RunReport("filter_dataset", model_name)
+    output_path = path.format(model_name)
+    prediction_column = f"{model_name}_prediction"
+    value_counts = pd.Series(dtype="int64")
+    num_labeled = 0
+    settings = get_run_settings(
+        with_margins or cascade is not None, scoring, items_per_prompt, dedup
+    )
+
+    # the writer thread is flushed before the output file is closed, the data_load and save
+    # stages only count the time that inference waits for them
+    with (
+        ParquetAppender(output_path, get_run_metadata(model_name, template, settings)) as writer,
+        SerialExecutor(pipeline_depth) as writes,
+        closing(
+            prefetch(iter_data(chunk_size, dir_path, read_columns, filters), pipeline_depth)
+        ) as chunks,
+    ):
+        for chunk in report.timed("data_load", chunks):
+            chunk = select_shard(chunk, num_shards, shard_index)
+
+            chunk = generate_resumable_output(
+                model_name,
+                chunk,
+                columns_to_use,
+                checkpoint,
+                completed=completed,
+                checkpoint_interval=checkpoint_interval,
+                temp=temp,
+                template=template,
+                model_loader=model_loader,
+                cache=cache,
+                dedup=dedup,
+                rules=rules,
+                length_policy=length_policy,
+                with_margins=with_margins,
+                scoring=scoring,
+                cascade=cascade,
+                distill=distill,
+                skip_row_ids=skip_row_ids,
+                report=report,
+                pipeline_depth=pipeline_depth,
+                items_per_prompt=items_per_prompt,
+            )
+            with report.stage("save"):
+                writes.submit(writer.write, chunk)
+            value_counts = value_counts.add(
+                chunk[prediction_column].value_counts(dropna=False), fill_value=0
+            )
+            num_labeled += len(chunk)
+            print(f"Labeled {num_labeled} examples, appending them to {output_path}")
+
+    return value_counts.astype("int64")
+
+
+def resolve_template(template: str) -> str:
+    """Resolves the prompt template of a job, either the name of a prompt in
+    `src.prompt_components` or the template itself.
+
+    Args:
+        template (str): Name of a prompt or prompt template.
+
+    Raises:
+        ValueError: If the template does not have exactly two placeholders.
+
+    Returns:
+        str: The prompt template.
+    """
+    if template.isidentifier():
+        template = getattr(prompt_components, template, template)
+
+    if template.count("{}") != 2:
+        raise ValueError("The prompt template should contain exactly 2 {} placeholders.")
+
+    return template
+
+
+def label_job(
+    job: Dict[str, Any],
+    model_name: str,
+    model_loader: ModelLoader,
+    template: str = CLASSIFY_PROMPT,
+    chunk_size: int = WORKER_CHUNK_SIZE,
+    cache: Optional[PredictionCache] = None,
+    dedup: str = "exact",
+    rules: Optional[List[Rule]] = None,
+    length_policy: str = "none",
+    with_margins: bool = False,
+    scoring: bool = False,
+    progress_interval: Optional[float] = None,
+    pipeline_depth: int = PIPELINE_DEPTH,
+    items_per_prompt: int = 1,
+) -> Dict[str, Any]:
+    """Labels the input file of a worker job with the resident model. Labeled chunks are
+    appended to the output file as they complete, and a job that was interrupted resumes from
+    its checkpoint.
+
+    Args:
+        job (Dict[str, Any]): The job, see `src.worker.submit_job`.
+        model_name (str): Name of the model.
+        model_loader (ModelLoader): Loader that holds the model across jobs.
+        template (str, optional): Prompt template for jobs without a template. Defaults to
+            CLASSIFY_PROMPT.
+        chunk_size (int, optional): Number of rows to read, label and write at once. Defaults
+            to WORKER_CHUNK_SIZE.
+        cache (Optional[PredictionCache], optional): Prediction cache. Defaults to None.
+        dedup (str, optional): Duplicate collapsing mode. Defaults to "exact".
+        rules (Optional[List[Rule]], optional): Pre-filter rules. Defaults to None.
+        length_policy (str, optional): One of LENGTH_POLICIES. Defaults to "none".
+        with_margins (bool, optional): Store the logprob margin of each label. Defaults to
+            False.
+        scoring (bool, optional): Score the labels from a single generated token. Defaults to
+            False.
+        progress_interval (Optional[float], optional): Seconds between two progress lines.
+            Defaults to None.
+        pipeline_depth (int, optional): Number of chunks read ahead of and written behind
+            inference. Defaults to PIPELINE_DEPTH.
+        items_per_prompt (int, optional): Number of text pairs packed into one prompt.
+            Defaults to 1.
+
+    Returns:
+        Dict[str, Any]: Output path, value counts of the predictions and run report of the job.
+    """
+    template = resolve_template(job.get("template") or template)
+    fingerprint = run_fingerprint(
+        model_name,
+        template,
+        SYSTEM_PROMPT,
+        RANDOM_SEED,
+        settings=get_run_settings(with_margins, scoring, items_per_prompt, dedup),
+    )
+    checkpoint = CheckpointStore(model_name, f"{fingerprint}_{job['id']}")
+    completed = checkpoint.load()
+    if len(completed):
+        print(f"Resuming job {job['id']} with {len(completed)} labeled examples ...")
+
+    report = RunReport(
+        "filter_dataset",
+        model_name,
+        total_rows=count_rows(job["input"]),
+        progress_interval=progress_interval,
+    )
+    os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+
+    value_counts = generate_output_streaming(
+        model_name,
+        job["columns"],
+        chunk_size,
+        checkpoint,
+        completed=completed,
+        template=template,
+        cache=cache,
+        dedup=dedup,
+        rules=rules,
+        length_policy=(
+            get_length_policy(model_name, template, length_policy)
+            if length_policy != "none"
+            else None
+        ),
+        with_margins=with_margins,
+        scoring=scoring,
+        model_loader=model_loader,
+        report=report,
+        path=job["output"],
+        dir_path=job["input"],
+        pipeline_depth=pipeline_depth,
+        items_per_prompt=items_per_prompt,
+    )
+    checkpoint.clear()
+
+    return {
+        "output": job["output"],
+        "value_counts": {str(label): int(count) for label, count in value_counts.items()},
+        "report": report.to_dict(),
+    }
+
+
+def iter_prompts(df: pd.DataFrame, columns_to_use: List[str], template: str) -> Iterator[str]:
+    """Lazily generate prompts based on the DataFrame and a template, so that the formatted
+    prompts never have to be held in memory all at once.
+
+    Args:
+        df (pd.DataFrame): Input DataFrame with revision data.
+        columns_to_use (List[str]): Columns to use for generating prompts.
+        template (str): Template string for generating prompts.
+
+    Raises:
+        ValueError: If columns_to_use does not contain exactly 2 columns.
+
+    Returns:
+        Iterator[str]: Formatted prompts in the order of the rows.
+    """
+    if len(columns_to_use) != 2:
+        raise ValueError("columns_to_use should contain exactly 2 columns")
+
+    return (
+        template.format(before, after)
+        for before, after in zip(df[columns_to_use[0]], df[columns_to_use[1]])
+    )
+
+
+def iter_prompt_windows(
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    template: str,
+    prompt_batch_size: int = PROMPT_BATCH_SIZE,
+    fingerprint: Optional[str] = None,
+) -> Iterator[PromptWindow]:
+    """Builds the prompts of the rows in windows of `prompt_batch_size` prompts, so that only
+    the prompts in flight are held in memory.
+
+    Args:
+        df (pd.DataFrame): Input DataFrame with revision data.
+        columns_to_use (List[str]): Columns to use for generating prompts.
+        template (str): Template string for generating prompts.
+        prompt_batch_size (int, optional): Number of prompts per window. Defaults to
+            PROMPT_BATCH_SIZE.
+        fingerprint (Optional[str], optional): Configuration fingerprint of the prediction
+            cache, see `get_cache_fingerprint`. Without it, no cache keys are computed.
+            Defaults to None.
+
+    Returns:
+        Iterator[PromptWindow]: The prompts and cache keys of each window.
+    """
+    for prompts in batched(iter_prompts(df, columns_to_use, template), prompt_batch_size):
+        keys = None
+        if fingerprint is not None:
+            keys = [prediction_key(fingerprint, prompt) for prompt in prompts]
+        yield prompts, keys
+
+
 def get_prompts(df: pd.DataFrame, columns_to_use: List[str], template: str) -> List[str]:
     """Generate prompts based on the DataFrame and a template.
 
@@ -148,31 +1736,277 @@ def get_prompts(df: pd.DataFrame, columns_to_use: List[str], template: str) -> L
     Returns:
         List[str]: List of formatted prompts.
     """
-    if len(columns_to_use) != 2:
-        raise ValueError("columns_to_use should contain exactly 2 columns")
+    return list(iter_prompts(df, columns_to_use, template))
+
+
+def run_label_worker(args: argparse.Namespace, rules: Optional[List[Rule]] = None) -> None:
+    """Runs the labeling worker with the settings of the command line arguments. The model is
+    loaded with the first job that needs it and stays loaded for all following jobs."""
+    if args.cascade_from is not None or args.ensemble or args.distill or args.num_shards > 1:
+        raise ValueError(
+            "--cascade_from, --ensemble, --distill and --num_shards are not supported by jobs."
+        )
 
-    text_1 = df[columns_to_use[0]].tolist()
-    text_2 = df[columns_to_use[1]].tolist()
+    spool_dir = args.spool_dir or os.path.join(SPOOL_DIR, args.model_name)
+    cache = None
+    if not args.no_cache:
+        cache = PredictionCache(PREDICTION_CACHE_PATH, max_entries=args.cache_max_entries)
+    guide_cache = None if args.no_guide_cache or args.backend != "vllm" else GuideCache()
+    model_loader = ModelLoader(
+        args.model_name,
+        backend=args.backend,
+        api_base=args.api_base,
+        api_model=args.api_model,
+        max_concurrency=args.max_concurrency,
+        guide_cache=guide_cache,
+    )
 
-    prompts = []
-    for before, after in zip(text_1, text_2):
-        prompt = template.format(before, after)
-        prompts.append(prompt)
+    handle_job = partial(
+        label_job,
+        model_name=args.model_name,
+        model_loader=model_loader,
+        template=PROMPT_TEMPLATE,
+        chunk_size=args.chunk_size or WORKER_CHUNK_SIZE,
+        cache=cache,
+        dedup=args.dedup,
+        rules=rules,
+        length_policy=args.length_policy,
+        with_margins=args.store_margins,
+        scoring=args.scoring,
+        progress_interval=args.progress_interval,
+        pipeline_depth=args.pipeline_depth,
+        items_per_prompt=args.items_per_prompt,
+    )
 
-    return prompts
+    try:
+        num_done, num_failed = run_worker(
+            handle_job, spool_dir, args.poll_interval, exit_when_idle=args.exit_when_idle
+        )
+        print(f"Worker finished {num_done} jobs, {num_failed} failed")
+    finally:
+        model_loader.close()
+        if cache is not None:
+            cache.close()
+        if guide_cache is not None:
+            print("Guide cache", guide_cache.stats())
 
 
 def main(args: argparse.Namespace) -> None:
-    clean_up(args.model_name)
+    # with run_script.sh every model gets the same --cascade_from, the first model of the
+    # cascade has no previous stage
+    if args.cascade_from == args.model_name:
+        args.cascade_from = None
+
+    rules = get_rules(args.prefilter_rules.split(",")) if args.prefilter else None
+
+    if args.dry_run:
+        dry_run(
+            args.model_name,
+            COLUMNS,
+            PROMPT_TEMPLATE,
+            chunk_size=args.chunk_size,
+            dedup=args.dedup,
+            rules=rules,
+            skip_row_ids=LabelStore().flagged_row_ids() if args.ensemble else None,
+            num_shards=args.num_shards,
+            shard_index=args.shard_index,
+            input_path=args.input,
+            filters=args.filters,
+            path=(
+                f"./data/dry_run_{{}}_shard-{args.shard_index}-of-{args.num_shards}.json"
+                if args.num_shards > 1
+                else "./data/dry_run_{}.json"
+            ),
+        )
+        return
+
+    if args.items_per_prompt <= 0:
+        raise ValueError("--items_per_prompt must be a positive integer.")
+    if args.items_per_prompt > 1 and (
+        args.store_margins or args.scoring or args.cascade_from is not None
+    ):
+        raise ValueError(
+            "--items_per_prompt is not supported with --store_margins, --scoring and "
+            "--cascade_from."
+        )
+
+    if args.worker:
+        run_label_worker(args, rules)
+        return
+
+    # runs only resume from checkpoints with the same output columns and labeling settings
+    settings = get_run_settings(
+        args.store_margins or args.cascade_from is not None,
+        args.scoring,
+        args.items_per_prompt,
+        args.dedup,
+    )
+    fingerprint = run_fingerprint(
+        args.model_name, PROMPT_TEMPLATE, SYSTEM_PROMPT, RANDOM_SEED, settings=settings
+    )
+    output_path = "./data/labeled_data_{}.parquet"
+    shard_suffix = ""
+    if args.num_shards <= 0 or not 0 <= args.shard_index < args.num_shards:
+        raise ValueError(f"Invalid shard {args.shard_index} of {args.num_shards} shards.")
+    if args.num_shards > 1:
+        output_path = shard_path(args.model_name, args.shard_index, args.num_shards)
+        shard_suffix = f"_shard-{args.shard_index}-of-{args.num_shards}"
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        print(f"Labeling shard {args.shard_index} of {args.num_shards} ...")
+
+    checkpoint = CheckpointStore(args.model_name, fingerprint + shard_suffix)
+
+    report = RunReport("filter_dataset", args.model_name, progress_interval=args.progress_interval)
+
+    if args.resume:
+        completed = checkpoint.load()
+        print(f"Resuming from checkpoint with {len(completed)} labeled examples ...")
+    else:
+        if args.num_shards > 1:
+            remove_shard(output_path)
+        else:
+            clean_up(args.model_name)
+        checkpoint.clear()
+        completed = None
+
+    length_policy = None
+    if args.length_policy != "none":
+        length_policy = get_length_policy(args.model_name, PROMPT_TEMPLATE, args.length_policy)
+
+    cascade = None
+    if args.cascade_from is not None:
+        # labels that were already added with add_labels_to_dataset.py are in the label store
+        if args.cascade_from in LabelStore().models():
+            cascade = CascadeStage.from_label_store(args.cascade_from, args.cascade_threshold)
+        else:
+            cascade = CascadeStage.from_file(args.cascade_from, args.cascade_threshold)
+
+    distill = None
+    if args.distill:
+        distill = DistillStage(args.distill_sample_size, args.distill_threshold)
+
+    skip_row_ids = None
+    if args.ensemble:
+        skip_row_ids = LabelStore().flagged_row_ids()
+
+    cache = None
+    if not args.no_cache:
+        cache = PredictionCache(PREDICTION_CACHE_PATH, max_entries=args.cache_max_entries)
+
+    guide_cache = None if args.no_guide_cache or args.backend != "vllm" else GuideCache()
+    model_loader = ModelLoader(
+        args.model_name,
+        backend=args.backend,
+        api_base=args.api_base,
+        api_model=args.api_model,
+        max_concurrency=args.max_concurrency,
+        guide_cache=guide_cache,
+    )
+
+    if args.chunk_size is not None:
+        num_rows = count_rows(args.input, args.filters)
+        report.total_rows = num_rows // args.num_shards if num_rows is not None else None
+
+        value_counts = generate_output_streaming(
+            args.model_name,
+            COLUMNS,
+            args.chunk_size,
+            checkpoint,
+            completed=completed,
+            checkpoint_interval=args.checkpoint_interval,
+            temp=0.0,
+            template=PROMPT_TEMPLATE,
+            cache=cache,
+            dedup=args.dedup,
+            rules=rules,
+            length_policy=length_policy,
+            with_margins=args.store_margins,
+            scoring=args.scoring,
+            cascade=cascade,
+            distill=distill,
+            skip_row_ids=skip_row_ids,
+            model_loader=model_loader,
+            num_shards=args.num_shards,
+            shard_index=args.shard_index,
+            report=report,
+            path=output_path,
+            dir_path=args.input,
+            read_columns=COLUMNS,
+            filters=args.filters,
+            pipeline_depth=args.pipeline_depth,
+            items_per_prompt=args.items_per_prompt,
+        )
+    else:
+        # only the prompt columns and the row ids are read
+        with report.stage("data_load"):
+            df = read_data(args.input, COLUMNS, args.filters)
+            df = select_shard(df, args.num_shards, args.shard_index)
+        report.total_rows = len(df)
+
+        output = generate_resumable_output(
+            args.model_name,
+            df,
+            COLUMNS,
+            checkpoint,
+            completed=completed,
+            checkpoint_interval=args.checkpoint_interval,
+            temp=0.0,
+            template=PROMPT_TEMPLATE,
+            cache=cache,
+            dedup=args.dedup,
+            rules=rules,
+            length_policy=length_policy,
+            with_margins=args.store_margins,
+            scoring=args.scoring,
+            cascade=cascade,
+            distill=distill,
+            skip_row_ids=skip_row_ids,
+            model_loader=model_loader,
+            report=report,
+            pipeline_depth=args.pipeline_depth,
+            items_per_prompt=args.items_per_prompt,
+        )
+
+        with report.stage("save"):
+            save_output(
+                output,
+                args.model_name,
+                path=output_path,
+                metadata=get_run_metadata(args.model_name, PROMPT_TEMPLATE, settings),
+            )
+        value_counts = output[f"{args.model_name}_prediction"].value_counts(dropna=False)
+
+    model_loader.close()
+    if args.num_shards > 1:
+        write_manifest(
+            output_path,
+            args.model_name,
+            args.shard_index,
+            args.num_shards,
+            fingerprint,
+            input_path=args.input,
+            filters=args.filters,
+        )
+    checkpoint.clear()
+
+    print("Value_counts", value_counts)
+
+    if cascade is not None:
+        cascade.save_report(args.model_name + shard_suffix)
+        print("Cascade", cascade.report())
 
-    # reads the dataset from ./data/input
-    df = read_data()
+    if distill is not None:
+        distill.save_report(args.model_name + shard_suffix)
+        print("Distilled classifier", distill.report())
 
-    output = generate_output(args.model_name, df, COLUMNS, temp=0.0, template=PROMPT_TEMPLATE)
+    if cache is not None:
+        print("Prediction cache", cache.stats())
+        cache.close()
 
-    save_output(output, args.model_name)
+    if guide_cache is not None:
+        print("Guide cache", guide_cache.stats())
 
-    print("Value_counts", output[f"{args.model_name}_prediction"].value_counts())
+    report.save(f"./data/run_report_filter_{args.model_name}{shard_suffix}.json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+import argparse
+
+from src.settings import COMBINE_CHUNK_SIZE
+from src.sharding import merge_shards
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Simple argument parser for the script."""
+    parser = argparse.ArgumentParser(
+        description="Reassembles the labeled shards of a model in the order of the input dataset."
+    )
+    parser.add_argument(
+        "--model_name",
+        "-m",
+        type=str,
+        required=True,
+        help="The model name whose shards are merged.",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        "-c",
+        type=int,
+        default=COMBINE_CHUNK_SIZE,
+        help="Number of input rows that are merged at once.",
+    )
+
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    num_rows = merge_shards(args.model_name, args.chunk_size)
+
+    print(f"Merged {num_rows} labeled examples to ./data/labeled_data_{args.model_name}.parquet")
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(args)
@@ -2,18 +2,14 @@
 set -e
 
 if [ -z "$1" ]; then
-  echo "Usage: $0 <model_name>"
+  echo "Usage: $0 <model_name> [<model_name> ...]"
+  echo "Models are run in the given order. Extra arguments for filter_dataset.py can be"
+  echo "passed with FILTER_ARGS, e.g. FILTER_ARGS=\"--ensemble\" $0 gemma-2b gemma-2-27b"
   exit 1
 fi
 
-MODEL_NAME=$1
-
-# set and create the outlines cache directory
-UNIQUE_ID=$(date +%Y%m%d%H%M%S)_$RANDOM
-CACHE_DIR="$HOME/.cache/outlines_custom_cache/job_$UNIQUE_ID"
-export OUTLINES_CACHE_DIR="$CACHE_DIR"
-echo "Using cache directory: $CACHE_DIR"
-mkdir -p "$CACHE_DIR"
+# the compiled guided decoding indexes are kept in a persistent cache shared by all jobs,
+# see GUIDE_CACHE_DIR in src/settings.py
 
 start_time=$(date +%s)
 
@@ -22,17 +18,12 @@ export IC_DEBUG="False"  # icecream print debugging
 export TOKENIZERS_PARALLELISM="false"  # for sentence-transformers
 # export VLLM_ATTENTION_BACKEND=FLASHINFER  # for gemma models
 
-python filter_dataset.py --model_name "$MODEL_NAME"
-
-python add_labels_to_dataset.py --model_name "$MODEL_NAME"
+for MODEL_NAME in "$@"; do
+  # shellcheck disable=SC2086
+  python filter_dataset.py --model_name "$MODEL_NAME" $FILTER_ARGS
 
-# clean up the custom outlines cache directory
-if [ -d "$CACHE_DIR" ]; then
-    echo "Cleaning up cache directory: $CACHE_DIR"
-    rm -rf "$CACHE_DIR"
-else
-    echo "Cache directory not found: $CACHE_DIR"
-fi
+  python add_labels_to_dataset.py --model_name "$MODEL_NAME"
+done
 
 end_time=$(date +%s)
 elapsed_time=$((end_time - start_time))
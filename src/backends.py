@@ -0,0 +1,262 @@
+import asyncio
+import os
+import random
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import aiohttp
+
+from src.settings import (
+    API_BACKOFF_SECONDS,
+    API_MAX_CONCURRENCY,
+    API_MAX_RETRIES,
+    API_TIMEOUT_SECONDS,
+)
+
+# status codes that are worth retrying, e.g. an overloaded or restarting server
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class GenerationSettings(NamedTuple):
+    """Generation parameters that do not depend on the backend. The "openai" backend reads them
+    directly and `VLLMBackend` converts them into `flex_infer.GenerationParams`.
+
+    Attributes:
+        temperature (float): Temperature for generation.
+        seed (Optional[int]): Random seed of the sampling.
+        max_tokens (Optional[int]): Maximal number of generated tokens.
+        logprobs (Optional[int]): Number of logprobs per generated token, None for no logprobs.
+    """
+
+    temperature: float = 0.0
+    seed: Optional[int] = None
+    max_tokens: Optional[int] = None
+    logprobs: Optional[int] = None
+
+
+class VLLMBackend:
+    """Wraps a locally loaded `flex_infer.VLLM` model so that it accepts `GenerationSettings`
+    like the other backends.
+
+    Args:
+        model (Any): The loaded `flex_infer.VLLM` model.
+    """
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+
+    def generate(self, prompts: List[str], generation_params: Any, **kwargs: Any) -> List[Any]:
+        """Converts the generation parameters and generates with the wrapped model, see
+        `flex_infer.VLLM.generate`."""
+        from flex_infer import GenerationParams
+
+        if isinstance(generation_params, GenerationSettings):
+            generation_params = GenerationParams(
+                **{
+                    key: value
+                    for key, value in generation_params._asdict().items()
+                    if value is not None
+                }
+            )
+
+        return self.model.generate(prompts, generation_params, **kwargs)
+
+
+class OpenAICompatibleBackend:
+    """Inference backend for OpenAI compatible chat completion servers such as vLLM.
+
+    It has the same `generate` interface as `flex_infer.VLLM`, so it can be used in place of a
+    locally loaded model. Requests are sent concurrently from a persistent event loop over a pool
+    of keep-alive connections and failed requests are retried with exponential backoff. Answer
+    choices are enforced with the `guided_choice` extension of vLLM.
+
+    Args:
+        base_url (str): Base URL of the API, e.g. "http://localhost:8000/v1".
+        model (str): Name of the model on the server.
+        max_concurrency (int, optional): Maximum number of requests in flight. Defaults to
+            API_MAX_CONCURRENCY.
+        max_retries (int, optional): Maximum number of retries per request. Defaults to
+            API_MAX_RETRIES.
+        backoff (float, optional): Initial backoff in seconds, doubled after each retry.
+            Defaults to API_BACKOFF_SECONDS.
+        timeout (float, optional): Timeout per request in seconds. Defaults to
+            API_TIMEOUT_SECONDS.
+        merge_system_prompt (bool, optional): Prepend the system prompt to the user message for
+            chat templates without a system role, e.g. gemma. Defaults to False.
+        api_key (Optional[str], optional): API key. Defaults to the OPENAI_API_KEY environment
+            variable.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        max_retries: int = API_MAX_RETRIES,
+        backoff: float = API_BACKOFF_SECONDS,
+        timeout: float = API_TIMEOUT_SECONDS,
+        merge_system_prompt: bool = False,
+        api_key: Optional[str] = None,
+    ) -> None:
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be a positive integer")
+
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.merge_system_prompt = merge_system_prompt
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.num_retries = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _messages(self, prompt: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        if not system_prompt:
+            return [{"role": "user", "content": prompt}]
+        if self.merge_system_prompt:
+            return [{"role": "user", "content": f"{system_prompt}\n\n{prompt}"}]
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _payload(
+        self,
+        prompt: str,
+        generation_params: Any,
+        choices: Optional[List[str]],
+        system_prompt: Optional[str],
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "messages": self._messages(prompt, system_prompt),
+            "temperature": getattr(generation_params, "temperature", 0.0),
+            "max_tokens": getattr(generation_params, "max_tokens", None),
+            "seed": getattr(generation_params, "seed", None),
+        }
+        if choices:
+            payload["guided_choice"] = choices
+        if getattr(generation_params, "logprobs", None):
+            payload["logprobs"] = True
+            payload["top_logprobs"] = generation_params.logprobs
+
+        return {key: value for key, value in payload.items() if value is not None}
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=headers,
+            )
+        return self._session
+
+    async def _request(
+        self, payload: Dict[str, Any], semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        session = await self._get_session()
+
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                try:
+                    async with session.post(self.url, json=payload) as response:
+                        if response.status not in RETRY_STATUS_CODES:
+                            response.raise_for_status()
+                            return await response.json()
+                        error: Exception = RuntimeError(f"Server returned {response.status}")
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = e
+
+            if attempt == self.max_retries:
+                raise RuntimeError(
+                    f"Request failed after {self.max_retries} retries: {error}"
+                ) from error
+
+            self.num_retries += 1
+            delay = self.backoff * 2**attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+    async def _generate_all(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*(self._request(payload, semaphore) for payload in payloads))
+
+    def generate(
+        self,
+        prompts: List[str],
+        generation_params: Any,
+        choices: Optional[List[str]] = None,
+        system_prompt: Optional[str] = None,
+        use_tqdm: bool = False,
+        return_type: str = "str",
+    ) -> List[Any]:
+        """Generates a completion for every prompt, in the order of the prompts.
+
+        Args:
+            prompts (List[str]): Prompts to complete.
+            generation_params (Any): Generation parameters with `temperature`, `max_tokens`,
+                `seed` and optionally `logprobs` attributes.
+            choices (Optional[List[str]], optional): Answer choices the output is restricted
+                to. Defaults to None.
+            system_prompt (Optional[str], optional): System prompt. Defaults to None.
+            use_tqdm (bool, optional): Unused, kept for interface compatibility. Defaults to
+                False.
+            return_type (str, optional): "str" for the generated texts or "request_output" for
+                objects shaped like vLLM request outputs that include logprobs. Defaults to
+                "str".
+
+        Returns:
+            List[Any]: Generated texts or request outputs.
+        """
+        if return_type not in ["str", "request_output"]:
+            raise ValueError(f"Return type {return_type} not supported.")
+
+        payloads = [
+            self._payload(prompt, generation_params, choices, system_prompt) for prompt in prompts
+        ]
+        responses = self._loop.run_until_complete(self._generate_all(payloads))
+
+        if return_type == "str":
+            return [response["choices"][0]["message"]["content"] for response in responses]
+
+        return [to_request_output(response) for response in responses]
+
+    def close(self) -> None:
+        """Closes the connection pool and the event loop."""
+        if self._session is not None:
+            self._loop.run_until_complete(self._session.close())
+            self._session = None
+        self._loop.close()
+
+
+def to_request_output(response: Dict[str, Any]) -> SimpleNamespace:
+    """Converts a chat completion response into the shape of a vLLM request output, i.e.
+    `outputs[0].text` and `outputs[0].logprobs` as a list of dicts of objects with `logprob` and
+    `decoded_token` attributes per generated token.
+
+    Args:
+        response (Dict[str, Any]): Parsed chat completion response.
+
+    Returns:
+        SimpleNamespace: The request output with the token `usage` of the response, if any.
+    """
+    choice = response["choices"][0]
+    usage = response.get("usage")
+    content = (choice.get("logprobs") or {}).get("content") or []
+
+    logprobs = [
+        {
+            i: SimpleNamespace(decoded_token=top["token"], logprob=top["logprob"])
+            for i, top in enumerate(position.get("top_logprobs") or [position])
+        }
+        for position in content
+    ]
+
+    return SimpleNamespace(
+        outputs=[SimpleNamespace(text=choice["message"]["content"], logprobs=logprobs or None)],
+        usage=SimpleNamespace(**usage) if usage else None,
+    )
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.settings import PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_PATH
+
+# number of keys per SQL statement, below the SQLite host parameter limit
+_QUERY_BATCH_SIZE = 500
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """Hashes everything besides the prompt that determines a prediction, e.g. the model
+    settings, the system prompt and the generation parameters.
+
+    Args:
+        config (Dict[str, Any]): JSON serializable configuration.
+
+    Returns:
+        str: Hex digest of the configuration.
+    """
+    serialized = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def prediction_key(fingerprint: str, prompt: str) -> str:
+    """Computes the content address of a single prediction.
+
+    Args:
+        fingerprint (str): Configuration fingerprint, see `config_fingerprint`.
+        prompt (str): Fully formatted prompt, i.e. the template filled with the row text.
+
+    Returns:
+        str: Hex digest used as cache key.
+    """
+    return hashlib.sha256(f"{fingerprint}\x1f{prompt}".encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """Persistent content-addressed cache for model predictions backed by SQLite.
+
+    Each entry holds a label and, if it was generated with logprobs, the logprob margin of the
+    label. Entries are evicted in least recently used order once the cache holds more than
+    `max_entries` predictions. The number of entries is counted once when the cache is opened
+    and then kept up to date with the inserted and evicted entries, so entries that other
+    processes add to a shared cache are only counted once it is reopened. Hits and misses are
+    counted for reporting.
+
+    Args:
+        path (str, optional): Path of the SQLite database. Defaults to PREDICTION_CACHE_PATH.
+        max_entries (int, optional): Maximum number of cached predictions. Defaults to
+            PREDICTION_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(
+        self, path: str = PREDICTION_CACHE_PATH, max_entries: int = PREDICTION_CACHE_MAX_ENTRIES
+    ) -> None:
+        if max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions "
+            "(key TEXT PRIMARY KEY, prediction TEXT NOT NULL, margin REAL, last_used REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(predictions)")]
+        if "margin" not in columns:
+            self._conn.execute("ALTER TABLE predictions ADD COLUMN margin REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)"
+        )
+        self._conn.commit()
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+
+    def get_many(
+        self, keys: List[str], require_margin: bool = False
+    ) -> Dict[str, Tuple[str, Optional[float]]]:
+        """Looks up predictions and marks the found entries as recently used.
+
+        Args:
+            keys (List[str]): Cache keys to look up.
+            require_margin (bool, optional): Only return entries that have a margin. Defaults to
+                False.
+
+        Returns:
+            Dict[str, Tuple[str, Optional[float]]]: Cached label and margin for the keys that
+                were found.
+        """
+        found: Dict[str, Tuple[str, Optional[float]]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        margin_filter = " AND margin IS NOT NULL" if require_margin else ""
+        now = time.time()
+
+        for start in range(0, len(unique_keys), _QUERY_BATCH_SIZE):
+            batch = unique_keys[start : start + _QUERY_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                "SELECT key, prediction, margin FROM predictions "
+                f"WHERE key IN ({placeholders}){margin_filter}",
+                batch,
+            ).fetchall()
+            found.update((key, (prediction, margin)) for key, prediction, margin in rows)
+            self._conn.execute(
+                f"UPDATE predictions SET last_used = ? WHERE key IN ({placeholders})",
+                [now, *batch],
+            )
+        self._conn.commit()
+
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+
+        return found
+
+    def put_many(self, items: Dict[str, Tuple[str, Optional[float]]]) -> None:
+        """Stores predictions and evicts the least recently used entries if the cache is full.
+        An existing margin is kept if the new entry has none.
+
+        Args:
+            items (Dict[str, Tuple[str, Optional[float]]]): Label and margin keyed by cache key.
+        """
+        now = time.time()
+        keys = list(items)
+        for start in range(0, len(keys), _QUERY_BATCH_SIZE):
+            batch = keys[start : start + _QUERY_BATCH_SIZE]
+            (existing,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM predictions WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchone()
+            self._count += len(batch) - existing
+
+        self._conn.executemany(
+            "INSERT INTO predictions (key, prediction, margin, last_used) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET prediction = excluded.prediction, "
+            "margin = COALESCE(excluded.margin, margin), last_used = excluded.last_used",
+            [(key, prediction, margin, now) for key, (prediction, margin) in items.items()],
+        )
+        self._conn.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """Removes the least recently used entries until at most `max_entries` remain.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        excess = self._count - self.max_entries
+
+        if excess <= 0:
+            return 0
+
+        removed = self._conn.execute(
+            "DELETE FROM predictions WHERE key IN "
+            "(SELECT key FROM predictions ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self._conn.commit()
+        self._count -= removed
+        self.evictions += removed
+
+        return removed
+
+    def __len__(self) -> int:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        return count
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Returns the hit/miss counters of this session.
+
+        Returns:
+            Dict[str, Optional[float]]: Hits, misses, evictions, hit rate and cache size.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        self._conn.close()
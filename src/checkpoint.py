@@ -0,0 +1,121 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.settings import CHECKPOINT_DIR, ROW_ID_COLUMN
+
+
+def run_fingerprint(
+    model_name: str,
+    template: str,
+    system_prompt: str,
+    seed: int,
+    settings: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Computes a short fingerprint for a labeling run. Checkpoints are only reused by runs with
+    the same fingerprint.
+
+    Args:
+        model_name (str): Name of the model.
+        template (str): Prompt template.
+        system_prompt (str): System prompt.
+        seed (int): Random seed used for generation.
+        settings (Optional[Dict[str, Any]], optional): Further JSON serializable settings that
+            change the outputs of the run, e.g. its output columns. Runs without settings keep
+            the fingerprint of earlier runs. Defaults to None.
+
+    Returns:
+        str: Hex digest identifying the run configuration.
+    """
+    parts = [model_name, template, system_prompt, str(seed)]
+    if settings:
+        parts.append(json.dumps(settings, sort_keys=True))
+    key = "\x1f".join(parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def write_parquet_atomic(
+    df: pd.DataFrame,
+    path: str,
+    metadata: Optional[Dict[str, str]] = None,
+    row_group_size: Optional[int] = None,
+) -> None:
+    """Writes a DataFrame to a Parquet file via a temporary file and an atomic rename, so that
+    readers never see a partially written file.
+
+    Args:
+        df (pd.DataFrame): DataFrame to write.
+        path (str): Destination path.
+        metadata (Optional[Dict[str, str]], optional): Key-value metadata added to the schema.
+            Defaults to None.
+        row_group_size (Optional[int], optional): Maximum number of rows per row group.
+            Defaults to None.
+    """
+    directory, file_name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{file_name}.tmp")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+
+    pq.write_table(table, tmp_path, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+
+class CheckpointStore:
+    """Stores completed predictions of a labeling run as numbered Parquet parts keyed by row id.
+
+    Args:
+        model_name (str): Name of the model.
+        fingerprint (str): Fingerprint of the run, see `run_fingerprint`.
+        checkpoint_dir (str, optional): Base directory for checkpoints. Defaults to
+            CHECKPOINT_DIR.
+    """
+
+    def __init__(self, model_name: str, fingerprint: str, checkpoint_dir: str = CHECKPOINT_DIR):
+        self.path = os.path.join(checkpoint_dir, f"{model_name}_{fingerprint}")
+        self._next_part = len(self._part_files())
+
+    def _part_files(self) -> list:
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+
+    def save(self, outputs: pd.DataFrame) -> None:
+        """Persists a batch of completed predictions as a new checkpoint part.
+
+        Args:
+            outputs (pd.DataFrame): Row id column and the output columns of the labeled rows.
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        write_parquet_atomic(
+            outputs, os.path.join(self.path, f"part-{self._next_part:06d}.parquet")
+        )
+        self._next_part += 1
+
+    def load(self) -> pd.DataFrame:
+        """Loads all completed predictions.
+
+        Returns:
+            pd.DataFrame: Output columns indexed by row id. Empty if there is no checkpoint.
+        """
+        parts = [pd.read_parquet(f) for f in self._part_files()]
+
+        if not parts:
+            return pd.DataFrame(index=pd.Index([], name=ROW_ID_COLUMN))
+
+        completed = pd.concat(parts, ignore_index=True)
+        completed = completed.drop_duplicates(subset=ROW_ID_COLUMN, keep="last")
+
+        return completed.set_index(ROW_ID_COLUMN)
+
+    def clear(self) -> None:
+        """Removes all checkpoint parts of this run."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._next_part = 0
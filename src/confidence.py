@@ -0,0 +1,298 @@
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.label_store import LabelStore
+from src.settings import ROW_ID_COLUMN
+
+
+def choice_logprobs(token_logprobs: Dict[Any, Any], choices: List[str]) -> Dict[str, float]:
+    """Assigns the top logprobs of the first generated token to the answer choices. A token
+    counts towards a choice if it is a prefix of the choice, e.g. "go" for "good".
+
+    Args:
+        token_logprobs (Dict[Any, Any]): vLLM logprobs of one position, mapping token ids to
+            objects with `logprob` and `decoded_token` attributes.
+        choices (List[str]): Answer choices.
+
+    Returns:
+        Dict[str, float]: Highest logprob per choice, -inf for choices without a matching token.
+    """
+    best = {choice: -math.inf for choice in choices}
+
+    for logprob in token_logprobs.values():
+        token = (logprob.decoded_token or "").strip().lower()
+        if not token:
+            continue
+        for choice in choices:
+            if choice.startswith(token):
+                best[choice] = max(best[choice], logprob.logprob)
+
+    return best
+
+
+def label_margins(outputs: List[Any], choices: List[str]) -> Tuple[List[str], List[float]]:
+    """Extracts the label and its logprob margin over the best other choice from vLLM request
+    outputs that were generated with logprobs.
+
+    Args:
+        outputs (List[Any]): vLLM RequestOutput objects.
+        choices (List[str]): Answer choices.
+
+    Returns:
+        Tuple[List[str], List[float]]: Labels and margins. The margin is infinite if no other
+            choice appears in the top logprobs and 0 if the logprobs are missing.
+    """
+    labels, margins = [], []
+
+    for output in outputs:
+        completion = output.outputs[0]
+        label = completion.text.strip()
+        labels.append(label)
+
+        if not completion.logprobs or label not in choices:
+            margins.append(0.0)
+            continue
+
+        best = choice_logprobs(completion.logprobs[0], choices)
+        other = max(best[choice] for choice in choices if choice != label)
+        margin = best[label] - other if best[label] > -math.inf else 0.0
+        margins.append(margin)
+
+    return labels, margins
+
+
+def score_choices(outputs: List[Any], choices: List[str]) -> Tuple[List[str], List[float]]:
+    """Labels outputs of a single generated token with the choice that has the highest logprob
+    and computes its margin over the best other choice, so that a label only needs one decoding
+    step.
+
+    Args:
+        outputs (List[Any]): vLLM RequestOutput objects generated with logprobs.
+        choices (List[str]): Answer choices.
+
+    Returns:
+        Tuple[List[str], List[float]]: Labels and margins. Without logprobs of any choice, the
+            label is the choice the generated token is a prefix of and the margin is 0.
+    """
+    labels, margins = [], []
+
+    for output in outputs:
+        completion = output.outputs[0]
+        best = choice_logprobs(completion.logprobs[0], choices) if completion.logprobs else {}
+        ranked = sorted(best, key=best.get, reverse=True)
+
+        if not ranked or best[ranked[0]] == -math.inf:
+            token = completion.text.strip().lower()
+            matches = [choice for choice in choices if token and choice.startswith(token)]
+            labels.append(matches[0] if len(matches) == 1 else completion.text.strip())
+            margins.append(0.0)
+            continue
+
+        labels.append(ranked[0])
+        margins.append(best[ranked[0]] - best[ranked[1]])
+
+    return labels, margins
+
+
+def bad_probability(
+    labels: pd.Series, margins: pd.Series, bad_label: str = "bad", good_label: str = "good"
+) -> np.ndarray:
+    """Converts labels and their logprob margins into the probability of the bad label,
+    normalized over the two labels.
+
+    Args:
+        labels (pd.Series): Labels.
+        margins (pd.Series): Logprob margins of the labels over the other label.
+        bad_label (str, optional): The bad label. Defaults to "bad".
+        good_label (str, optional): The good label. Defaults to "good".
+
+    Returns:
+        np.ndarray: float32 probability of the bad label, NaN for missing or other labels.
+    """
+    margins = margins.to_numpy(dtype=np.float64)
+    with np.errstate(over="ignore"):
+        p_label = 1.0 / (1.0 + np.exp(-margins))
+
+    p_bad = np.full(len(labels), np.nan)
+    is_bad = (labels == bad_label).to_numpy()
+    is_good = (labels == good_label).to_numpy()
+    p_bad[is_bad] = p_label[is_bad]
+    p_bad[is_good] = 1.0 - p_label[is_good]
+
+    return p_bad.astype(np.float32)
+
+
+class CascadeStage:
+    """Labels of a previous, cheaper model that are kept if their logprob margin reaches the
+    threshold. Rows below the threshold are escalated to the current model.
+
+    Args:
+        model_name (str): Name of the previous model.
+        predictions (pd.DataFrame): Output of the previous model indexed by row id with a
+            `<model_name>_prediction` and a `<model_name>_margin` column and optionally a
+            `<model_name>_stage` column.
+        threshold (float): Minimal margin to keep a label.
+    """
+
+    def __init__(self, model_name: str, predictions: pd.DataFrame, threshold: float) -> None:
+        self.model_name = model_name
+        self.predictions = predictions
+        self.threshold = threshold
+        self.rows = 0
+        self.kept = 0
+
+    @classmethod
+    def from_label_store(
+        cls, model_name: str, threshold: float, label_store: Optional[LabelStore] = None
+    ) -> "CascadeStage":
+        """Reads the stored labels of the previous model, see `add_labels_to_dataset.py`. Only
+        the prediction, margin and stage columns of the model are read.
+
+        Args:
+            model_name (str): Name of the previous model.
+            threshold (float): Minimal margin to keep a label.
+            label_store (Optional[LabelStore], optional): Label store with the labels of the
+                previous model. Defaults to the default label store.
+
+        Raises:
+            FileNotFoundError: If no labels of the model are stored.
+            ValueError: If the labels were stored without margins.
+
+        Returns:
+            CascadeStage: The cascade stage.
+        """
+        label_store = label_store if label_store is not None else LabelStore()
+        path = label_store.path(model_name)
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Labels of {model_name} not found at {path}")
+
+        wanted = cls._columns(model_name, pq.read_schema(path).names)
+        predictions = label_store.read_labels([model_name], columns=wanted)
+        # the label store keeps the labels dictionary encoded
+        prediction_column = f"{model_name}_prediction"
+        predictions[prediction_column] = predictions[prediction_column].astype(object)
+
+        return cls(model_name, predictions, threshold)
+
+    @classmethod
+    def from_file(
+        cls, model_name: str, threshold: float, prediction_dir: str = "./data/"
+    ) -> "CascadeStage":
+        """Reads the output of the previous model before it was added to the label store.
+
+        Args:
+            model_name (str): Name of the previous model.
+            threshold (float): Minimal margin to keep a label.
+            prediction_dir (str, optional): Path of the prediction files. Defaults to "./data/".
+
+        Raises:
+            FileNotFoundError: If the predictions file is not found.
+            ValueError: If the predictions were stored without margins.
+
+        Returns:
+            CascadeStage: The cascade stage.
+        """
+        path = os.path.join(prediction_dir, f"labeled_data_{model_name}.parquet")
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Predictions file for {model_name} not found at {path}")
+
+        wanted = cls._columns(model_name, pq.read_schema(path).names)
+        predictions = pd.read_parquet(path, columns=[ROW_ID_COLUMN] + wanted)
+
+        return cls(model_name, predictions.set_index(ROW_ID_COLUMN), threshold)
+
+    @staticmethod
+    def _columns(model_name: str, schema_columns: List[str]) -> List[str]:
+        """Returns the columns of the previous model that the cascade needs.
+
+        Raises:
+            ValueError: If the previous model was run without margins.
+        """
+        if f"{model_name}_margin" not in schema_columns:
+            raise ValueError(
+                f"Predictions of {model_name} have no margins. Run it with --store_margins."
+            )
+
+        wanted = [f"{model_name}_prediction", f"{model_name}_margin"]
+        if f"{model_name}_stage" in schema_columns:
+            wanted.append(f"{model_name}_stage")
+
+        return wanted
+
+    def margins(self, row_ids: pd.Series) -> pd.Series:
+        """Looks up the margins of the previous model.
+
+        Args:
+            row_ids (pd.Series): Row ids to look up.
+
+        Returns:
+            pd.Series: Margins aligned with `row_ids`, missing for unknown rows.
+        """
+        margins = self.predictions[f"{self.model_name}_margin"].reindex(row_ids.to_numpy())
+        return pd.Series(margins.to_numpy(dtype=float), index=row_ids.index)
+
+    def decide(self, row_ids: pd.Series) -> Tuple[pd.Series, pd.Series, pd.Series]:
+        """Keeps the previous labels of the given rows if they are confident enough. The rows
+        count towards the escalation statistics of this stage.
+
+        Args:
+            row_ids (pd.Series): Row ids of the rows to decide.
+
+        Returns:
+            Tuple[pd.Series, pd.Series, pd.Series]: Kept labels (missing for escalated rows),
+                the margins of the previous model and the stage that decided each kept row, all
+                aligned with `row_ids`.
+        """
+        previous = self.predictions.reindex(row_ids.to_numpy())
+        previous.index = row_ids.index
+
+        margins = previous[f"{self.model_name}_margin"].astype(float)
+        keep = margins >= self.threshold
+
+        # rows that an earlier stage of a longer cascade decided keep that stage
+        stages = pd.Series(f"model:{self.model_name}", index=row_ids.index, dtype=object)
+        stage_column = f"{self.model_name}_stage"
+        if stage_column in previous.columns:
+            earlier = previous[stage_column].fillna("model") != "model"
+            stages = stages.where(~earlier, previous[stage_column])
+
+        self.rows += len(row_ids)
+        self.kept += int(keep.sum())
+
+        return previous[f"{self.model_name}_prediction"].where(keep), margins, stages.where(keep)
+
+    def report(self) -> Dict[str, Optional[float]]:
+        """Returns the escalation statistics of this stage.
+
+        Returns:
+            Dict[str, Optional[float]]: Number of rows, kept and escalated rows and the
+                escalation rate.
+        """
+        escalated = self.rows - self.kept
+        return {
+            "stage": self.model_name,
+            "threshold": self.threshold,
+            "rows": self.rows,
+            "kept": self.kept,
+            "escalated": escalated,
+            "escalation_rate": escalated / self.rows if self.rows else None,
+        }
+
+    def save_report(self, model_name: str, path: str = "./data/cascade_report_{}.json") -> None:
+        """Writes the escalation statistics to a JSON file.
+
+        Args:
+            model_name (str): Name of the current model, used in the file name.
+            path (str, optional): File path template. Defaults to
+                "./data/cascade_report_{}.json".
+        """
+        with open(path.format(model_name), "w") as f:
+            json.dump(self.report(), f, indent=2)
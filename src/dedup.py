@@ -0,0 +1,264 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.settings import (
+    NEAR_DEDUP_BATCH_SIZE,
+    NEAR_DEDUP_NGRAM_SIZE,
+    NEAR_DEDUP_NUM_BANDS,
+    NEAR_DEDUP_NUM_PERM,
+    NEAR_DEDUP_THRESHOLD,
+    RANDOM_SEED,
+)
+
+DEDUP_MODES = ["none", "exact", "normalized", "near"]
+
+# multiplier of the rolling n-gram hash
+_HASH_PRIME = np.uint64(1_099_511_628_211)
+
+
+def normalize_text(texts: pd.Series) -> pd.Series:
+    """Normalizes texts for duplicate detection by lower casing them and collapsing whitespace.
+
+    Args:
+        texts (pd.Series): Texts to normalize.
+
+    Returns:
+        pd.Series: Normalized texts. Missing values become empty strings.
+    """
+    return texts.fillna("").astype(str).str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def ngram_hashes(
+    texts: pd.Series, ngram_range: Tuple[int, int], salt: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashes the byte n-grams of texts in a vectorized way. The texts are lowercased and padded
+    with spaces, so that n-grams at the start and the end of a word differ from the same
+    n-grams inside a word.
+
+    Args:
+        texts (pd.Series): Texts, missing values are treated as empty strings.
+        ngram_range (Tuple[int, int]): Smallest and largest n-gram length in bytes.
+        salt (int, optional): Seed of the hashes, e.g. to tell the columns of a pair apart.
+            Defaults to 0.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Row of each n-gram, sorted by n-gram length, and the
+            uint64 hash of each n-gram.
+    """
+    if len(texts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+
+    array = pa.array(texts.to_numpy(dtype=object), type=pa.large_string(), from_pandas=True)
+    space, empty = pa.scalar(" ", pa.large_string()), pa.scalar("", pa.large_string())
+    array = pc.binary_join_element_wise(
+        space, pc.utf8_lower(pc.fill_null(array, empty)), space, empty
+    )
+
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[
+        array.offset : array.offset + len(array) + 1
+    ]
+    data = np.frombuffer(array.buffers()[2], dtype=np.uint8)[offsets[0] : offsets[-1]]
+    offsets = offsets - offsets[0]
+    row_of_byte = np.repeat(np.arange(len(array)), np.diff(offsets))
+
+    rows, hashes = [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        num_starts = len(data) - n + 1
+        if num_starts <= 0:
+            continue
+        h = np.full(num_starts, salt * 64 + n, dtype=np.uint64)
+        for k in range(n):
+            h = h * _HASH_PRIME + data[k : k + num_starts]
+        starts = row_of_byte[:num_starts]
+        valid = np.arange(num_starts) + n <= offsets[starts + 1]
+        rows.append(starts[valid])
+        hashes.append(h[valid])
+
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    return np.concatenate(rows), np.concatenate(hashes)
+
+
+def pair_fingerprints(df: pd.DataFrame, columns_to_use: List[str], normalize: bool) -> np.ndarray:
+    """Computes a 64 bit fingerprint of the text pair in each row.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the text pairs.
+        columns_to_use (List[str]): Columns that make up the pair.
+        normalize (bool): Whether to normalize whitespace and case before hashing.
+
+    Returns:
+        np.ndarray: One uint64 fingerprint per row.
+    """
+    pairs = df[columns_to_use]
+
+    if normalize:
+        pairs = pairs.apply(normalize_text)
+
+    return pd.util.hash_pandas_object(pairs, index=False).to_numpy()
+
+
+def minhash_signatures(
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    num_perm: int = NEAR_DEDUP_NUM_PERM,
+    ngram_size: int = NEAR_DEDUP_NGRAM_SIZE,
+    batch_size: int = NEAR_DEDUP_BATCH_SIZE,
+    seed: int = RANDOM_SEED,
+) -> np.ndarray:
+    """Computes MinHash signatures of the text pairs. The shingles of a pair are the byte
+    n-grams of its normalized texts, hashed separately for each column, so that the share of
+    equal signature values estimates the Jaccard similarity of two pairs.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the text pairs.
+        columns_to_use (List[str]): Columns that make up the pair.
+        num_perm (int, optional): Number of hash functions. Defaults to NEAR_DEDUP_NUM_PERM.
+        ngram_size (int, optional): Length of the shingles in bytes. Defaults to
+            NEAR_DEDUP_NGRAM_SIZE.
+        batch_size (int, optional): Number of rows hashed at once. Defaults to
+            NEAR_DEDUP_BATCH_SIZE.
+        seed (int, optional): Seed of the hash functions. Defaults to RANDOM_SEED.
+
+    Returns:
+        np.ndarray: uint32 signatures with one row per row of `df` and `num_perm` columns.
+            Pairs without shingles have the maximal value everywhere.
+    """
+    rng = np.random.default_rng(seed)
+    # random odd multipliers and offsets of the hash functions h(x) = (a * x + b) mod 2**64
+    multipliers = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(
+        2
+    ) + np.uint64(1)
+    offsets = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(df), num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+    for low in range(0, len(df), batch_size):
+        batch = df.iloc[low : low + batch_size]
+        rows, hashes = zip(
+            *(
+                ngram_hashes(normalize_text(batch[column]), (ngram_size, ngram_size), salt)
+                for salt, column in enumerate(columns_to_use)
+            )
+        )
+        rows, hashes = np.concatenate(rows), np.concatenate(hashes)
+
+        # the shingles of each row are grouped by row, repeated shingles do not change the minimum
+        order = np.argsort(rows, kind="stable")
+        rows, hashes = rows[order], hashes[order]
+        starts = np.searchsorted(rows, np.arange(len(batch)))
+        has_shingles = np.bincount(rows, minlength=len(batch)) > 0
+        if not has_shingles.any():
+            continue
+
+        positions = low + np.flatnonzero(has_shingles)
+        permuted = np.empty_like(hashes)
+        for k in range(num_perm):
+            np.multiply(hashes, multipliers[k], out=permuted)
+            np.add(permuted, offsets[k], out=permuted)
+            np.right_shift(permuted, np.uint64(32), out=permuted)
+            signatures[positions, k] = np.minimum.reduceat(permuted, starts[has_shingles])
+
+    return signatures
+
+
+def near_duplicate_clusters(
+    signatures: np.ndarray,
+    num_bands: int = NEAR_DEDUP_NUM_BANDS,
+    threshold: float = NEAR_DEDUP_THRESHOLD,
+) -> np.ndarray:
+    """Groups rows with similar MinHash signatures with LSH banding. Rows that share all
+    values of a band become candidates of the first row with these values, and a candidate
+    joins its cluster if the share of equal signature values reaches the threshold. Clusters
+    are the connected components of the accepted pairs.
+
+    Args:
+        signatures (np.ndarray): MinHash signatures, see `minhash_signatures`.
+        num_bands (int, optional): Number of bands, must divide the signature length. Defaults
+            to NEAR_DEDUP_NUM_BANDS.
+        threshold (float, optional): Minimal estimated Jaccard similarity of two rows of a
+            cluster. Defaults to NEAR_DEDUP_THRESHOLD.
+
+    Raises:
+        ValueError: If the number of bands does not divide the signature length.
+
+    Returns:
+        np.ndarray: For every row, the position of the first row of its cluster.
+    """
+    num_rows, num_perm = signatures.shape
+    if num_bands <= 0 or num_perm % num_bands:
+        raise ValueError(f"{num_bands} bands do not divide signatures of length {num_perm}.")
+
+    band_size = num_perm // num_bands
+    left, right = [], []
+    for band in range(num_bands):
+        values = signatures[:, band * band_size : (band + 1) * band_size]
+        keys = pd.util.hash_pandas_object(pd.DataFrame(values), index=False).to_numpy()
+        codes, _ = pd.factorize(keys)
+        _, first_positions = np.unique(codes, return_index=True)
+        firsts = first_positions[codes]
+
+        candidates = np.flatnonzero(firsts != np.arange(num_rows))
+        similarity = (signatures[candidates] == signatures[firsts[candidates]]).mean(axis=1)
+        accepted = candidates[similarity >= threshold]
+        left.append(accepted)
+        right.append(firsts[accepted])
+
+    left, right = np.concatenate(left), np.concatenate(right)
+
+    # propagates the smallest position through the accepted pairs, with pointer jumping
+    clusters = np.arange(num_rows)
+    while True:
+        smallest = np.minimum(clusters[left], clusters[right])
+        updated = clusters.copy()
+        np.minimum.at(updated, left, smallest)
+        np.minimum.at(updated, right, smallest)
+        updated = updated[updated]
+        if (updated == clusters).all():
+            return clusters
+        clusters = updated
+
+
+def collapse_duplicates(
+    df: pd.DataFrame, columns_to_use: List[str], mode: str = "exact"
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Collapses rows with duplicate text pairs to their first occurrence.
+
+    Labels computed for the unique rows can be broadcast back to all rows with
+    `unique_labels[codes]`.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the text pairs.
+        columns_to_use (List[str]): Columns that make up the pair.
+        mode (str, optional): One of DEDUP_MODES. "exact" collapses identical pairs,
+            "normalized" also collapses pairs that only differ in whitespace or case, "near"
+            collapses clusters of near-duplicate pairs, see `near_duplicate_clusters`, and
+            "none" keeps every row. Defaults to "exact".
+
+    Raises:
+        ValueError: If the mode is not supported.
+
+    Returns:
+        Tuple[pd.DataFrame, np.ndarray]: The unique rows in order of first appearance and, for
+            every row of `df`, the position of its representative in the unique rows.
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Dedup mode {mode} not supported. Choose from {DEDUP_MODES}.")
+
+    if mode == "none" or len(df) == 0:
+        return df, np.arange(len(df))
+
+    if mode == "near":
+        codes, _ = pd.factorize(
+            near_duplicate_clusters(minhash_signatures(df, columns_to_use)), sort=False
+        )
+    else:
+        fingerprints = pair_fingerprints(df, columns_to_use, normalize=mode == "normalized")
+        codes, _ = pd.factorize(fingerprints)
+    _, first_positions = np.unique(codes, return_index=True)
+
+    return df.iloc[first_positions], codes
@@ -0,0 +1,390 @@
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.dedup import ngram_hashes
+from src.settings import (
+    DISTILL_BATCH_SIZE,
+    DISTILL_CONFIDENCE_THRESHOLD,
+    DISTILL_EPOCHS,
+    DISTILL_HASH_BITS,
+    DISTILL_HOLDOUT,
+    DISTILL_LEARNING_RATE,
+    DISTILL_NGRAM_RANGE,
+    DISTILL_SAMPLE_SIZE,
+    RANDOM_SEED,
+    ROW_ID_COLUMN,
+)
+
+# multiplier of the bit mixing of the n-gram hashes (Fibonacci hashing)
+_HASH_MIX = np.uint64(11_400_714_819_323_198_485)
+
+
+class Features(NamedTuple):
+    """Sparse feature matrix in coordinate format with the entries sorted by row.
+
+    Attributes:
+        rows (np.ndarray): Row of each entry.
+        columns (np.ndarray): Feature index of each entry.
+        values (np.ndarray): float32 value of each entry.
+        num_rows (int): Number of rows, including rows without entries.
+    """
+
+    rows: np.ndarray
+    columns: np.ndarray
+    values: np.ndarray
+    num_rows: int
+
+    def row_pointers(self) -> np.ndarray:
+        """Start of the entries of each row and the end of the last row."""
+        return np.searchsorted(self.rows, np.arange(self.num_rows + 1))
+
+    def take(self, rows: np.ndarray) -> "Features":
+        """Selects rows in the given order."""
+        pointers = self.row_pointers()
+        starts = pointers[rows]
+        lengths = pointers[rows + 1] - starts
+        ends = np.cumsum(lengths)
+        entries = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            starts - ends + lengths, lengths
+        )
+
+        return Features(
+            np.repeat(np.arange(len(rows)), lengths),
+            self.columns[entries],
+            self.values[entries],
+            len(rows),
+        )
+
+
+def hash_features(
+    df: pd.DataFrame,
+    columns: List[str],
+    hash_bits: int = DISTILL_HASH_BITS,
+    ngram_range: Tuple[int, int] = DISTILL_NGRAM_RANGE,
+) -> Features:
+    """Counts the hashed character n-grams of the text columns. N-grams are taken over the
+    UTF-8 bytes of the lowercased texts and hashed into 2**hash_bits features, separately for
+    each column. The counts of each row are L2 normalized.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the text columns.
+        columns (List[str]): Text columns.
+        hash_bits (int, optional): Number of bits of the feature index. Defaults to
+            DISTILL_HASH_BITS.
+        ngram_range (Tuple[int, int], optional): Smallest and largest n-gram length. Defaults to
+            DISTILL_NGRAM_RANGE.
+
+    Returns:
+        Features: Sparse features with one row per row of `df`.
+    """
+    rows, hashes = zip(
+        *(ngram_hashes(df[column], ngram_range, salt) for salt, column in enumerate(columns))
+    )
+    columns_ = (np.concatenate(hashes) * _HASH_MIX) >> np.uint64(64 - hash_bits)
+    keys = (np.concatenate(rows).astype(np.int64) << hash_bits) | columns_.astype(np.int64)
+    keys, counts = np.unique(keys, return_counts=True)
+
+    rows = keys >> hash_bits
+    values = counts.astype(np.float32)
+    norms = np.sqrt(np.bincount(rows, weights=values**2, minlength=len(df)))
+    values /= norms[rows].astype(np.float32)
+
+    return Features(rows, keys & ((1 << hash_bits) - 1), values, len(df))
+
+
+class HashedNgramClassifier:
+    """Logistic regression on hashed character n-grams, trained with mini-batch AdaGrad in
+    NumPy. The bad label is the positive class.
+
+    Args:
+        hash_bits (int, optional): Number of bits of the feature index. Defaults to
+            DISTILL_HASH_BITS.
+        ngram_range (Tuple[int, int], optional): Smallest and largest n-gram length. Defaults to
+            DISTILL_NGRAM_RANGE.
+        epochs (int, optional): Number of passes over the training rows. Defaults to
+            DISTILL_EPOCHS.
+        learning_rate (float, optional): AdaGrad learning rate. Defaults to
+            DISTILL_LEARNING_RATE.
+        l2 (float, optional): L2 penalty of the weights. Defaults to 1e-6.
+        batch_size (int, optional): Number of rows per update. Defaults to 256.
+        seed (int, optional): Seed of the shuffling. Defaults to RANDOM_SEED.
+    """
+
+    def __init__(
+        self,
+        hash_bits: int = DISTILL_HASH_BITS,
+        ngram_range: Tuple[int, int] = DISTILL_NGRAM_RANGE,
+        epochs: int = DISTILL_EPOCHS,
+        learning_rate: float = DISTILL_LEARNING_RATE,
+        l2: float = 1e-6,
+        batch_size: int = 256,
+        seed: int = RANDOM_SEED,
+    ) -> None:
+        self.hash_bits = hash_bits
+        self.ngram_range = ngram_range
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.batch_size = batch_size
+        self.seed = seed
+        self.weights = np.zeros(2**hash_bits, dtype=np.float64)
+        self.bias = 0.0
+
+    def features(self, df: pd.DataFrame, columns: List[str]) -> Features:
+        return hash_features(df, columns, self.hash_bits, self.ngram_range)
+
+    def fit(self, features: Features, is_bad: np.ndarray) -> "HashedNgramClassifier":
+        """Trains the classifier from scratch.
+
+        Args:
+            features (Features): Features of the training rows.
+            is_bad (np.ndarray): Boolean target of each row.
+
+        Returns:
+            HashedNgramClassifier: The trained classifier.
+        """
+        rng = np.random.default_rng(self.seed)
+        self.weights = np.zeros(2**self.hash_bits, dtype=np.float64)
+        self.bias = 0.0
+        squared_gradients = np.full(len(self.weights), 1e-8)
+        bias_squared_gradient = 1e-8
+        is_bad = np.asarray(is_bad, dtype=np.float64)
+
+        for _ in range(self.epochs):
+            order = rng.permutation(features.num_rows)
+            shuffled = features.take(order)
+            targets = is_bad[order]
+            pointers = shuffled.row_pointers()
+
+            for low in range(0, features.num_rows, self.batch_size):
+                high = min(low + self.batch_size, features.num_rows)
+                entries = slice(pointers[low], pointers[high])
+                rows = shuffled.rows[entries] - low
+                columns = shuffled.columns[entries]
+                values = shuffled.values[entries]
+
+                logits = np.bincount(rows, values * self.weights[columns], high - low) + self.bias
+                errors = (_sigmoid(logits) - targets[low:high]) / (high - low)
+
+                # AdaGrad only updates the features of the batch
+                touched, inverse = np.unique(columns, return_inverse=True)
+                gradients = np.bincount(inverse, values * errors[rows], len(touched))
+                gradients += self.l2 * self.weights[touched]
+                squared_gradients[touched] += gradients**2
+                self.weights[touched] -= (
+                    self.learning_rate * gradients / np.sqrt(squared_gradients[touched])
+                )
+
+                bias_gradient = errors.sum()
+                bias_squared_gradient += bias_gradient**2
+                self.bias -= self.learning_rate * bias_gradient / np.sqrt(bias_squared_gradient)
+
+        return self
+
+    def decision_function(self, features: Features) -> np.ndarray:
+        """Log-odds of the bad label for each row."""
+        return (
+            np.bincount(
+                features.rows,
+                features.values * self.weights[features.columns],
+                features.num_rows,
+            )
+            + self.bias
+        )
+
+    def predict_logits(
+        self, df: pd.DataFrame, columns: List[str], batch_size: int = DISTILL_BATCH_SIZE
+    ) -> np.ndarray:
+        """Log-odds of the bad label for the rows of a DataFrame, featurized in batches.
+
+        Args:
+            df (pd.DataFrame): DataFrame with the text columns.
+            columns (List[str]): Text columns.
+            batch_size (int, optional): Number of rows featurized at once. Defaults to
+                DISTILL_BATCH_SIZE.
+
+        Returns:
+            np.ndarray: Log-odds of the bad label.
+        """
+        logits = [
+            self.decision_function(self.features(df.iloc[low : low + batch_size], columns))
+            for low in range(0, len(df), batch_size)
+        ]
+        return np.concatenate(logits) if logits else np.zeros(0)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        return 1.0 / (1.0 + np.exp(-x))
+
+
+class DistillStage:
+    """Cheap classifier that is trained on the labels of the model for a sample of the rows and
+    labels the remaining rows. Rows where the classifier is less confident than the threshold
+    are still labeled by the model.
+
+    Sample rows are collected until `sample_size` labels are available, e.g. from the first
+    chunks of a streaming run. A share of `holdout` of the sample is held out to measure the
+    agreement of the classifier with the model.
+
+    Args:
+        sample_size (int, optional): Number of rows labeled by the model for training. Defaults
+            to DISTILL_SAMPLE_SIZE.
+        threshold (float, optional): Minimal probability of the predicted label to keep it.
+            Defaults to DISTILL_CONFIDENCE_THRESHOLD.
+        holdout (float, optional): Share of the sample used for evaluation only. Defaults to
+            DISTILL_HOLDOUT.
+        classifier (Optional[HashedNgramClassifier], optional): Classifier to train. Defaults to
+            a HashedNgramClassifier with the default settings.
+    """
+
+    def __init__(
+        self,
+        sample_size: int = DISTILL_SAMPLE_SIZE,
+        threshold: float = DISTILL_CONFIDENCE_THRESHOLD,
+        holdout: float = DISTILL_HOLDOUT,
+        classifier: Optional[HashedNgramClassifier] = None,
+    ) -> None:
+        if not 0.5 <= threshold <= 1.0:
+            raise ValueError("The distill threshold must be between 0.5 and 1.0")
+
+        self.sample_size = sample_size
+        self.threshold = threshold
+        self.holdout = holdout
+        self.classifier = classifier or HashedNgramClassifier()
+        self.trained = False
+        self.samples: List[pd.DataFrame] = []
+        self.evaluation: Dict[str, Optional[float]] = {}
+        self.rows = 0
+        self.kept = 0
+
+    @property
+    def needed(self) -> int:
+        """Number of sample rows that are still missing."""
+        return max(self.sample_size - sum(len(sample) for sample in self.samples), 0)
+
+    def select_sample(self, row_ids: pd.Series) -> pd.Index:
+        """Selects the sample rows that are still needed among the given rows. The rows are
+        picked by a hash of their row id, so that the sample is random but the same rows are
+        picked when a run is resumed.
+
+        Args:
+            row_ids (pd.Series): Row ids of the candidate rows.
+
+        Returns:
+            pd.Index: Index labels of the selected rows.
+        """
+        if self.trained or not self.needed:
+            return row_ids.index[:0]
+
+        hashes = pd.util.hash_array(row_ids.to_numpy(dtype=np.int64))
+        return row_ids.index[np.argsort(hashes, kind="stable")[: self.needed]]
+
+    def add(self, df: pd.DataFrame, columns: List[str], labels: pd.Series) -> None:
+        """Adds sample rows labeled by the model. Rows without a good or bad label are ignored.
+
+        Args:
+            df (pd.DataFrame): Sample rows with the row id and the text columns.
+            columns (List[str]): Text columns.
+            labels (pd.Series): Labels of the model aligned with `df`.
+        """
+        labeled = labels.isin(["good", "bad"]).to_numpy()
+        sample = df.loc[labeled, [ROW_ID_COLUMN] + columns].copy()
+        sample["is_bad"] = (labels[labeled] == "bad").to_numpy()
+        self.samples.append(sample)
+
+    def fit(self, columns: List[str]) -> Dict[str, Optional[float]]:
+        """Trains the classifier on the sample without the held out rows and evaluates it on
+        the held out rows.
+
+        Args:
+            columns (List[str]): Text columns.
+
+        Returns:
+            Dict[str, Optional[float]]: Agreement with the model on the held out rows, the
+                share of held out rows above the threshold (coverage) and the agreement on them.
+        """
+        sample = pd.concat(self.samples, ignore_index=True)
+        hashes = pd.util.hash_array(sample[ROW_ID_COLUMN].to_numpy(dtype=np.int64))
+        held_out = hashes % np.uint64(1000) < np.uint64(round(self.holdout * 1000))
+
+        train = sample[~held_out]
+        self.classifier.fit(self.classifier.features(train, columns), train["is_bad"].to_numpy())
+        self.trained = True
+        self.samples = []
+
+        test = sample[held_out]
+        agreement, coverage, confident_agreement = None, None, None
+        if len(test):
+            logits = self.classifier.predict_logits(test, columns)
+            agrees = (logits >= 0) == test["is_bad"].to_numpy()
+            confident = _sigmoid(np.abs(logits)) >= self.threshold
+            agreement = float(agrees.mean())
+            coverage = float(confident.mean())
+            if confident.any():
+                confident_agreement = float(agrees[confident].mean())
+
+        self.evaluation = {
+            "train_rows": len(train),
+            "holdout_rows": len(test),
+            "holdout_agreement": agreement,
+            "holdout_coverage": coverage,
+            "holdout_confident_agreement": confident_agreement,
+        }
+        return self.evaluation
+
+    def decide(self, df: pd.DataFrame, columns: List[str]) -> Tuple[pd.Series, pd.Series]:
+        """Labels the given rows with the classifier and keeps the confident labels. The rows
+        count towards the escalation statistics of this stage.
+
+        Args:
+            df (pd.DataFrame): Rows to decide with the text columns.
+            columns (List[str]): Text columns.
+
+        Returns:
+            Tuple[pd.Series, pd.Series]: Kept labels (missing for escalated rows) and the
+                absolute log-odds of the labels, both aligned with `df`.
+        """
+        logits = self.classifier.predict_logits(df, columns)
+        margins = pd.Series(np.abs(logits), index=df.index)
+        keep = _sigmoid(margins.to_numpy()) >= self.threshold
+
+        labels = pd.Series(np.where(logits >= 0, "bad", "good"), index=df.index, dtype=object)
+
+        self.rows += len(df)
+        self.kept += int(keep.sum())
+
+        return labels.where(keep), margins
+
+    def report(self) -> Dict[str, Optional[float]]:
+        """Returns the held out evaluation and the escalation statistics of this stage.
+
+        Returns:
+            Dict[str, Optional[float]]: Sample size, threshold, held out evaluation, number of
+                rows, kept and escalated rows and the escalation rate.
+        """
+        escalated = self.rows - self.kept
+        return {
+            "sample_size": self.sample_size,
+            "threshold": self.threshold,
+            "trained": self.trained,
+            **self.evaluation,
+            "rows": self.rows,
+            "kept": self.kept,
+            "escalated": escalated,
+            "escalation_rate": escalated / self.rows if self.rows else None,
+        }
+
+    def save_report(self, model_name: str, path: str = "./data/distill_report_{}.json") -> None:
+        """Writes the evaluation and the escalation statistics to a JSON file.
+
+        Args:
+            model_name (str): Name of the model, used in the file name.
+            path (str, optional): File path template. Defaults to
+                "./data/distill_report_{}.json".
+        """
+        with open(path.format(model_name), "w") as f:
+            json.dump(self.report(), f, indent=2)
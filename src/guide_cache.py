@@ -0,0 +1,250 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.settings import GUIDE_CACHE_DIR, GUIDE_CACHE_MAX_BYTES
+
+# files that determine the vocabulary of a Hugging Face tokenizer
+TOKENIZER_FILES = [
+    "tokenizer.json",
+    "tokenizer_config.json",
+    "tokenizer.model",
+    "vocab.json",
+    "merges.txt",
+    "special_tokens_map.json",
+]
+
+
+def tokenizer_fingerprint(model_path: str) -> str:
+    """Hashes the tokenizer files of a model, so that models that share a tokenizer share their
+    compiled guides.
+
+    Args:
+        model_path (str): Path of the model.
+
+    Returns:
+        str: Hex digest of the tokenizer files, or of the model path if it has none.
+    """
+    digest = hashlib.sha256()
+    found = False
+
+    for file_name in TOKENIZER_FILES:
+        path = os.path.join(model_path, file_name)
+        if os.path.isfile(path):
+            found = True
+            digest.update(file_name.encode("utf-8"))
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+
+    if not found:
+        digest.update(os.path.abspath(model_path).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def guide_key(tokenizer_id: str, choices: Optional[List[str]] = None, schema: Any = None) -> str:
+    """Computes the key of the compiled guides of a tokenizer and a set of choices or a schema.
+    The outlines version is part of the key, because the cached guides are not compatible
+    across versions.
+
+    Args:
+        tokenizer_id (str): Tokenizer fingerprint, see `tokenizer_fingerprint`.
+        choices (Optional[List[str]], optional): Choices of guided decoding. Defaults to None.
+        schema (Any, optional): JSON schema or regex of guided decoding. Defaults to None.
+
+    Returns:
+        str: Hex digest used as cache key.
+    """
+    try:
+        outlines_version = version("outlines")
+    except PackageNotFoundError:
+        outlines_version = None
+
+    config = {
+        "tokenizer": tokenizer_id,
+        "choices": choices,
+        "schema": schema,
+        "outlines": outlines_version,
+    }
+    serialized = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:32]
+
+
+def directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file_name))
+            except FileNotFoundError:
+                pass
+    return size
+
+
+class GuideCache:
+    """Persistent cache for the guided decoding indexes that outlines compiles. Every key, see
+    `guide_key`, gets its own outlines cache directory, so jobs with the same key reuse the
+    compiled guides instead of recompiling them. Within a directory, outlines keys the guides
+    by their choices, so an entry can hold the guides of several sets of choices.
+
+    Concurrent jobs on the same machine are safe: a job holds a shared lock on its entry while
+    it runs, and the index of the entries is only changed under an exclusive lock and replaced
+    atomically. Once the entries exceed `max_bytes`, the least recently used entries that no
+    job holds are evicted.
+
+    Args:
+        root (str, optional): Base directory of the cache. Defaults to GUIDE_CACHE_DIR.
+        max_bytes (int, optional): Maximum total size of the entries. Defaults to
+            GUIDE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, root: str = GUIDE_CACHE_DIR, max_bytes: int = GUIDE_CACHE_MAX_BYTES):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be a positive integer")
+
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._held: Dict[str, Any] = {}
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    @contextmanager
+    def _locked_index(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """Yields the index under an exclusive lock and writes it back atomically."""
+        with open(os.path.join(self.root, "index.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = {}
+                if os.path.exists(self._index_path()):
+                    with open(self._index_path()) as f:
+                        index = json.load(f)
+
+                yield index
+
+                tmp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(index, f, indent=2)
+                os.replace(tmp_path, self._index_path())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, key: str, description: Optional[Dict[str, Any]] = None) -> str:
+        """Returns the outlines cache directory of a key and holds a shared lock on it until
+        `release` is called, so that it is not evicted while a job uses it.
+
+        Args:
+            key (str): Cache key, see `guide_key`.
+            description (Optional[Dict[str, Any]], optional): Stored with the entry to tell
+                the entries apart, e.g. the model and the choices. Defaults to None.
+
+        Returns:
+            str: Directory to use as OUTLINES_CACHE_DIR.
+        """
+        if key not in self._held:
+            lock = open(self.path(key) + ".lock", "a")
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            self._held[key] = lock
+
+        with self._locked_index() as index:
+            entry = index.setdefault(key, {"hits": 0, "misses": 0, "size": 0})
+            # an entry only counts as a hit once a job finished with it and recorded its size
+            if entry["size"] > 0 and os.path.isdir(self.path(key)):
+                entry["hits"] += 1
+                self.hits += 1
+            else:
+                entry["misses"] += 1
+                self.misses += 1
+            entry["last_used"] = time.time()
+            if description is not None:
+                entry["description"] = description
+
+        os.makedirs(self.path(key), exist_ok=True)
+        return self.path(key)
+
+    def release(self, key: str) -> None:
+        """Records the size of an entry after a job used it, releases its lock and evicts the
+        least recently used entries if the cache is too large.
+
+        Args:
+            key (str): Cache key.
+        """
+        with self._locked_index() as index:
+            if key in index:
+                index[key]["size"] = directory_size(self.path(key))
+                index[key]["last_used"] = time.time()
+
+        lock = self._held.pop(key, None)
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+        self.evict()
+
+    def evict(self) -> List[str]:
+        """Removes the least recently used entries that no job holds until the cache fits
+        into `max_bytes`.
+
+        Returns:
+            List[str]: Keys of the evicted entries.
+        """
+        evicted = []
+
+        with self._locked_index() as index:
+            total = sum(entry["size"] for entry in index.values())
+            for key in sorted(index, key=lambda key: index[key]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if key in self._held:
+                    continue
+
+                with open(self.path(key) + ".lock", "a") as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        # in use by another job
+                        continue
+                    shutil.rmtree(self.path(key), ignore_errors=True)
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+                total -= index.pop(key)["size"]
+                evicted.append(key)
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the entries of the index with their size, hits, misses and last use."""
+        with self._locked_index() as index:
+            return dict(index)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Returns the hit/miss counters of this session.
+
+        Returns:
+            Dict[str, Optional[float]]: Hits, misses, evictions, hit rate and total size of the
+                cache in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "size": sum(entry["size"] for entry in self.entries().values()),
+        }
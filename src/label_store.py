@@ -0,0 +1,281 @@
+import glob
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.checkpoint import write_parquet_atomic
+from src.settings import LABEL_STORE_DIR, LABEL_STORE_ROW_GROUP_SIZE, ROW_ID_COLUMN
+from src.utils import add_row_ids, read_data
+
+PREDICTION_SUFFIX = "_prediction"
+# probability of the bad label of models that were run in scoring mode
+PROBABILITY_SUFFIX = "_p_bad"
+# schema metadata key that lists the prediction columns of a label file
+PREDICTION_COLUMNS_KEY = "prediction_columns"
+# schema metadata keys that name the run that produced the labels of a file
+RUN_METADATA_KEYS = ["model_name", "template", "fingerprint"]
+
+# labels are stored dictionary encoded with this dictionary first, so that every label file has
+# the same int8 codes for the labels
+LABELS = ["good", "bad"]
+
+
+def encode_labels(values: Iterable[Optional[str]], labels: List[str] = LABELS) -> pd.Categorical:
+    """Encodes labels as a categorical, which is stored as an Arrow dictionary column with
+    int8 indices. Unexpected labels are kept as additional categories.
+
+    Args:
+        values (Iterable[Optional[str]]): Labels, missing labels are None or NaN.
+        labels (List[str], optional): Expected labels. Defaults to LABELS.
+
+    Returns:
+        pd.Categorical: The encoded labels.
+    """
+    values = pd.Series(values, dtype=object)
+    extra = sorted(set(values.dropna()) - set(labels))
+    return pd.Categorical(values, categories=labels + extra)
+
+
+def label_mask(values: pa.ChunkedArray, label: str) -> np.ndarray:
+    """Returns which rows have the given label. Dictionary encoded labels are compared on
+    their integer codes without materializing the strings.
+
+    Args:
+        values (pa.ChunkedArray): Label column, dictionary encoded or plain strings.
+        label (str): Label to look for.
+
+    Returns:
+        np.ndarray: Boolean mask, False for missing labels.
+    """
+    masks = []
+    for chunk in values.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            code = pc.index(chunk.dictionary, label).as_py()
+            if code < 0:
+                masks.append(np.zeros(len(chunk), dtype=bool))
+                continue
+            codes = pc.fill_null(chunk.indices, -1).to_numpy()
+            masks.append(codes == code)
+        else:
+            masks.append(pc.fill_null(pc.equal(chunk, label), False).to_numpy(zero_copy_only=False))
+
+    return np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+
+
+def run_metadata(schema: pa.Schema) -> Dict[str, str]:
+    """Returns the metadata of the run that produced a labeled file, see RUN_METADATA_KEYS."""
+    metadata = schema.metadata or {}
+    return {
+        key: metadata[key.encode()].decode()
+        for key in RUN_METADATA_KEYS
+        if key.encode() in metadata
+    }
+
+
+class LabelStore:
+    """Stores the labels of every model in a separate Parquet file keyed by row id, so that
+    adding a model only writes its own columns. The wide view of the dataset and all labels is
+    joined on demand and only reads the requested columns.
+
+    Args:
+        directory (str, optional): Directory of the label files. Defaults to LABEL_STORE_DIR.
+    """
+
+    def __init__(self, directory: str = LABEL_STORE_DIR) -> None:
+        self.directory = directory
+
+    def path(self, model_name: str) -> str:
+        return os.path.join(self.directory, f"{model_name}.parquet")
+
+    def models(self) -> List[str]:
+        """Returns the models with stored labels in the order in which they were added."""
+        paths = sorted(glob.glob(os.path.join(self.directory, "*.parquet")), key=os.path.getmtime)
+        return [os.path.basename(path)[: -len(".parquet")] for path in paths]
+
+    def label_columns(self, models: Optional[List[str]] = None) -> List[str]:
+        """Returns the label columns of the given models, by default of all models."""
+        columns = []
+        for model_name in models if models is not None else self.models():
+            names = pq.read_schema(self.path(model_name)).names
+            columns.extend(name for name in names if name != ROW_ID_COLUMN)
+        return columns
+
+    def prediction_columns(self, models: Optional[List[str]] = None) -> List[str]:
+        """Returns the prediction columns of the given models, by default of all models, as
+        recorded in the metadata of the label files."""
+        columns = []
+        for model_name in models if models is not None else self.models():
+            metadata = pq.read_schema(self.path(model_name)).metadata or {}
+            columns.extend(json.loads(metadata.get(PREDICTION_COLUMNS_KEY.encode(), b"[]")))
+        return columns
+
+    def metadata(self, model_name: str) -> Dict[str, str]:
+        """Returns the model name, prompt template and run fingerprint of the stored labels of a
+        model, as far as they were recorded."""
+        return run_metadata(pq.read_schema(self.path(model_name)))
+
+    def add(
+        self, model_name: str, labels: pd.DataFrame, metadata: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Stores the labels of a model and replaces previously stored labels of the model. The
+        prediction columns are stored dictionary encoded, see `encode_labels`.
+
+        Args:
+            model_name (str): Name of the model.
+            labels (pd.DataFrame): Row id column and the label columns of the model.
+            metadata (Optional[Dict[str, str]], optional): Metadata of the run that produced the
+                labels, see RUN_METADATA_KEYS. Defaults to None.
+
+        Raises:
+            ValueError: If the labels have no row id column.
+        """
+        if ROW_ID_COLUMN not in labels.columns:
+            raise ValueError(f"Labels of {model_name} have no {ROW_ID_COLUMN} column.")
+
+        prediction_columns = [
+            column for column in labels.columns if column.endswith(PREDICTION_SUFFIX)
+        ]
+
+        labels = labels.sort_values(ROW_ID_COLUMN)
+        for column in prediction_columns:
+            labels[column] = encode_labels(labels[column])
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_parquet_atomic(
+            labels,
+            self.path(model_name),
+            metadata={
+                **(metadata or {}),
+                "model_name": model_name,
+                PREDICTION_COLUMNS_KEY: json.dumps(prediction_columns),
+            },
+            row_group_size=LABEL_STORE_ROW_GROUP_SIZE,
+        )
+
+    def remove(self, model_name: str) -> None:
+        if os.path.exists(self.path(model_name)):
+            os.remove(self.path(model_name))
+
+    def read_labels(
+        self, models: Optional[List[str]] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Joins the stored labels on the row id. Only the requested columns are read.
+
+        Args:
+            models (Optional[List[str]], optional): Models to read. Defaults to all models.
+            columns (Optional[List[str]], optional): Label columns to read. Defaults to all
+                label columns.
+
+        Returns:
+            pd.DataFrame: Label columns indexed by row id. Rows missing from a label file are
+                empty in its columns.
+        """
+        frames = []
+        for model_name in models if models is not None else self.models():
+            names = pq.read_schema(self.path(model_name)).names
+            selected = [
+                name
+                for name in names
+                if name != ROW_ID_COLUMN and (columns is None or name in columns)
+            ]
+            if selected:
+                frame = pd.read_parquet(self.path(model_name), columns=[ROW_ID_COLUMN] + selected)
+                frames.append(frame.set_index(ROW_ID_COLUMN))
+
+        if not frames:
+            return pd.DataFrame(index=pd.Index([], name=ROW_ID_COLUMN))
+
+        return pd.concat(frames, axis=1, join="outer")
+
+    def read_table(self, columns: List[str], row_ids: np.ndarray) -> pa.Table:
+        """Reads the label columns of the given rows. Row groups outside the range of the row
+        ids are skipped, so reading the labels of a chunk does not read the whole label files.
+
+        Args:
+            columns (List[str]): Label columns to read.
+            row_ids (np.ndarray): Row ids to read.
+
+        Returns:
+            pa.Table: Row id column and the label columns in the order of `row_ids`. Rows
+                missing from a label file are null in its columns.
+        """
+        row_ids = pa.array(row_ids)
+        arrays, names = [row_ids], [ROW_ID_COLUMN]
+        if len(row_ids) == 0:
+            filters = None
+        else:
+            bounds = pc.min_max(row_ids)
+            filters = [
+                (ROW_ID_COLUMN, ">=", bounds["min"].as_py()),
+                (ROW_ID_COLUMN, "<=", bounds["max"].as_py()),
+            ]
+
+        for model_name in self.models():
+            names_in_file = pq.read_schema(self.path(model_name)).names
+            selected = [name for name in columns if name in names_in_file]
+            if not selected:
+                continue
+
+            table = pq.read_table(
+                self.path(model_name), columns=[ROW_ID_COLUMN] + selected, filters=filters
+            )
+            positions = pc.index_in(row_ids, value_set=table[ROW_ID_COLUMN])
+            for name in selected:
+                arrays.append(table[name].take(positions))
+                names.append(name)
+
+        missing = [name for name in columns if name not in names]
+        if missing:
+            raise KeyError(f"Label columns {missing} not found in {self.directory}")
+
+        return pa.Table.from_arrays(arrays, names=names).select([ROW_ID_COLUMN] + columns)
+
+    def read(
+        self,
+        df: Optional[pd.DataFrame] = None,
+        models: Optional[List[str]] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Assembles the wide view of the dataset and the stored labels.
+
+        Args:
+            df (Optional[pd.DataFrame], optional): Dataset to add the labels to. Defaults to the
+                input dataset in ./data/input.
+            models (Optional[List[str]], optional): Models to add. Defaults to all models.
+            columns (Optional[List[str]], optional): Label columns to add. Defaults to all label
+                columns.
+
+        Returns:
+            pd.DataFrame: The dataset in its original row order with the label columns.
+        """
+        if df is None:
+            df = read_data()
+        df = add_row_ids(df)
+
+        labels = self.read_labels(models, columns)
+
+        return df.join(labels, on=ROW_ID_COLUMN, how="left")
+
+    def flagged_row_ids(self, bad_label: str = "bad") -> np.ndarray:
+        """Returns the ids of all rows that at least one model labeled as bad. Only the
+        prediction columns are read.
+
+        Args:
+            bad_label (str, optional): The bad label. Defaults to "bad".
+
+        Returns:
+            np.ndarray: Row ids of the flagged rows. Empty if no labels are stored yet.
+        """
+        labels = self.read_labels(columns=self.prediction_columns())
+
+        if labels.empty:
+            return np.array([], dtype=np.int64)
+
+        flagged = labels.eq(bad_label).any(axis=1).to_numpy()
+        return labels.index.to_numpy()[flagged]
@@ -0,0 +1,169 @@
+import itertools
+import re
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.prompt_components import MULTI_CLASSIFY_ITEM, MULTI_CLASSIFY_PROMPT
+from src.settings import MAX_TOKENS, MULTI_ITEM_TOKENS_PER_ITEM, PROMPT_FORMAT_OVERHEAD_TOKENS
+from src.token_lengths import count_tokens
+
+# one answer line per pair, e.g. "3: bad"
+_ANSWER_LINE = re.compile(r"^\W*(\d+)\W+([a-z]+)\W*$", re.IGNORECASE)
+
+
+def format_answer(labels: List[str]) -> str:
+    """Formats the labels of the pairs of a prompt as the expected answer."""
+    return "\n".join(f"{number}: {label}" for number, label in enumerate(labels, start=1))
+
+
+def label_choices(num_items: int, labels: List[str]) -> List[str]:
+    """All answers to a prompt with `num_items` pairs, used as answer choices for guided
+    decoding. There are len(labels) ** num_items choices.
+
+    Args:
+        num_items (int): Number of pairs of the prompt.
+        labels (List[str]): Labels of a single pair.
+
+    Returns:
+        List[str]: The formatted answers.
+    """
+    return [
+        format_answer(list(combination))
+        for combination in itertools.product(labels, repeat=num_items)
+    ]
+
+
+def parse_labels(text: str, num_items: int, labels: List[str]) -> Optional[List[str]]:
+    """Reads the labels of the pairs of a prompt from the generated answer.
+
+    Args:
+        text (str): Generated answer with one "<number>: <label>" line per pair.
+        num_items (int): Number of pairs of the prompt.
+        labels (List[str]): Valid labels.
+
+    Returns:
+        Optional[List[str]]: The label of each pair, None if the answer does not label every
+            pair exactly once with a valid label.
+    """
+    parsed = {}
+    for line in text.strip().splitlines():
+        if not line.strip():
+            continue
+        match = _ANSWER_LINE.match(line)
+        if match is None:
+            return None
+        number, label = int(match.group(1)), match.group(2).lower()
+        if number in parsed or label not in labels:
+            return None
+        parsed[number] = label
+
+    if sorted(parsed) != list(range(1, num_items + 1)):
+        return None
+    return [parsed[number] for number in range(1, num_items + 1)]
+
+
+def build_prompt(
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    template: str = MULTI_CLASSIFY_PROMPT,
+    item_template: str = MULTI_CLASSIFY_ITEM,
+) -> str:
+    """Packs the text pairs of all rows into a single prompt.
+
+    Args:
+        df (pd.DataFrame): Rows of the prompt.
+        columns_to_use (List[str]): Columns that make up the pair.
+        template (str, optional): Prompt template with placeholders for the number of pairs and
+            the pairs. Defaults to MULTI_CLASSIFY_PROMPT.
+        item_template (str, optional): Template of a pair with placeholders for its number and
+            both texts. Defaults to MULTI_CLASSIFY_ITEM.
+
+    Raises:
+        ValueError: If columns_to_use does not contain exactly 2 columns.
+
+    Returns:
+        str: The prompt.
+    """
+    if len(columns_to_use) != 2:
+        raise ValueError("columns_to_use should contain exactly 2 columns")
+
+    items = [
+        item_template.format(number, before, after)
+        for number, (before, after) in enumerate(
+            zip(df[columns_to_use[0]], df[columns_to_use[1]]), start=1
+        )
+    ]
+    return template.format(len(items), "\n".join(items))
+
+
+def split_items(
+    tokenizer: Any,
+    df: pd.DataFrame,
+    columns_to_use: List[str],
+    items_per_prompt: int,
+    max_model_len: int,
+    system_prompt: str,
+    tokens_per_item: int = MULTI_ITEM_TOKENS_PER_ITEM,
+    min_output_tokens: int = MAX_TOKENS,
+    template: str = MULTI_CLASSIFY_PROMPT,
+    item_template: str = MULTI_CLASSIFY_ITEM,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Splits consecutive rows into prompts of at most `items_per_prompt` pairs that fit into the
+    context together with their answer of `tokens_per_item` tokens per pair. A prompt is closed
+    as soon as the next pair would exceed the context.
+
+    Args:
+        tokenizer (Any): Tokenizer of the model.
+        df (pd.DataFrame): Rows to split.
+        columns_to_use (List[str]): Columns that make up the pair.
+        items_per_prompt (int): Maximal number of pairs per prompt.
+        max_model_len (int): Context length of the model.
+        system_prompt (str): System prompt.
+        tokens_per_item (int, optional): Generated tokens per pair. Defaults to
+            MULTI_ITEM_TOKENS_PER_ITEM.
+        min_output_tokens (int, optional): Generated tokens of a prompt with few pairs.
+            Defaults to MAX_TOKENS.
+        template (str, optional): Prompt template, see `build_prompt`. Defaults to
+            MULTI_CLASSIFY_PROMPT.
+        item_template (str, optional): Template of a pair, see `build_prompt`. Defaults to
+            MULTI_CLASSIFY_ITEM.
+
+    Returns:
+        Tuple[List[np.ndarray], np.ndarray]: The row positions of each prompt and the positions
+            of the rows that do not fit into a prompt even on their own.
+    """
+    before, after = columns_to_use
+    fixed = count_tokens(tokenizer, [template.format(items_per_prompt, ""), system_prompt]).sum()
+    budget = max_model_len - PROMPT_FORMAT_OVERHEAD_TOKENS - int(fixed)
+    # one more token per pair for the line break between the pairs
+    item_tokens = (
+        count_tokens(
+            tokenizer,
+            [
+                item_template.format(items_per_prompt, b, a)
+                for b, a in zip(df[before].fillna("").astype(str), df[after].fillna("").astype(str))
+            ],
+        )
+        + 1
+    )
+
+    groups: List[np.ndarray] = []
+    oversized: List[int] = []
+    group: List[int] = []
+    used = 0
+    for position, tokens in enumerate(item_tokens):
+        output_tokens = max(min_output_tokens, tokens_per_item * (len(group) + 1))
+        if group and (len(group) == items_per_prompt or used + tokens + output_tokens > budget):
+            groups.append(np.array(group))
+            group, used = [], 0
+        if tokens + max(min_output_tokens, tokens_per_item) > budget:
+            oversized.append(position)
+            continue
+        group.append(position)
+        used += tokens
+    if group:
+        groups.append(np.array(group))
+
+    return groups, np.array(oversized, dtype=np.int64)
@@ -0,0 +1,119 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, Iterator, TypeVar
+
+from src.settings import PIPELINE_DEPTH
+
+T = TypeVar("T")
+
+# kinds of the messages from a producer thread to the consumer
+_ITEM, _DONE, _ERROR = range(3)
+
+
+def prefetch(iterable: Iterable[T], depth: int = PIPELINE_DEPTH) -> Iterator[T]:
+    """Produces the items of an iterable in a background thread while the consumer works on the
+    previous items, e.g. reads the next chunk during inference. Items arrive in order, and the
+    producer stops once it is `depth` items ahead of the consumer. An exception of the producer
+    is raised in the consumer.
+
+    Close the returned iterator (e.g. with `contextlib.closing`) if it is not consumed to the end,
+    so that the producer thread stops.
+
+    Args:
+        iterable (Iterable[T]): Items to produce.
+        depth (int, optional): Maximum number of produced items waiting for the consumer. With
+            0, the items are produced in the calling thread. Defaults to PIPELINE_DEPTH.
+
+    Yields:
+        T: The items of `iterable` in order.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    messages: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(message: Any) -> bool:
+        # waits for a free slot, but gives up once the consumer is gone
+        while not stop.is_set():
+            try:
+                messages.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put((_ITEM, item)):
+                    return
+            put((_DONE, None))
+        except BaseException as error:
+            put((_ERROR, error))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            kind, value = messages.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        thread.join()
+
+
+class SerialExecutor:
+    """Runs calls one after another in a background thread in the order in which they were
+    submitted, e.g. to write a chunk while the next chunk is labeled. At most `depth` calls are
+    pending, `submit` waits for the oldest call beyond that. An exception of a call is raised by
+    a later `submit` or by `wait`.
+
+    Args:
+        depth (int, optional): Maximum number of pending calls. With 0, calls run in the calling
+            thread. Defaults to PIPELINE_DEPTH.
+    """
+
+    def __init__(self, depth: int = PIPELINE_DEPTH) -> None:
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=1) if depth > 0 else None
+        self._pending: Deque[Future] = deque()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        if self._executor is None:
+            fn(*args)
+            return
+
+        while len(self._pending) >= self.depth:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(fn, *args))
+
+    def wait(self) -> None:
+        """Waits for all pending calls."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "SerialExecutor":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._executor is not None:
+            # an error of a pending call must not hide the original error
+            self._executor.shutdown(wait=True)
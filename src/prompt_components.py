@@ -67,3 +67,18 @@ Classify the following text pairs and think step by step about the quality of th
 
 
 SYSTEM_PROMPT = """You are an expert language model tasked with evaluating text revisions for coherence, grammar, and logical structure. Your goal is to help filter out nonsensical or confusing text, while retaining useful examples that can be used for further analysis."""
+
+
+# the guidelines and examples of CLASSIFY_PROMPT for several numbered text pairs per prompt, with
+# the number of pairs and the pairs formatted with MULTI_CLASSIFY_ITEM as placeholders
+MULTI_CLASSIFY_PROMPT = (
+    CLASSIFY_PROMPT[: CLASSIFY_PROMPT.index("Classify the following text pairs")].lstrip("\n")
+    + "Classify each of the following {} numbered text pairs on its own and remember the "
+    + "guidelines above. Answer with one line per pair in the form "
+    + '"<number>: <good or bad>":\n\n{}'
+)
+
+MULTI_CLASSIFY_ITEM = """**Pair {}**
+**Before**: {}
+**After**: {}
+"""
@@ -0,0 +1,209 @@
+import string
+from typing import Callable, Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.settings import (
+    PREFILTER_CLEAN_MIN_CHARS,
+    PREFILTER_MIN_ALPHA_RATIO,
+    PREFILTER_MIN_CHARS,
+    PREFILTER_RUN_TOGETHER_MIN_MATCHES,
+)
+
+# image caption artifacts from Wikinews, e.g. "File photo of Peter Stöger in 2011Yesterday, ..."
+CAPTION_PATTERN = r"\bfile photo\b|^\s*(file|image|photo)\s*:"
+
+# reference and category lists from Wikipedia and Wikinews
+REFERENCE_PATTERN = (
+    r"\bcategory\s*:|^\s*(references|sources|external links|see also)\b|\bretrieved (on )?\d"
+)
+
+# tokens that were glued together when markup was removed: weekdays glued to the next word,
+# e.g. "on Sundayon SaturdayIn", years glued to a capitalized word, e.g. "2011Yesterday", and
+# sentences glued together without a space, e.g. "the cup.The". CamelCase names such as
+# "JavaScript" do not match
+RUN_TOGETHER_PATTERN = (
+    r"(?:Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)day(?:(?:on|in|at)\b|[A-Z][a-z])"
+    r"|\d{4}[A-Z][a-z]"
+    r"|[a-z]{2}[.!?][A-Z][a-z]"
+)
+
+# a single sentence without leftover markup, spacing or punctuation artifacts
+CLEAN_SENTENCE_PATTERN = r"^[A-Z][^\s]*( [^\s,.;:!?]+[,;:]?)*[^\s,;:][.!?]$"
+
+
+class Rule(NamedTuple):
+    """A heuristic that labels a text pair without the model.
+
+    Attributes:
+        name (str): Name of the rule, recorded as the stage that decided the row.
+        label (str): Label assigned to matching rows, either "good" or "bad".
+        matches (Callable[[pa.Array, pa.Array], np.ndarray]): Returns a boolean mask of the
+            matching rows given the before and after texts.
+    """
+
+    name: str
+    label: str
+    matches: Callable[[pa.Array, pa.Array], np.ndarray]
+
+
+def _to_numpy(mask: pa.Array) -> np.ndarray:
+    return mask.to_numpy(zero_copy_only=False)
+
+
+def is_empty_or_short(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """Either text has fewer than PREFILTER_MIN_CHARS non-whitespace characters."""
+    masks = [
+        _to_numpy(pc.less(pc.utf8_length(pc.utf8_trim_whitespace(t)), PREFILTER_MIN_CHARS))
+        for t in (before, after)
+    ]
+    return masks[0] | masks[1]
+
+
+def has_caption_artifact(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """Either text contains an image caption artifact."""
+    return _to_numpy(pc.match_substring_regex(after, CAPTION_PATTERN, ignore_case=True)) | (
+        _to_numpy(pc.match_substring_regex(before, CAPTION_PATTERN, ignore_case=True))
+    )
+
+
+def has_reference_list(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """Either text is or contains a reference or category list."""
+    return _to_numpy(pc.match_substring_regex(after, REFERENCE_PATTERN, ignore_case=True)) | (
+        _to_numpy(pc.match_substring_regex(before, REFERENCE_PATTERN, ignore_case=True))
+    )
+
+
+def has_run_together_tokens(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """The revised text contains several tokens that were glued together."""
+    counts = pc.count_substring_regex(after, RUN_TOGETHER_PATTERN)
+    return _to_numpy(pc.greater_equal(counts, PREFILTER_RUN_TOGETHER_MIN_MATCHES))
+
+
+# byte classes for the alpha ratio, non-ASCII bytes are counted as letters
+_LETTER_BYTES = np.zeros(256, dtype=np.uint8)
+_LETTER_BYTES[np.frombuffer(string.ascii_letters.encode(), dtype=np.uint8)] = 1
+_LETTER_BYTES[0x80:] = 1
+_NON_SPACE_BYTES = np.ones(256, dtype=np.uint8)
+_NON_SPACE_BYTES[np.frombuffer(string.whitespace.encode(), dtype=np.uint8)] = 0
+
+
+def _sum_per_row(texts: pa.Array, byte_classes: np.ndarray) -> np.ndarray:
+    if isinstance(texts, pa.ChunkedArray):
+        return np.concatenate(
+            [_sum_per_row(chunk, byte_classes) for chunk in texts.chunks]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+
+    offset_type = np.int64 if pa.types.is_large_string(texts.type) else np.int32
+    _, offsets_buffer, data_buffer = texts.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_type)[
+        texts.offset : texts.offset + len(texts) + 1
+    ]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer else np.empty(0, np.uint8)
+    cumulative = np.concatenate([[0], np.cumsum(byte_classes[data], dtype=np.int64)])
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+
+def _alpha_ratio(texts: pa.Array) -> np.ndarray:
+    letters = _sum_per_row(texts, _LETTER_BYTES).astype(np.float64)
+    non_space = _sum_per_row(texts, _NON_SPACE_BYTES).astype(np.float64)
+    return np.divide(letters, non_space, out=np.zeros_like(letters), where=non_space > 0)
+
+
+def has_low_alpha_ratio(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """Less than PREFILTER_MIN_ALPHA_RATIO of the non-whitespace characters are letters."""
+    return (_alpha_ratio(before) < PREFILTER_MIN_ALPHA_RATIO) | (
+        _alpha_ratio(after) < PREFILTER_MIN_ALPHA_RATIO
+    )
+
+
+def is_clean_sentence(before: pa.Array, after: pa.Array) -> np.ndarray:
+    """Both texts are single, long enough sentences without spacing or markup artifacts."""
+    masks = [
+        _to_numpy(pc.match_substring_regex(t, CLEAN_SENTENCE_PATTERN))
+        & _to_numpy(pc.greater_equal(pc.utf8_length(t), PREFILTER_CLEAN_MIN_CHARS))
+        for t in (before, after)
+    ]
+    return masks[0] & masks[1]
+
+
+RULES: Dict[str, Rule] = {
+    rule.name: rule
+    for rule in [
+        Rule("empty_or_short", "bad", is_empty_or_short),
+        Rule("caption_artifact", "bad", has_caption_artifact),
+        Rule("reference_list", "bad", has_reference_list),
+        Rule("run_together", "bad", has_run_together_tokens),
+        Rule("low_alpha_ratio", "bad", has_low_alpha_ratio),
+        Rule("clean_sentence", "good", is_clean_sentence),
+    ]
+}
+
+# the "good" rule is opt-in since it cannot judge whether a clean sentence makes sense
+DEFAULT_RULES = [
+    "empty_or_short",
+    "caption_artifact",
+    "reference_list",
+    "run_together",
+    "low_alpha_ratio",
+]
+
+
+def get_rules(rule_names: List[str]) -> List[Rule]:
+    """Looks up rules by name.
+
+    Args:
+        rule_names (List[str]): Names of the rules in the order they should be applied.
+
+    Raises:
+        ValueError: If a rule name is unknown.
+
+    Returns:
+        List[Rule]: The requested rules.
+    """
+    unknown = [name for name in rule_names if name not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown rules {unknown}. Choose from {list(RULES)}.")
+
+    return [RULES[name] for name in rule_names]
+
+
+def to_string_array(texts: pd.Series) -> pa.Array:
+    """Converts a text column to an Arrow string array with missing values as empty strings.
+    The offsets are 64-bit, so a single array holds columns of more than 2 GB of text."""
+    return pc.fill_null(
+        pa.array(texts, type=pa.large_string(), from_pandas=True),
+        pa.scalar("", pa.large_string()),
+    )
+
+
+def apply_rules(df: pd.DataFrame, columns_to_use: List[str], rules: List[Rule]) -> pd.Series:
+    """Applies the rules to every text pair. The first matching rule decides the row.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the text pairs.
+        columns_to_use (List[str]): The before and after columns.
+        rules (List[Rule]): Rules in the order they should be applied.
+
+    Returns:
+        pd.Series: Name of the deciding rule per row, None for rows no rule matched.
+    """
+    if len(columns_to_use) != 2:
+        raise ValueError("columns_to_use should contain exactly 2 columns")
+
+    before = to_string_array(df[columns_to_use[0]])
+    after = to_string_array(df[columns_to_use[1]])
+
+    decided_by = np.full(len(df), None, dtype=object)
+
+    for rule in rules:
+        undecided = pd.isna(decided_by)
+        if not undecided.any():
+            break
+        decided_by[undecided & rule.matches(before, after)] = rule.name
+
+    return pd.Series(decided_by, index=df.index, dtype=object)
@@ -1,2 +1,96 @@
 RANDOM_SEED = 42
 MAX_TOKENS = 32
+# generated tokens in scoring mode, the label is read from the logprobs of the first token
+SCORING_MAX_TOKENS = 1
+
+# number of top logprobs returned per generated token, also used as max_logprobs of the model
+NUM_LOGPROBS = 4
+
+# name of the stable row id column used to key checkpoints and labels
+ROW_ID_COLUMN = "row_id"
+
+# number of labeled rows between two checkpoints
+CHECKPOINT_INTERVAL = 10_000
+CHECKPOINT_DIR = "./data/checkpoints"
+
+# labeled data and manifests of dataset shards
+SHARD_DIR = "./data/shards"
+
+# per-model label files keyed by row id
+LABEL_STORE_DIR = "./data/output/labels"
+LABEL_STORE_ROW_GROUP_SIZE = 100_000
+
+# compiled guided decoding indexes of outlines, shared by all jobs on the machine
+GUIDE_CACHE_DIR = "~/.cache/llm_data_filter/guides"
+GUIDE_CACHE_MAX_BYTES = 2 * 2**30
+
+# spool directory of the labeling worker, jobs are read in chunks of WORKER_CHUNK_SIZE rows
+SPOOL_DIR = "./data/spool"
+WORKER_CHUNK_SIZE = 100_000
+WORKER_POLL_INTERVAL = 5.0
+
+# number of Parquet row groups that are read in parallel when the input is filtered
+READ_THREADS = 8
+
+# number of rows that are combined and written at once
+COMBINE_CHUNK_SIZE = 100_000
+
+# persistent prediction cache shared by all runs
+PREDICTION_CACHE_PATH = "./data/cache/predictions.sqlite"
+PREDICTION_CACHE_MAX_ENTRIES = 5_000_000
+
+# thresholds of the rule-based pre-filter
+PREFILTER_MIN_CHARS = 10
+PREFILTER_MIN_ALPHA_RATIO = 0.5
+PREFILTER_RUN_TOGETHER_MIN_MATCHES = 2
+PREFILTER_CLEAN_MIN_CHARS = 40
+
+# tokens reserved for the chat template of the prompt format
+PROMPT_FORMAT_OVERHEAD_TOKENS = 64
+TOKENIZATION_BATCH_SIZE = 10_000
+
+# minimal logprob margin between the chosen and the other label to keep a cascade label
+CASCADE_MARGIN_THRESHOLD = 2.0
+
+# OpenAI compatible inference servers
+API_BASE_URL = "http://localhost:8000/v1"
+API_MAX_CONCURRENCY = 64
+API_MAX_RETRIES = 5
+API_BACKOFF_SECONDS = 0.5
+API_TIMEOUT_SECONDS = 300
+
+# prompt tokens per second of generation time for the runtime estimate of a dry run, used when
+# no previous run report of the model exists
+DRY_RUN_PROMPT_TOKENS_PER_SECOND = 5_000
+
+# number of prompts that are built and sent to the inference engine at once
+PROMPT_BATCH_SIZE = 10_000
+
+# number of chunks or prompt windows that are read or built ahead of inference and written
+# behind it, 0 runs the stages one after another
+PIPELINE_DEPTH = 2
+
+# distilled classifier that is trained on the labels of the model for a sample of the rows and
+# labels the remaining rows, rows below the confidence threshold are still sent to the model
+DISTILL_SAMPLE_SIZE = 50_000
+DISTILL_CONFIDENCE_THRESHOLD = 0.9
+DISTILL_HOLDOUT = 0.1
+DISTILL_HASH_BITS = 20
+DISTILL_NGRAM_RANGE = (2, 4)
+DISTILL_EPOCHS = 5
+DISTILL_LEARNING_RATE = 0.5
+# number of rows that are featurized at once
+DISTILL_BATCH_SIZE = 10_000
+
+# near-duplicate collapsing with MinHash signatures of the byte n-grams of a text pair and LSH
+# banding, pairs with an estimated Jaccard similarity of at least the threshold share a label
+NEAR_DEDUP_NUM_PERM = 128
+NEAR_DEDUP_NUM_BANDS = 16
+NEAR_DEDUP_NGRAM_SIZE = 5
+NEAR_DEDUP_THRESHOLD = 0.9
+NEAR_DEDUP_BATCH_SIZE = 10_000
+
+# multi-item prompts: generated tokens per pair of a prompt, and the largest number of pairs
+# whose answers are enforced with guided decoding, there are 2**n choices for n pairs
+MULTI_ITEM_TOKENS_PER_ITEM = 8
+MULTI_ITEM_MAX_GUIDED_ITEMS = 8
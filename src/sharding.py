@@ -0,0 +1,253 @@
+import glob
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.label_store import run_metadata
+from src.settings import ROW_ID_COLUMN, SHARD_DIR
+from src.utils import Filter, ParquetAppender, iter_data
+
+
+def shard_mask(row_ids: np.ndarray, num_shards: int, shard_index: int) -> np.ndarray:
+    """Selects the rows of a shard. Rows are assigned by a hash of their row id, so the
+    assignment does not depend on the chunk size or on the order in which rows are read.
+
+    Args:
+        row_ids (np.ndarray): Row ids.
+        num_shards (int): Total number of shards.
+        shard_index (int): Index of the shard, between 0 and num_shards - 1.
+
+    Raises:
+        ValueError: If the shard index is out of range.
+
+    Returns:
+        np.ndarray: Boolean mask of the rows that belong to the shard.
+    """
+    if num_shards <= 0 or not 0 <= shard_index < num_shards:
+        raise ValueError(f"Invalid shard {shard_index} of {num_shards} shards.")
+
+    if num_shards == 1:
+        return np.ones(len(row_ids), dtype=bool)
+
+    return shard_indices(row_ids, num_shards) == shard_index
+
+
+def shard_indices(row_ids: np.ndarray, num_shards: int) -> np.ndarray:
+    """Returns the index of the shard of each row, see `shard_mask`."""
+    hashes = pd.util.hash_array(np.asarray(row_ids, dtype=np.int64))
+    return (hashes % np.uint64(num_shards)).astype(np.int64)
+
+
+def shard_path(
+    model_name: str, shard_index: int, num_shards: int, shard_dir: str = SHARD_DIR
+) -> str:
+    """Returns the path of the labeled data of a shard. Its manifest is stored next to it with a
+    .json extension."""
+    file_name = f"shard-{shard_index:05d}-of-{num_shards:05d}.parquet"
+    return os.path.join(shard_dir, model_name, file_name)
+
+
+def manifest_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def write_manifest(
+    path: str,
+    model_name: str,
+    shard_index: int,
+    num_shards: int,
+    fingerprint: str,
+    input_path: str = "./data/input",
+    filters: Optional[List[Filter]] = None,
+) -> Dict[str, Any]:
+    """Writes the manifest of a finished shard next to its labeled data.
+
+    Args:
+        path (str): Path of the labeled data of the shard.
+        model_name (str): Name of the model.
+        shard_index (int): Index of the shard.
+        num_shards (int): Total number of shards.
+        fingerprint (str): Fingerprint of the run, see `run_fingerprint`.
+        input_path (str, optional): Path of the input dataset. Defaults to "./data/input".
+        filters (Optional[List[Filter]], optional): Filters of the input rows. Defaults to
+            None.
+
+    Returns:
+        Dict[str, Any]: The manifest.
+    """
+    manifest = {
+        "model_name": model_name,
+        "shard_index": shard_index,
+        "num_shards": num_shards,
+        "fingerprint": fingerprint,
+        "input": input_path,
+        "filters": filters,
+        "num_rows": pq.ParquetFile(path).metadata.num_rows,
+        "file": os.path.basename(path),
+    }
+
+    tmp_path = manifest_path(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(path))
+
+    return manifest
+
+
+def remove_shard(path: str) -> None:
+    """Removes the labeled data and the manifest of a shard."""
+    for file_path in [path, manifest_path(path)]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def load_manifests(model_name: str, shard_dir: str = SHARD_DIR) -> List[Dict[str, Any]]:
+    """Loads and verifies the manifests of all shards of a model.
+
+    Args:
+        model_name (str): Name of the model.
+        shard_dir (str, optional): Base directory of the shards. Defaults to SHARD_DIR.
+
+    Raises:
+        FileNotFoundError: If there are no manifests.
+        ValueError: If the shards belong to different runs, or shards are missing or
+            incomplete.
+
+    Returns:
+        List[Dict[str, Any]]: Manifests ordered by shard index.
+    """
+    paths = sorted(glob.glob(os.path.join(shard_dir, model_name, "shard-*.json")))
+    if not paths:
+        raise FileNotFoundError(f"No shard manifests found for {model_name} in {shard_dir}")
+
+    manifests = []
+    for path in paths:
+        with open(path) as f:
+            manifests.append(json.load(f))
+
+    for key in ["num_shards", "fingerprint", "input", "filters"]:
+        values = {json.dumps(manifest.get(key)) for manifest in manifests}
+        if len(values) > 1:
+            raise ValueError(f"Shards of {model_name} have different {key} values: {values}")
+
+    num_shards = manifests[0]["num_shards"]
+    missing = sorted(set(range(num_shards)) - {manifest["shard_index"] for manifest in manifests})
+    if missing:
+        raise ValueError(f"Missing shards {missing} of {num_shards} for {model_name}")
+
+    for manifest in manifests:
+        path = os.path.join(shard_dir, model_name, manifest["file"])
+        if pq.ParquetFile(path).metadata.num_rows != manifest["num_rows"]:
+            raise ValueError(f"Shard {path} does not match its manifest")
+
+    return sorted(manifests, key=lambda manifest: manifest["shard_index"])
+
+
+class _ShardReader:
+    """Reads the rows of a shard front to back in slices of any length."""
+
+    def __init__(self, path: str, columns: List[str], batch_size: int) -> None:
+        self._batches: Iterator[pa.RecordBatch] = pq.ParquetFile(path).iter_batches(
+            batch_size=batch_size, columns=columns
+        )
+        schema = pq.read_schema(path)
+        self._buffer = pa.Table.from_batches([], schema=pa.schema(map(schema.field, columns)))
+
+    def take(self, num_rows: int) -> pa.Table:
+        """Returns the next `num_rows` rows, fewer if the shard ends before."""
+        batches = []
+        while self._buffer.num_rows + sum(len(batch) for batch in batches) < num_rows:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            batches.append(batch)
+        if batches:
+            self._buffer = pa.concat_tables([self._buffer, pa.Table.from_batches(batches)])
+
+        rows = self._buffer.slice(0, num_rows)
+        self._buffer = self._buffer.slice(num_rows)
+        return rows
+
+
+def merge_shards(
+    model_name: str,
+    chunk_size: int,
+    path: str = "./data/labeled_data_{}.parquet",
+    shard_dir: str = SHARD_DIR,
+    dir_path: Optional[str] = None,
+) -> int:
+    """Reassembles the labeled data of all shards in the order of the input dataset. The input
+    is streamed in chunks with the filters of the shards. Each shard holds its rows in the
+    input order, so every shard is read once from front to back, and the rows of a chunk are
+    taken from the shards the row ids are assigned to, see `shard_mask`.
+
+    Args:
+        model_name (str): Name of the model.
+        chunk_size (int): Number of input rows to merge at once.
+        path (str, optional): File path template for the merged output. Defaults to
+            "./data/labeled_data_{}.parquet".
+        shard_dir (str, optional): Base directory of the shards. Defaults to SHARD_DIR.
+        dir_path (Optional[str], optional): Path of the input dataset. Defaults to the input
+            recorded in the manifests.
+
+    Raises:
+        ValueError: If the shards do not cover the input dataset exactly or a shard is not in
+            the input order.
+
+    Returns:
+        int: Number of merged rows.
+    """
+    manifests = load_manifests(model_name, shard_dir)
+    shard_paths = [os.path.join(shard_dir, model_name, manifest["file"]) for manifest in manifests]
+    # the input columns are taken from the input, only the model outputs from the shards
+    shard_schema = pq.read_schema(shard_paths[0])
+    output_columns = [name for name in shard_schema.names if name.startswith(f"{model_name}_")]
+
+    if dir_path is None:
+        dir_path = manifests[0].get("input", "./data/input")
+    input_filters = [tuple(f) for f in manifests[0].get("filters") or []] or None
+
+    readers = [
+        _ShardReader(shard, [ROW_ID_COLUMN] + output_columns, chunk_size) for shard in shard_paths
+    ]
+
+    num_rows = 0
+    with ParquetAppender(path.format(model_name), run_metadata(shard_schema)) as writer:
+        for chunk in iter_data(chunk_size, dir_path, filters=input_filters):
+            num_rows += len(chunk)
+            row_ids = chunk[ROW_ID_COLUMN].to_numpy()
+            assignment = shard_indices(row_ids, len(readers))
+
+            parts, positions = [], []
+            for shard_index, reader in enumerate(readers):
+                shard_positions = np.flatnonzero(assignment == shard_index)
+                part = reader.take(len(shard_positions))
+                if part.num_rows != len(shard_positions) or not np.array_equal(
+                    part[ROW_ID_COLUMN].to_numpy(), row_ids[shard_positions]
+                ):
+                    raise ValueError(
+                        f"Shard {shard_paths[shard_index]} does not cover the input rows from "
+                        f"row id {row_ids[0]} to {row_ids[-1]} in the input order"
+                    )
+                parts.append(part)
+                positions.append(shard_positions)
+
+            # rows of the chunk in the order of the concatenated shard parts
+            outputs = pa.concat_tables(parts).take(np.argsort(np.concatenate(positions)))
+            for name in output_columns:
+                # keeps dictionary encoded labels encoded
+                chunk[name] = outputs[name].to_pandas().array
+            writer.write(chunk)
+
+    total_shard_rows = sum(manifest["num_rows"] for manifest in manifests)
+    if total_shard_rows != num_rows:
+        raise ValueError(
+            f"Shards of {model_name} have {total_shard_rows} rows, the input has {num_rows} rows"
+        )
+
+    return num_rows
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+def stub_label(text: str, choices: List[str]) -> str:
+    """Deterministically picks one of the choices based on the hash of the text."""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return choices[digest[0] % len(choices)]
+
+
+class StubServer:
+    """Minimal OpenAI compatible chat completion server for tests and benchmarks without a GPU.
+
+    It answers every request with a deterministic choice derived from the hash of the messages,
+    optionally after a fixed latency, and can reject the first requests with a 503 to exercise
+    retries. It runs on a background thread with its own event loop.
+
+    Args:
+        latency (float, optional): Seconds to wait before answering. Defaults to 0.0.
+        fail_first (int, optional): Number of initial requests answered with a 503. Defaults to
+            0.
+        host (str, optional): Host to bind. Defaults to "127.0.0.1".
+        port (int, optional): Port to bind, 0 picks a free port. Defaults to 0.
+    """
+
+    def __init__(
+        self, latency: float = 0.0, fail_first: int = 0, host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        self.latency = latency
+        self.fail_first = fail_first
+        self.host = host
+        self.port = port
+        self.num_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.peers = set()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def _chat_completions(self, request: web.Request) -> web.Response:
+        self.num_requests += 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+
+        if self.num_requests <= self.fail_first:
+            return web.Response(status=503, text="warming up")
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            payload = await request.json()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return web.json_response(self.completion(payload))
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def completion(payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the chat completion response for a request payload."""
+        text = "\n".join(message["content"] for message in payload["messages"])
+        choices = payload.get("guided_choice") or ["good", "bad"]
+        label = stub_label(text, choices)
+
+        choice: Dict[str, Any] = {
+            "index": 0,
+            "message": {"role": "assistant", "content": label},
+            "finish_reason": "stop",
+        }
+        if payload.get("logprobs"):
+            top = [{"token": label, "logprob": -0.05}] + [
+                {"token": other, "logprob": -3.0} for other in choices if other != label
+            ]
+            choice["logprobs"] = {
+                "content": [
+                    {
+                        "token": label,
+                        "logprob": -0.05,
+                        "top_logprobs": top[: payload.get("top_logprobs", 1)],
+                    }
+                ]
+            }
+
+        return {
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [choice],
+            "usage": {"prompt_tokens": len(text.split()), "completion_tokens": 1},
+        }
+
+    async def _start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self) -> "StubServer":
+        """Starts the server on a background thread and returns once it accepts requests."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+
+        return self
+
+    def stop(self) -> None:
+        """Stops the server and its background thread."""
+        if self._loop is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI compatible server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request.")
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency, host=args.host, port=args.port).start()
+    print(f"Stub server listening on {server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,170 @@
+import json
+import os
+import platform
+import resource
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10
+
+
+def count_output_tokens(outputs: List[Any]) -> Tuple[int, int]:
+    """Counts the prompt and generated tokens of vLLM request outputs, or of request outputs of
+    an OpenAI compatible server that report the token usage instead of the token ids.
+
+    Args:
+        outputs (List[Any]): Request outputs.
+
+    Returns:
+        Tuple[int, int]: Number of prompt tokens and number of generated tokens.
+    """
+    prompt_tokens, generated_tokens = 0, 0
+
+    for output in outputs:
+        usage = getattr(output, "usage", None)
+        prompt_token_ids = getattr(output, "prompt_token_ids", None)
+        if prompt_token_ids is not None:
+            prompt_tokens += len(prompt_token_ids)
+        elif usage is not None:
+            prompt_tokens += usage.prompt_tokens
+
+        token_ids = getattr(output.outputs[0], "token_ids", None)
+        if token_ids is not None:
+            generated_tokens += len(token_ids)
+        elif usage is not None:
+            generated_tokens += usage.completion_tokens
+
+    return prompt_tokens, generated_tokens
+
+
+class RunReport:
+    """Collects the wall time per stage and counters of a run and writes them as a JSON report.
+
+    Stages can be entered many times, e.g. once per batch, and their times add up. With a
+    progress interval, a progress line with the throughput and the estimated remaining time is
+    printed at most every `progress_interval` seconds while rows are completed.
+
+    Args:
+        script (str): Name of the script.
+        model_name (Optional[str], optional): Name of the model. Defaults to None.
+        total_rows (Optional[int], optional): Number of rows of the run, used for the remaining
+            time. Defaults to None.
+        progress_interval (Optional[float], optional): Seconds between two progress lines, None
+            to disable them. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        script: str,
+        model_name: Optional[str] = None,
+        total_rows: Optional[int] = None,
+        progress_interval: Optional[float] = None,
+    ) -> None:
+        self.script = script
+        self.model_name = model_name
+        self.total_rows = total_rows
+        self.progress_interval = progress_interval
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self._last_progress = self._start
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measures the wall time of a block and adds it to the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+
+    def timed(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Iterates over `iterable` and adds the time spent producing the items to the stage,
+        e.g. for reading chunks or building prompts lazily."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def advance(self, rows: int) -> None:
+        """Counts completed rows and prints a progress line if the progress interval passed."""
+        self.count("rows", rows)
+
+        now = time.perf_counter()
+        if self.progress_interval is None or rows == 0:
+            return
+        if now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+
+        done = self.counters["rows"]
+        rate = done / (now - self._start)
+        line = f"Progress: {done} rows ({rate:,.0f} rows/s)"
+        if self.total_rows and rate > 0:
+            remaining = max(self.total_rows - done, 0) / rate
+            line = (
+                f"Progress: {done}/{self.total_rows} rows ({done / self.total_rows:.1%}, "
+                f"{rate:,.0f} rows/s, ETA {time.strftime('%H:%M:%S', time.gmtime(remaining))})"
+            )
+        print(line, flush=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall_time = time.perf_counter() - self._start
+        rows = self.counters.get("rows", 0)
+        tokens = self.counters.get("prompt_tokens", 0) + self.counters.get("output_tokens", 0)
+        generation_time = self.stages.get("generation", {}).get("seconds", 0.0)
+
+        return {
+            "script": self.script,
+            "model_name": self.model_name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started_at)),
+            "wall_time": wall_time,
+            "stages": self.stages,
+            "counters": self.counters,
+            "rows_per_second": rows / wall_time if wall_time > 0 else None,
+            "tokens_per_second": tokens / generation_time if tokens and generation_time else None,
+            # close to 1 if reading, prompt building and writing overlap with inference
+            "generation_share": generation_time / wall_time if wall_time > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def save(self, path: str) -> Dict[str, Any]:
+        """Writes the report as JSON.
+
+        Args:
+            path (str): Path of the report.
+
+        Returns:
+            Dict[str, Any]: The report.
+        """
+        report = self.to_dict()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Saved run report to {path}")
+
+        return report
+
+
+# marks the end of an iterator in `RunReport.timed`
+_DONE = object()
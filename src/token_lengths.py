@@ -0,0 +1,173 @@
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.settings import PROMPT_FORMAT_OVERHEAD_TOKENS, TOKENIZATION_BATCH_SIZE
+
+LENGTH_POLICIES = ["none", "truncate", "skip"]
+
+
+def load_tokenizer(model_path: str) -> Any:
+    """Loads the Hugging Face tokenizer of a model without loading its weights.
+
+    Args:
+        model_path (str): Path of the model.
+
+    Returns:
+        Any: The tokenizer.
+    """
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_path)
+
+
+def get_max_model_len(model_settings: dict) -> int:
+    """Returns the context length the model is served with.
+
+    Args:
+        model_settings (dict): Model settings, see `get_model_settings`.
+
+    Returns:
+        int: Maximum number of tokens of prompt and output.
+    """
+    if model_settings.get("max_model_len") is not None:
+        return model_settings["max_model_len"]
+
+    from transformers import AutoConfig
+
+    return AutoConfig.from_pretrained(model_settings["model_path"]).max_position_embeddings
+
+
+def count_tokens(tokenizer: Any, texts: List[str]) -> np.ndarray:
+    """Counts the tokens of each text in batches.
+
+    Args:
+        tokenizer (Any): Tokenizer with the Hugging Face call interface.
+        texts (List[str]): Texts to tokenize.
+
+    Returns:
+        np.ndarray: Number of tokens per text.
+    """
+    lengths = np.zeros(len(texts), dtype=np.int64)
+
+    for start in range(0, len(texts), TOKENIZATION_BATCH_SIZE):
+        batch = texts[start : start + TOKENIZATION_BATCH_SIZE]
+        input_ids = tokenizer(batch, add_special_tokens=False)["input_ids"]
+        lengths[start : start + len(batch)] = [len(ids) for ids in input_ids]
+
+    return lengths
+
+
+def text_token_budget(
+    tokenizer: Any, template: str, system_prompt: str, max_model_len: int, max_tokens: int
+) -> int:
+    """Computes how many tokens the two texts of a pair may use in total so that the prompt and
+    the generated output fit into the context.
+
+    Args:
+        tokenizer (Any): Tokenizer of the model.
+        template (str): Prompt template with two placeholders.
+        system_prompt (str): System prompt.
+        max_model_len (int): Context length of the model.
+        max_tokens (int): Maximum number of generated tokens.
+
+    Returns:
+        int: Token budget for the before and after texts combined.
+    """
+    fixed = count_tokens(tokenizer, [template.format("", ""), system_prompt]).sum()
+    return int(max_model_len - max_tokens - PROMPT_FORMAT_OVERHEAD_TOKENS - fixed)
+
+
+def _to_texts(texts: pd.Series) -> List[str]:
+    return texts.fillna("").astype(str).tolist()
+
+
+class LengthPolicy:
+    """Orders text pairs by token length and handles pairs that do not fit into the context.
+
+    Args:
+        tokenizer (Any): Tokenizer of the model.
+        max_text_tokens (int): Token budget of both texts combined, see `text_token_budget`.
+        policy (str, optional): "truncate" shortens over-long pairs to the budget, "skip"
+            leaves them unlabeled. Defaults to "truncate".
+        max_model_len (Optional[int], optional): Context length of the model, used to fit
+            multi-item prompts into the context, see `src.multi_item.split_items`. Defaults to
+            None.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        max_text_tokens: int,
+        policy: str = "truncate",
+        max_model_len: Optional[int] = None,
+    ) -> None:
+        if policy not in LENGTH_POLICIES[1:]:
+            raise ValueError(f"Length policy {policy} not supported. Choose truncate or skip.")
+        if max_text_tokens <= 0:
+            raise ValueError("The prompt template alone exceeds the context length.")
+
+        self.tokenizer = tokenizer
+        self.max_text_tokens = max_text_tokens
+        self.policy = policy
+        self.max_model_len = max_model_len
+
+    def truncate_pair(self, before: str, after: str) -> Tuple[str, str]:
+        """Truncates the texts so that together they fit into the token budget. The budget is
+        split evenly unless one of the texts needs less than its half.
+
+        Args:
+            before (str): Text before the revision.
+            after (str): Text after the revision.
+
+        Returns:
+            Tuple[str, str]: The truncated texts.
+        """
+        ids_before, ids_after = self.tokenizer([before, after], add_special_tokens=False)[
+            "input_ids"
+        ]
+        half = self.max_text_tokens // 2
+        keep_before = min(len(ids_before), max(self.max_text_tokens - len(ids_after), half))
+        keep_after = min(len(ids_after), self.max_text_tokens - keep_before)
+
+        return (
+            self.tokenizer.decode(ids_before[:keep_before]),
+            self.tokenizer.decode(ids_after[:keep_after]),
+        )
+
+    def apply(
+        self, df: pd.DataFrame, columns_to_use: List[str]
+    ) -> Tuple[pd.DataFrame, np.ndarray, int]:
+        """Sorts the rows by token length with the rows to label first. Depending on the policy,
+        over-long rows are truncated or moved behind the rows to label.
+
+        Args:
+            df (pd.DataFrame): DataFrame with the text pairs.
+            columns_to_use (List[str]): The before and after columns.
+
+        Returns:
+            Tuple[pd.DataFrame, np.ndarray, int]: The reordered (and possibly truncated) rows,
+                the permutation that was applied to `df` and the number of rows to label.
+        """
+        before, after = columns_to_use
+        lengths = count_tokens(self.tokenizer, _to_texts(df[before])) + count_tokens(
+            self.tokenizer, _to_texts(df[after])
+        )
+        too_long = lengths > self.max_text_tokens
+
+        if self.policy == "truncate" and too_long.any():
+            df = df.copy()
+            for position in np.flatnonzero(too_long):
+                row = df.index[position]
+                df.loc[row, [before, after]] = self.truncate_pair(
+                    *_to_texts(df.loc[row, [before, after]])
+                )
+            print(f"Truncated {too_long.sum()} examples to {self.max_text_tokens} text tokens ...")
+            lengths = np.minimum(lengths, self.max_text_tokens)
+            too_long[:] = False
+
+        # rows to label first, each group ordered by token length
+        permutation = np.lexsort((lengths, too_long))
+
+        return df.iloc[permutation], permutation, int((~too_long).sum())
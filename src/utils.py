@@ -1,10 +1,27 @@
+import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.settings import READ_THREADS, ROW_ID_COLUMN
+
+T = TypeVar("T")
+
+DATASET_FORMATS = (".csv", ".parquet")
 
 
 def save_output(
-    df: pd.DataFrame, model_name: str, path: str = "./data/labeled_data_{}.parquet"
+    df: pd.DataFrame,
+    model_name: str,
+    path: str = "./data/labeled_data_{}.parquet",
+    metadata: Optional[Dict[str, str]] = None,
 ) -> None:
     """Save the labeled data to a parquet file.
 
@@ -13,11 +30,18 @@ def save_output(
         model_name (str): Model name to use in the filename.
         path (str, optional): File path template for saving. Defaults to
             "./data/labeled_data_{}.parquet".
+        metadata (Optional[Dict[str, str]], optional): Key-value metadata added to the schema.
+            Defaults to None.
     """
     print("Saving labeled data ...")
     output_path = path.format(model_name)
 
-    df.to_parquet(output_path, index=False)
+    if metadata:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        pq.write_table(table, output_path)
+    else:
+        df.to_parquet(output_path, index=False)
 
     print(f"Saved {len(df)} labeled examples to {output_path}")
 
@@ -35,46 +59,418 @@ def clean_up(model_name: str) -> None:
         pass
 
 
-def read_data() -> pd.DataFrame:
-    """Reads a single dataset from a hardcoded directory. The function ensures there is only one
-    dataset (CSV or Parquet) and raises an error if multiple dataset files are found.
+# comparison operators of dataset filters, see `parse_filter`
+FILTER_OPERATORS = ["==", "!=", "<=", ">=", "<", ">"]
+
+Filter = Tuple[str, str, Any]
+
+
+def find_dataset_files(path: str = "./data/input") -> List[str]:
+    """Finds the files of a dataset. A dataset is a single CSV or Parquet file, a directory or
+    a glob pattern. All CSV and Parquet files of a directory or pattern are read as one dataset
+    in sorted order.
+
+    Args:
+        path (str, optional): Path of a dataset file, a directory or a glob pattern, e.g.
+            "./exports/part-*.parquet". Defaults to "./data/input".
 
     Returns:
-        pd.DataFrame: Loaded dataset.
+        List[str]: Paths of the dataset files.
 
     Raises:
-        ValueError: If more than one dataset file is found.
+        ValueError: If no dataset file is found or CSV and Parquet files are mixed.
     """
-    dir_path = "./data/input"
+    if os.path.isfile(path):
+        if not path.endswith(DATASET_FORMATS):
+            raise ValueError(f"Dataset file {path} is neither a CSV nor a Parquet file.")
+        return [path]
 
-    all_files = os.listdir(dir_path)
+    if any(char in path for char in "*?["):
+        candidates = glob.glob(path)
+    else:
+        candidates = [os.path.join(path, f) for f in os.listdir(path)]
 
-    dataset_files = [f for f in all_files if f.endswith(".csv") or f.endswith(".parquet")]
+    dataset_files = sorted(f for f in candidates if f.endswith(DATASET_FORMATS))
+
+    if len(dataset_files) == 0:
+        raise ValueError(f"No dataset file found. Ensure there are CSV or Parquet files in {path}.")
 
-    if len(dataset_files) > 1:
+    if len({os.path.splitext(f)[1] for f in dataset_files}) > 1:
         raise ValueError(
-            "Multiple dataset files found. "
-            f"Only one CSV or Parquet file should be present in {dir_path}."
+            "Multiple dataset formats found. "
+            f"Only CSV or only Parquet files should be present in {path}."
         )
 
-    if len(dataset_files) == 0:
-        raise ValueError(
-            f"No dataset file found. Ensure there is one CSV or Parquet file in {dir_path}."
+    return dataset_files
+
+
+def parse_filter(expression: str) -> Filter:
+    """Parses a filter like "lang == en" or "score >= 0.5". Numeric values are compared as
+    numbers.
+
+    Args:
+        expression (str): Column, operator and value separated by whitespace.
+
+    Raises:
+        ValueError: If the expression has no valid operator.
+
+    Returns:
+        Filter: The filter as (column, operator, value).
+    """
+    for operator in FILTER_OPERATORS:
+        column, found, value = expression.partition(operator)
+        if found and column.strip() and value.strip():
+            value = value.strip()
+            for cast in (int, float):
+                try:
+                    value = cast(value)
+                    break
+                except ValueError:
+                    pass
+            return column.strip(), operator, value
+
+    raise ValueError(
+        f"Invalid filter {expression!r}, expected '<column> <operator> <value>' with one of "
+        f"the operators {FILTER_OPERATORS}"
+    )
+
+
+def _read_columns(
+    names: List[str], columns: Optional[List[str]], filters: Optional[List[Filter]]
+) -> Optional[List[str]]:
+    """Columns to read: the row id, the requested columns and the columns of the filters."""
+    if columns is None:
+        return None
+
+    wanted = [ROW_ID_COLUMN] + list(columns) + [column for column, _, _ in filters or []]
+    # missing requested columns are kept, so that reading them fails with a clear error
+    return [name for name in dict.fromkeys(wanted) if name in names or name in columns]
+
+
+def _with_row_ids(table: pa.Table, offset: int) -> pa.Table:
+    if ROW_ID_COLUMN in table.column_names:
+        return table
+    row_ids = pa.array(np.arange(offset, offset + table.num_rows))
+    return table.add_column(0, ROW_ID_COLUMN, row_ids)
+
+
+def _select(table: pa.Table, columns: Optional[List[str]]) -> pd.DataFrame:
+    if columns is not None:
+        table = table.select([ROW_ID_COLUMN] + [c for c in columns if c != ROW_ID_COLUMN])
+    return table.to_pandas()
+
+
+def _iter_parquet(
+    files: List[str],
+    columns: Optional[List[str]],
+    filters: Optional[List[Filter]],
+    batch_size: Optional[int],
+) -> Iterator[pd.DataFrame]:
+    dataset = ds.dataset(files, format="parquet")
+    read_columns = _read_columns(dataset.schema.names, columns, filters)
+
+    if not filters:
+        # the scanner reads the files and row groups in parallel and keeps their order
+        scanner = dataset.scanner(
+            columns=read_columns, batch_size=batch_size or 2**20, use_threads=True
         )
+        offset = 0
+        for batch in scanner.to_batches():
+            table = _with_row_ids(pa.Table.from_batches([batch]), offset)
+            offset += batch.num_rows
+            yield _select(table, columns)
+        return
+
+    # row ids are the positions in the unfiltered dataset, so the row groups are read one by one
+    # with their offset from the metadata, and row groups that the statistics of the filters
+    # rule out are not read at all
+    expression = pq.filters_to_expression(filters)
+    row_groups = []
+    offset = 0
+    for fragment in dataset.get_fragments():
+        fragment.ensure_complete_metadata()
+        starts = np.cumsum([0] + [row_group.num_rows for row_group in fragment.row_groups])
+        for row_group in fragment.split_by_row_group(expression):
+            row_groups.append((row_group, offset + int(starts[row_group.row_groups[0].id])))
+        offset += int(starts[-1])
+
+    def read(item: Tuple[ds.ParquetFileFragment, int]) -> pd.DataFrame:
+        row_group, start = item
+        table = _with_row_ids(row_group.to_table(columns=read_columns), start)
+        return _select(table.filter(expression), columns)
+
+    with ThreadPoolExecutor(READ_THREADS) as executor:
+        for window in batched(row_groups, READ_THREADS):
+            yield from executor.map(read, window)
+
+
+def _iter_csv(
+    files: List[str],
+    columns: Optional[List[str]],
+    filters: Optional[List[Filter]],
+    chunk_size: Optional[int],
+) -> Iterator[pd.DataFrame]:
+    expression = pq.filters_to_expression(filters) if filters else None
+    offset = 0
+
+    for path in files:
+        names = pd.read_csv(path, nrows=0).columns.tolist()
+        read_columns = _read_columns(names, columns, filters)
+        if chunk_size is None:
+            chunks = [pd.read_csv(path, usecols=read_columns)]
+        else:
+            chunks = pd.read_csv(path, usecols=read_columns, chunksize=chunk_size)
+
+        for chunk in chunks:
+            chunk = add_row_ids(chunk.reset_index(drop=True), offset=offset)
+            offset += len(chunk)
+            if expression is not None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False).filter(expression)
+                chunk = table.to_pandas()
+            if columns is not None:
+                chunk = chunk[[ROW_ID_COLUMN] + [c for c in columns if c != ROW_ID_COLUMN]]
+            yield chunk
+
+
+def _iter_dataset(
+    path: str,
+    columns: Optional[List[str]],
+    filters: Optional[List[Filter]],
+    chunk_size: Optional[int],
+) -> Iterator[pd.DataFrame]:
+    files = find_dataset_files(path)
+    if files[0].endswith(".parquet"):
+        return _iter_parquet(files, columns, filters, chunk_size)
+    return _iter_csv(files, columns, filters, chunk_size)
+
+
+def read_data(
+    path: str = "./data/input",
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Filter]] = None,
+) -> pd.DataFrame:
+    """Reads a dataset of one or more CSV or Parquet files into memory. Parquet files are read
+    with multiple threads, and only the requested columns and the row groups that can match the
+    filters are read.
 
-    dataset_file = os.path.join(dir_path, dataset_files[0])
+    Args:
+        path (str, optional): Path of a dataset file, a directory or a glob pattern. Defaults to
+            "./data/input".
+        columns (Optional[List[str]], optional): Columns to read in addition to the row id.
+            Defaults to all columns.
+        filters (Optional[List[Filter]], optional): Only rows that match all filters, e.g.
+            `[("lang", "==", "en")]`, are returned. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Loaded dataset with a row id column. Row ids are the positions in the
+            unfiltered dataset.
 
-    print(f"Reading data from {dataset_file} ...")
+    Raises:
+        ValueError: If no dataset file is found or CSV and Parquet files are mixed.
+    """
+    print(f"Reading data from {path} ...")
 
-    if dataset_file.endswith(".csv"):
-        df = pd.read_csv(dataset_file)
-    elif dataset_file.endswith(".parquet"):
-        df = pd.read_parquet(dataset_file)
+    chunks = list(_iter_dataset(path, columns, filters, None))
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
 
     print(f"Data loaded successfully, number of rows: {len(df)}")
     return df
 
 
+def count_rows(
+    dir_path: str = "./data/input", filters: Optional[List[Filter]] = None
+) -> Optional[int]:
+    """Counts the rows of the dataset from the Parquet metadata. With filters, only the filter
+    columns are read.
+
+    Args:
+        dir_path (str, optional): Path of a dataset file, a directory or a glob pattern.
+            Defaults to "./data/input".
+        filters (Optional[List[Filter]], optional): Only count the rows that match all filters.
+            Defaults to None.
+
+    Returns:
+        Optional[int]: Number of rows, or None for CSV files.
+    """
+    files = find_dataset_files(dir_path)
+
+    if not files[0].endswith(".parquet"):
+        return None
+
+    if not filters:
+        return sum(pq.ParquetFile(f).metadata.num_rows for f in files)
+
+    dataset = ds.dataset(files, format="parquet")
+    return dataset.count_rows(filter=pq.filters_to_expression(filters))
+
+
+def iter_data(
+    chunk_size: int,
+    dir_path: str = "./data/input",
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Filter]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Reads a dataset of one or more CSV or Parquet files in chunks of `chunk_size` rows, so
+    only a few chunks are held in memory at a time. See `read_data` for the columns and
+    filters.
+
+    Args:
+        chunk_size (int): Number of rows per chunk, only the last chunk may be smaller.
+        dir_path (str, optional): Path of a dataset file, a directory or a glob pattern.
+            Defaults to "./data/input".
+        columns (Optional[List[str]], optional): Columns to read in addition to the row id.
+            Defaults to all columns.
+        filters (Optional[List[Filter]], optional): Only rows that match all filters are
+            returned. Defaults to None.
+
+    Yields:
+        pd.DataFrame: The next chunk of the dataset with a row id column and a fresh RangeIndex.
+
+    Raises:
+        ValueError: If the chunk size is not positive or no dataset file can be found.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be a positive integer")
+
+    print(f"Streaming data from {dir_path} in chunks of {chunk_size} rows ...")
+
+    pending: List[pd.DataFrame] = []
+    num_pending = 0
+
+    for part in _iter_dataset(dir_path, columns, filters, chunk_size):
+        pending.append(part)
+        num_pending += len(part)
+
+        while num_pending >= chunk_size:
+            combined = pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+            yield combined.iloc[:chunk_size].reset_index(drop=True)
+            pending = [combined.iloc[chunk_size:]]
+            num_pending -= chunk_size
+
+    if num_pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def add_row_ids(df: pd.DataFrame, offset: int = 0) -> pd.DataFrame:
+    """Adds a stable row id column based on the position of each row in the input dataset. If
+    the dataset already provides a row id column, it is kept as is.
+
+    Args:
+        df (pd.DataFrame): DataFrame (or chunk of the dataset) to add row ids to.
+        offset (int, optional): Position of the first row of `df` in the dataset. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: DataFrame with a row id column.
+    """
+    if ROW_ID_COLUMN not in df.columns:
+        df.insert(0, ROW_ID_COLUMN, np.arange(offset, offset + len(df)))
+
+    return df
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yields lists of `size` consecutive items, the last list may be shorter.
+
+    Args:
+        iterable (Iterable[T]): Items to batch.
+        size (int): Number of items per batch.
+
+    Raises:
+        ValueError: If size is not a positive integer.
+
+    Returns:
+        Iterator[List[T]]: Batches of items.
+    """
+    if size <= 0:
+        raise ValueError("size must be a positive integer")
+
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class ParquetAppender:
+    """Appends DataFrame chunks to a single Parquet file, one row group per chunk.
+
+    The schema is taken from the first chunk and later chunks are cast to it, so the output is
+    readable as one table. The chunks are written to a temporary file that is only renamed to
+    `path` once the file is finalized, so readers never see a partially written output. Use it
+    as a context manager, which finalizes the file on success and removes the temporary file if
+    an exception is raised.
+
+    Args:
+        path (str): Path of the Parquet file to write.
+        metadata (Optional[Dict[str, str]], optional): Key-value metadata added to the schema.
+            Defaults to None.
+    """
+
+    def __init__(self, path: str, metadata: Optional[Dict[str, str]] = None) -> None:
+        self.path = path
+        directory, file_name = os.path.split(path)
+        self.tmp_path = os.path.join(directory, f".{file_name}.tmp")
+        self.metadata = metadata or {}
+        self.num_rows = 0
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._empty: Optional[pd.DataFrame] = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Appends a chunk to the output file.
+
+        Args:
+            df (pd.DataFrame): Chunk to append.
+        """
+        # the column types of an empty chunk are unknown, so the schema is taken from the
+        # first non-empty chunk
+        if self._writer is None and len(df) == 0:
+            self._empty = df
+            return
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.tmp_path, self._schema(table))
+        else:
+            table = table.cast(self._writer.schema)
+
+        self._writer.write_table(table)
+        self.num_rows += len(df)
+
+    def _schema(self, table: pa.Table) -> pa.Schema:
+        return table.schema.with_metadata({**(table.schema.metadata or {}), **self.metadata})
+
+    def close(self) -> None:
+        """Closes the underlying writer and moves the finalized file to `path`."""
+        if self._writer is None and self._empty is not None:
+            self._writer = pq.ParquetWriter(
+                self.tmp_path,
+                self._schema(pa.Table.from_pandas(self._empty, preserve_index=False)),
+            )
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self.tmp_path, self.path)
+        self._empty = None
+
+    def abort(self) -> None:
+        """Closes the underlying writer and removes the temporary file without touching
+        `path`."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self._empty = None
+
+    def __enter__(self) -> "ParquetAppender":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 def read_model_predictions(model_name: str, prediction_dir: str = "./data/") -> pd.DataFrame:
     """
     Reads the model predictions from a parquet file.
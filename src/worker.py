@@ -0,0 +1,196 @@
+import glob
+import json
+import os
+import time
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.settings import SPOOL_DIR, WORKER_POLL_INTERVAL
+
+
+def job_path(spool_dir: str, state: str, job_id: str) -> str:
+    """Returns the path of a job in the pending, running, done or failed jobs."""
+    return os.path.join(spool_dir, state, f"{job_id}.json")
+
+
+def _write_json_atomic(job: Dict[str, Any], path: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def submit_job(
+    input_path: str,
+    columns: List[str],
+    template: Optional[str] = None,
+    output_path: Optional[str] = None,
+    spool_dir: str = SPOOL_DIR,
+) -> str:
+    """Adds a labeling job to the spool directory of a worker.
+
+    Args:
+        input_path (str): Path of a CSV or Parquet file, a directory or a glob pattern to label.
+        columns (List[str]): The before and after columns.
+        template (Optional[str], optional): Prompt template with two placeholders, or the name
+            of a prompt in `src.prompt_components`. Defaults to the prompt of the worker.
+        output_path (Optional[str], optional): Path of the labeled output. Defaults to
+            `<spool_dir>/results/<job_id>.parquet`.
+        spool_dir (str, optional): Spool directory of the worker. Defaults to SPOOL_DIR.
+
+    Raises:
+        ValueError: If columns does not contain exactly 2 columns.
+
+    Returns:
+        str: Id of the job. Ids sort in the order in which the jobs were submitted.
+    """
+    if len(columns) != 2:
+        raise ValueError("columns should contain exactly 2 columns")
+
+    job_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:8]}"
+    if output_path is None:
+        output_path = os.path.join(spool_dir, "results", f"{job_id}.parquet")
+
+    job = {
+        "id": job_id,
+        "input": os.path.abspath(input_path),
+        "columns": columns,
+        "template": template,
+        "output": os.path.abspath(output_path),
+        "submitted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    os.makedirs(os.path.join(spool_dir, "pending"), exist_ok=True)
+    _write_json_atomic(job, job_path(spool_dir, "pending", job_id))
+
+    return job_id
+
+
+def claim_job(spool_dir: str = SPOOL_DIR) -> Optional[Dict[str, Any]]:
+    """Claims the oldest pending job by moving it to the running jobs.
+
+    Args:
+        spool_dir (str, optional): Spool directory of the worker. Defaults to SPOOL_DIR.
+
+    Returns:
+        Optional[Dict[str, Any]]: The claimed job, None if no job is pending.
+    """
+    os.makedirs(os.path.join(spool_dir, "running"), exist_ok=True)
+
+    for path in sorted(glob.glob(os.path.join(spool_dir, "pending", "*.json"))):
+        job_id = os.path.basename(path)[: -len(".json")]
+        try:
+            os.rename(path, job_path(spool_dir, "running", job_id))
+        except FileNotFoundError:
+            # claimed by another worker
+            continue
+
+        with open(job_path(spool_dir, "running", job_id)) as f:
+            return json.load(f)
+
+    return None
+
+
+def finish_job(
+    job: Dict[str, Any],
+    result: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None,
+    spool_dir: str = SPOOL_DIR,
+) -> str:
+    """Moves a running job to the done or failed jobs together with its result or error.
+
+    Args:
+        job (Dict[str, Any]): The running job.
+        result (Optional[Dict[str, Any]], optional): Result of the job. Defaults to None.
+        error (Optional[str], optional): Error of a failed job. Defaults to None.
+        spool_dir (str, optional): Spool directory of the worker. Defaults to SPOOL_DIR.
+
+    Returns:
+        str: Path of the finished job.
+    """
+    state = "failed" if error is not None else "done"
+    job = {
+        **job,
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "result": result,
+        "error": error,
+    }
+
+    os.makedirs(os.path.join(spool_dir, state), exist_ok=True)
+    path = job_path(spool_dir, state, job["id"])
+    _write_json_atomic(job, path)
+    os.remove(job_path(spool_dir, "running", job["id"]))
+
+    return path
+
+
+def requeue_running_jobs(spool_dir: str = SPOOL_DIR) -> List[str]:
+    """Moves the jobs left running by a stopped worker back to the pending jobs. Only one
+    worker may use a spool directory when this is called.
+
+    Args:
+        spool_dir (str, optional): Spool directory of the worker. Defaults to SPOOL_DIR.
+
+    Returns:
+        List[str]: Ids of the requeued jobs.
+    """
+    os.makedirs(os.path.join(spool_dir, "pending"), exist_ok=True)
+
+    job_ids = []
+    for path in sorted(glob.glob(os.path.join(spool_dir, "running", "*.json"))):
+        job_id = os.path.basename(path)[: -len(".json")]
+        os.rename(path, job_path(spool_dir, "pending", job_id))
+        job_ids.append(job_id)
+
+    return job_ids
+
+
+def run_worker(
+    handle_job: Callable[[Dict[str, Any]], Dict[str, Any]],
+    spool_dir: str = SPOOL_DIR,
+    poll_interval: float = WORKER_POLL_INTERVAL,
+    exit_when_idle: bool = False,
+) -> Tuple[int, int]:
+    """Processes the jobs of the spool directory one after another. A failing job is moved to
+    the failed jobs with its traceback and the worker continues with the next job.
+
+    Args:
+        handle_job (Callable[[Dict[str, Any]], Dict[str, Any]]): Processes a job and returns
+            its result.
+        spool_dir (str, optional): Spool directory of the worker. Defaults to SPOOL_DIR.
+        poll_interval (float, optional): Seconds to wait for new jobs when none is pending.
+            Defaults to WORKER_POLL_INTERVAL.
+        exit_when_idle (bool, optional): Return once no job is pending instead of waiting for
+            new jobs. Defaults to False.
+
+    Returns:
+        Tuple[int, int]: Number of done and failed jobs.
+    """
+    requeued = requeue_running_jobs(spool_dir)
+    if requeued:
+        print(f"Requeued {len(requeued)} jobs of a previous worker: {requeued}")
+
+    print(f"Waiting for jobs in {os.path.join(spool_dir, 'pending')} ...")
+    num_done, num_failed = 0, 0
+
+    while True:
+        job = claim_job(spool_dir)
+        if job is None:
+            if exit_when_idle:
+                return num_done, num_failed
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Starting job {job['id']} on {job['input']} ...")
+        try:
+            result = handle_job(job)
+        except Exception:
+            path = finish_job(job, error=traceback.format_exc(), spool_dir=spool_dir)
+            num_failed += 1
+            print(f"Job {job['id']} failed, see {path}")
+        else:
+            path = finish_job(job, result=result, spool_dir=spool_dir)
+            num_done += 1
+            print(f"Finished job {job['id']}, see {path}")
@@ -0,0 +1,73 @@
+import argparse
+import os
+
+from src.settings import SPOOL_DIR
+from src.worker import submit_job
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Simple argument parser for the script."""
+    parser = argparse.ArgumentParser(
+        description="Adds a labeling job to the spool directory of a filter_dataset.py worker."
+    )
+    parser.add_argument(
+        "--model_name",
+        "-m",
+        type=str,
+        required=True,
+        help="The model name of the worker that labels the job.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=str,
+        required=True,
+        help="Path of the CSV or Parquet file to label.",
+    )
+    parser.add_argument(
+        "--columns",
+        type=str,
+        default="before_revision,after_revision",
+        help="Comma separated before and after columns.",
+    )
+    parser.add_argument(
+        "--template",
+        type=str,
+        default=None,
+        help="Name of a prompt in src/prompt_components.py or a prompt template with two {} "
+        "placeholders. Defaults to the prompt of the worker.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Path of the labeled output. Defaults to <spool_dir>/results/<job_id>.parquet.",
+    )
+    parser.add_argument(
+        "--spool_dir",
+        type=str,
+        default=None,
+        help="Spool directory of the worker. Defaults to ./data/spool/<model_name>.",
+    )
+
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    spool_dir = args.spool_dir or os.path.join(SPOOL_DIR, args.model_name)
+
+    job_id = submit_job(
+        args.input,
+        args.columns.split(","),
+        template=args.template,
+        output_path=args.output,
+        spool_dir=spool_dir,
+    )
+
+    print(f"Submitted job {job_id} to {spool_dir}")
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,119 @@
+import sys
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+from src.backends import (
+    GenerationSettings,
+    OpenAICompatibleBackend,
+    VLLMBackend,
+    to_request_output,
+)
+from src.confidence import label_margins
+from src.stub_server import StubServer, stub_label
+
+
+@pytest.fixture
+def params():
+    return SimpleNamespace(temperature=0.0, seed=42, max_tokens=32)
+
+
+def test_generate_keeps_prompt_order(params):
+    prompts = [f"prompt {i}" for i in range(20)]
+
+    with StubServer(latency=0.01) as server:
+        backend = OpenAICompatibleBackend(server.base_url, "stub", max_concurrency=4)
+        labels = backend.generate(prompts, params, choices=["good", "bad"], system_prompt="sys")
+        backend.close()
+
+    assert labels == [stub_label(f"sys\n{prompt}", ["good", "bad"]) for prompt in prompts]
+    assert server.max_in_flight <= 4
+
+
+def test_generate_reuses_connections(params):
+    with StubServer() as server:
+        backend = OpenAICompatibleBackend(server.base_url, "stub", max_concurrency=2)
+        backend.generate([f"a {i}" for i in range(10)], params, choices=["good", "bad"])
+        backend.generate([f"b {i}" for i in range(10)], params, choices=["good", "bad"])
+        backend.close()
+
+    assert server.num_requests == 20
+    assert len(server.peers) <= 2
+
+
+def test_generate_retries_failed_requests(params):
+    with StubServer(fail_first=3) as server:
+        backend = OpenAICompatibleBackend(server.base_url, "stub", backoff=0.001)
+        labels = backend.generate(["a prompt"], params, choices=["good", "bad"])
+        backend.close()
+
+    assert labels == [stub_label("a prompt", ["good", "bad"])]
+    assert backend.num_retries == 3
+
+
+def test_generate_gives_up_after_max_retries(params):
+    with StubServer(fail_first=10) as server:
+        backend = OpenAICompatibleBackend(server.base_url, "stub", max_retries=2, backoff=0.001)
+        with pytest.raises(RuntimeError, match="Request failed after 2 retries"):
+            backend.generate(["a prompt"], params, choices=["good", "bad"])
+        backend.close()
+
+
+def test_generate_request_output_with_logprobs():
+    params = SimpleNamespace(temperature=0.0, seed=42, max_tokens=32, logprobs=2)
+
+    with StubServer() as server:
+        backend = OpenAICompatibleBackend(server.base_url, "stub")
+        outputs = backend.generate(
+            ["a prompt"], params, choices=["good", "bad"], return_type="request_output"
+        )
+        backend.close()
+
+    labels, margins = label_margins(outputs, ["good", "bad"])
+
+    assert labels == [stub_label("a prompt", ["good", "bad"])]
+    assert margins[0] == pytest.approx(2.95)
+    assert outputs[0].usage.prompt_tokens == 2
+
+
+def test_merge_system_prompt():
+    backend = OpenAICompatibleBackend("http://localhost/v1", "stub", merge_system_prompt=True)
+
+    messages = backend._messages("prompt", "system")
+    backend.close()
+
+    assert messages == [{"role": "user", "content": "system\n\nprompt"}]
+
+
+def test_to_request_output_without_logprobs():
+    response = {"choices": [{"message": {"content": "good"}}]}
+
+    output = to_request_output(response)
+
+    assert output.outputs[0].text == "good"
+    assert output.outputs[0].logprobs is None
+
+
+def test_vllm_backend_converts_generation_settings(monkeypatch):
+    flex_infer = ModuleType("flex_infer")
+    flex_infer.GenerationParams = lambda **kwargs: kwargs
+    monkeypatch.setitem(sys.modules, "flex_infer", flex_infer)
+    model = SimpleNamespace(generate=lambda prompts, params, **kwargs: [params] * len(prompts))
+
+    [params] = VLLMBackend(model).generate(
+        ["a prompt"], GenerationSettings(temperature=0.5, seed=42, max_tokens=32)
+    )
+
+    assert params == {"temperature": 0.5, "seed": 42, "max_tokens": 32}
+
+
+def test_payload_from_generation_settings():
+    backend = OpenAICompatibleBackend("http://localhost/v1", "stub")
+
+    payload = backend._payload(
+        "prompt", GenerationSettings(seed=42, max_tokens=32, logprobs=2), ["good", "bad"], None
+    )
+    backend.close()
+
+    assert payload["max_tokens"] == 32
+    assert payload["top_logprobs"] == 2
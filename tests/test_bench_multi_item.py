@@ -0,0 +1,21 @@
+import sys
+
+import filter_dataset
+from benchmarks.bench_multi_item import run_multi_item
+from benchmarks.bench_pipeline import FakeModel, FakeModelLoader, make_dataset
+
+
+def test_run_multi_item(monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    df = make_dataset(40)
+    df["label"] = "good"
+
+    results = run_multi_item(
+        df, "gemma-2b", FakeModelLoader("gemma-2b", FakeModel()), [4, 2], label_column="label"
+    )
+
+    assert [result["items_per_prompt"] for result in results] == [1, 2, 4]
+    assert results[0]["agreement_with_single_row"] == 1.0
+    assert results[2]["prompt_tokens_per_row"] < results[0]["prompt_tokens_per_row"] / 2
+    assert all(0.0 <= result["accuracy"] <= 1.0 for result in results)
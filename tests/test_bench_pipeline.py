@@ -0,0 +1,67 @@
+import sys
+
+import pandas as pd
+
+import filter_dataset
+from benchmarks.bench_pipeline import (
+    COLUMNS,
+    FakeModel,
+    FakeModelLoader,
+    make_dataset,
+    run_pipeline,
+)
+from src.checkpoint import CheckpointStore
+
+
+def test_make_dataset_duplicate_ratio():
+    df = make_dataset(1000, duplicate_ratio=0.2)
+
+    assert len(df) == 1000
+    assert df.duplicated().mean() < 0.25
+    assert df["after_revision"].nunique() > 700
+
+
+def test_run_pipeline(tmp_path, monkeypatch):
+    # the benchmark runs without a GPU, so importing flex_infer (and vLLM) fails the test
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    result = run_pipeline(200, ["gemma-2b", "gemma-2-9b"], chunk_size=64, work_dir=str(tmp_path))
+
+    stages = [stage["stage"] for stage in result["stages"]]
+    assert stages == [
+        "filter:gemma-2b",
+        "add_labels:gemma-2b",
+        "filter:gemma-2-9b",
+        "add_labels:gemma-2-9b",
+        "combine",
+    ]
+    assert all(stage["rows_per_second"] > 0 for stage in result["stages"])
+
+    combined = pd.read_parquet(tmp_path / "data" / "output" / "combined_dataset.parquet")
+    assert len(combined) == 200
+    assert set(combined["quality_label"]) <= {"good", "bad"}
+
+
+def test_pipelined_streaming_matches_sequential(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    (tmp_path / "data" / "input").mkdir(parents=True)
+    make_dataset(300).to_parquet("data/input/in.parquet", index=False)
+
+    outputs = []
+    for depth in [0, 2]:
+        path = str(tmp_path / f"out_{depth}_{{}}.parquet")
+        filter_dataset.generate_output_streaming(
+            "gemma-2b",
+            COLUMNS,
+            64,
+            CheckpointStore("gemma-2b", f"depth{depth}", str(tmp_path / "checkpoints")),
+            checkpoint_interval=16,
+            model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+            path=path,
+            pipeline_depth=depth,
+        )
+        outputs.append(pd.read_parquet(path.format("gemma-2b")))
+
+    assert outputs[1]["row_id"].tolist() == list(range(300))
+    pd.testing.assert_frame_equal(outputs[0], outputs[1])
@@ -0,0 +1,86 @@
+import pytest
+
+from src.cache import PredictionCache, config_fingerprint, prediction_key
+
+
+def test_config_fingerprint_is_order_independent():
+    assert config_fingerprint({"a": 1, "b": [1, 2]}) == config_fingerprint({"b": [1, 2], "a": 1})
+    assert config_fingerprint({"a": 1}) != config_fingerprint({"a": 2})
+
+
+def test_prediction_key_depends_on_fingerprint_and_prompt():
+    key = prediction_key("abc", "prompt")
+
+    assert key == prediction_key("abc", "prompt")
+    assert key != prediction_key("abd", "prompt")
+    assert key != prediction_key("abc", "other prompt")
+
+
+def test_prediction_cache_hits_and_misses(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({"k1": ("good", None), "k2": ("bad", 1.5)})
+
+    found = cache.get_many(["k1", "k2", "k3", "k1"])
+
+    assert found == {"k1": ("good", None), "k2": ("bad", 1.5)}
+    assert cache.hits == 3
+    assert cache.misses == 1
+    assert cache.stats()["hit_rate"] == 0.75
+
+
+def test_prediction_cache_is_persistent(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = PredictionCache(path)
+    cache.put_many({"k1": ("good", None)})
+    cache.close()
+
+    assert PredictionCache(path).get_many(["k1"]) == {"k1": ("good", None)}
+
+
+def test_prediction_cache_evicts_least_recently_used(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put_many({"k1": ("good", None)})
+    cache.put_many({"k2": ("bad", None)})
+    cache.get_many(["k1"])
+
+    cache.put_many({"k3": ("good", None)})
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    assert set(cache.get_many(["k1", "k2", "k3"])) == {"k1", "k3"}
+
+
+def test_prediction_cache_counts_only_new_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = PredictionCache(path, max_entries=3)
+    cache.put_many({"k1": ("good", None), "k2": ("bad", None)})
+    cache.put_many({"k1": ("bad", None), "k2": ("bad", None), "k3": ("good", None)})
+    cache.close()
+
+    # the entries are counted again when the cache is reopened
+    cache = PredictionCache(path, max_entries=3)
+    cache.put_many({"k4": ("good", None)})
+
+    assert cache.evictions == 1
+    assert len(cache) == 3
+
+
+def test_prediction_cache_require_margin(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({"k1": ("good", 3.0), "k2": ("bad", None)})
+
+    assert cache.get_many(["k1", "k2"], require_margin=True) == {"k1": ("good", 3.0)}
+
+
+def test_prediction_cache_keeps_margin(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({"k1": ("good", 3.0)})
+
+    cache.put_many({"k1": ("good", None)})
+
+    assert cache.get_many(["k1"]) == {"k1": ("good", 3.0)}
+
+
+def test_prediction_cache_invalid_size(tmp_path):
+    with pytest.raises(ValueError, match="max_entries must be a positive integer"):
+        PredictionCache(str(tmp_path / "cache.sqlite"), max_entries=0)
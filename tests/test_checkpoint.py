@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+
+from src.checkpoint import CheckpointStore, run_fingerprint, write_parquet_atomic
+
+
+def test_run_fingerprint_depends_on_configuration():
+    fingerprint = run_fingerprint("model", "template {} {}", "system", 42)
+
+    assert fingerprint == run_fingerprint("model", "template {} {}", "system", 42)
+    assert fingerprint != run_fingerprint("model", "template {} {}", "system", 43)
+    assert fingerprint != run_fingerprint("other", "template {} {}", "system", 42)
+
+
+def test_run_fingerprint_depends_on_settings():
+    fingerprint = run_fingerprint("model", "template {} {}", "system", 42)
+
+    assert fingerprint == run_fingerprint("model", "template {} {}", "system", 42, settings={})
+    assert fingerprint != run_fingerprint(
+        "model", "template {} {}", "system", 42, settings={"scoring": True}
+    )
+    assert run_fingerprint(
+        "model", "template {} {}", "system", 42, settings={"dedup": "near", "scoring": True}
+    ) == run_fingerprint(
+        "model", "template {} {}", "system", 42, settings={"scoring": True, "dedup": "near"}
+    )
+
+
+def test_checkpoint_store_save_and_load(tmp_path):
+    store = CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path))
+
+    store.save(pd.DataFrame({"row_id": [0, 1], "prediction": ["good", "bad"]}))
+    store.save(pd.DataFrame({"row_id": [5], "prediction": ["good"]}))
+
+    completed = CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path)).load()
+
+    assert completed["prediction"].to_dict() == {0: "good", 1: "bad", 5: "good"}
+
+
+def test_checkpoint_store_continues_part_numbering(tmp_path):
+    CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path)).save(
+        pd.DataFrame({"row_id": [0], "prediction": ["good"]})
+    )
+
+    store = CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path))
+    store.save(pd.DataFrame({"row_id": [1], "prediction": ["bad"]}))
+
+    assert sorted(os.listdir(store.path)) == ["part-000000.parquet", "part-000001.parquet"]
+
+
+def test_checkpoint_store_load_empty(tmp_path):
+    store = CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path))
+
+    assert store.load().empty
+
+
+def test_checkpoint_store_clear(tmp_path):
+    store = CheckpointStore("model", "abc", checkpoint_dir=str(tmp_path))
+    store.save(pd.DataFrame({"row_id": [0], "prediction": ["good"]}))
+
+    store.clear()
+
+    assert not os.path.exists(store.path)
+    assert store.load().empty
+
+
+def test_write_parquet_atomic(tmp_path):
+    path = str(tmp_path / "file.parquet")
+
+    write_parquet_atomic(pd.DataFrame({"col1": [1, 2]}), path)
+
+    assert os.listdir(tmp_path) == ["file.parquet"]
+    assert pd.read_parquet(path)["col1"].tolist() == [1, 2]
@@ -1,9 +1,20 @@
+import argparse
 from unittest import mock
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pytest
 
-from combine_labels import find_label_columns, load_labeled_data
+from combine_labels import (
+    count_votes,
+    find_label_columns,
+    load_labeled_data,
+    main,
+    parse_weights,
+    vote,
+)
+from src.label_store import LabelStore, encode_labels
 
 
 @mock.patch("combine_labels.pd.read_parquet")
@@ -41,6 +52,19 @@ def test_find_label_columns_valid():
     assert label_columns == ["col1", "col2"]
 
 
+def test_find_label_columns_skips_missing_values():
+    data = {
+        "col1": [None, "bad", "good"],
+        "col2": [None, None, None],
+        "col3": ["neutral", "some_value5", "some_value6"],
+    }
+    df = pd.DataFrame(data)
+
+    label_columns = find_label_columns(df)
+
+    assert label_columns == ["col1"]
+
+
 def test_find_label_columns_no_labels():
     data = {
         "col1": ["neutral", "some_value1", "some_value2"],
@@ -58,3 +82,172 @@ def test_find_label_columns_empty_dataframe():
 
     with pytest.raises(ValueError, match="No data found in the dataset."):
         find_label_columns(df)
+
+
+def test_parse_weights():
+    assert parse_weights("m1=2, m2=0.5") == {"m1": 2.0, "m2": 0.5}
+    assert parse_weights(None) == {}
+
+    with pytest.raises(ValueError, match="Invalid weight m1"):
+        parse_weights("m1")
+
+
+def test_count_votes_skips_missing_labels():
+    labels = pa.table(
+        {
+            "m1_prediction": ["bad", "good", None],
+            "m2_prediction": ["bad", "bad", "good"],
+        }
+    )
+
+    bad_votes, votes = count_votes(labels, ["m1_prediction", "m2_prediction"], {"m2": 3.0})
+
+    assert bad_votes.tolist() == [4.0, 3.0, 0.0]
+    assert votes.tolist() == [4.0, 4.0, 3.0]
+
+
+def test_count_votes_dictionary_encoded_labels():
+    labels = pa.Table.from_pandas(
+        pd.DataFrame(
+            {
+                "m1_prediction": encode_labels(["bad", "good", None]),
+                "m2_prediction": encode_labels(["good", "good", "bad"]),
+            }
+        )
+    )
+
+    bad_votes, votes = count_votes(labels, ["m1_prediction", "m2_prediction"])
+
+    assert bad_votes.tolist() == [1.0, 0.0, 1.0]
+    assert votes.tolist() == [2.0, 2.0, 1.0]
+
+
+def test_count_votes_rethresholds_probabilities():
+    labels = pa.table(
+        {
+            "m1_prediction": ["good", "good", "bad", None],
+            "m1_p_bad": [0.1, 0.3, 0.9, None],
+            "m2_prediction": ["good", "good", "good", "bad"],
+        }
+    )
+
+    bad_votes, votes = count_votes(labels, ["m1_prediction", "m2_prediction"], p_bad_threshold=0.25)
+
+    assert bad_votes.tolist() == [0.0, 1.0, 1.0, 1.0]
+    assert votes.tolist() == [2.0, 2.0, 2.0, 1.0]
+
+
+def test_vote_policies():
+    bad_votes = np.array([0.0, 1.0, 2.0, 3.0])
+    votes = np.array([3.0, 3.0, 4.0, 3.0])
+
+    assert vote(bad_votes, votes, "or").tolist() == [False, True, True, True]
+    assert vote(bad_votes, votes, "majority").tolist() == [False, False, True, True]
+    assert vote(bad_votes, votes, "weighted", threshold=0.9).tolist() == [
+        False,
+        False,
+        False,
+        True,
+    ]
+
+    with pytest.raises(ValueError, match="Policy unknown not supported."):
+        vote(bad_votes, votes, "unknown")
+
+
+def test_main_streams_label_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "input").mkdir(parents=True)
+    (tmp_path / "data" / "output").mkdir()
+    pd.DataFrame({"text": ["a", "b", "c", "d", "e"]}).to_parquet("data/input/in.parquet")
+
+    store = LabelStore()
+    store.add(
+        "m1",
+        pd.DataFrame(
+            {
+                "row_id": range(5),
+                "m1_prediction": ["good", "bad", "good", "bad", "good"],
+                "m1_margin": [1.0] * 5,
+            }
+        ),
+    )
+    store.add(
+        "m2",
+        pd.DataFrame({"row_id": range(5), "m2_prediction": ["good", None, "bad", "bad", "good"]}),
+    )
+
+    args = argparse.Namespace(
+        policy="or",
+        weights=None,
+        threshold=0.5,
+        p_bad_threshold=None,
+        input="./data/input",
+        chunk_size=2,
+    )
+    main(args)
+
+    combined = pd.read_parquet("data/output/combined_dataset.parquet")
+    filtered = pd.read_parquet("data/output/filtered_dataset.parquet")
+
+    assert combined.columns.tolist() == ["row_id", "text", "quality_label"]
+    assert combined["quality_label"].tolist() == ["good", "bad", "bad", "bad", "good"]
+    assert combined["quality_label"].cat.categories.tolist() == ["good", "bad"]
+    assert filtered["text"].tolist() == ["a", "e"]
+
+
+def test_main_reads_labeled_dataset_without_label_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "output").mkdir(parents=True)
+    pd.DataFrame(
+        {
+            "text": ["a", "b", "c"],
+            "m1_prediction": ["good", "bad", "bad"],
+            "m2_prediction": ["good", "good", "bad"],
+        }
+    ).to_parquet("data/output/labeled_dataset.parquet")
+
+    args = argparse.Namespace(
+        policy="majority",
+        weights=None,
+        threshold=0.6,
+        p_bad_threshold=None,
+        input="./data/input",
+        chunk_size=2,
+    )
+    main(args)
+
+    combined = pd.read_parquet("data/output/combined_dataset.parquet")
+
+    assert combined.columns.tolist() == ["text", "quality_label"]
+    assert combined["quality_label"].tolist() == ["good", "good", "bad"]
+
+
+def test_main_rethresholds_scored_model(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "input").mkdir(parents=True)
+    (tmp_path / "data" / "output").mkdir()
+    pd.DataFrame({"text": ["a", "b", "c"]}).to_parquet("data/input/in.parquet")
+    LabelStore().add(
+        "m1",
+        pd.DataFrame(
+            {
+                "row_id": range(3),
+                "m1_prediction": ["good", "good", "bad"],
+                "m1_margin": [2.0, 0.5, 1.0],
+                "m1_p_bad": np.array([0.1, 0.4, 0.7], dtype=np.float32),
+            }
+        ),
+    )
+
+    args = argparse.Namespace(
+        policy="or",
+        weights=None,
+        threshold=0.5,
+        p_bad_threshold=0.3,
+        input="./data/input",
+        chunk_size=2,
+    )
+    main(args)
+
+    combined = pd.read_parquet("data/output/combined_dataset.parquet")
+    assert combined["quality_label"].tolist() == ["good", "bad", "bad"]
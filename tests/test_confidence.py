@@ -0,0 +1,174 @@
+import json
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.confidence import (
+    CascadeStage,
+    bad_probability,
+    choice_logprobs,
+    label_margins,
+    score_choices,
+)
+from src.label_store import LabelStore
+
+
+def _output(text, token_logprobs):
+    logprobs = {
+        i: SimpleNamespace(decoded_token=token, logprob=logprob)
+        for i, (token, logprob) in enumerate(token_logprobs)
+    }
+    return SimpleNamespace(outputs=[SimpleNamespace(text=text, logprobs=[logprobs])])
+
+
+def test_choice_logprobs_matches_token_prefixes():
+    logprobs = {
+        0: SimpleNamespace(decoded_token="good", logprob=-0.1),
+        1: SimpleNamespace(decoded_token=" b", logprob=-2.5),
+        2: SimpleNamespace(decoded_token="the", logprob=-5.0),
+    }
+
+    best = choice_logprobs(logprobs, ["good", "bad"])
+
+    assert best == {"good": -0.1, "bad": -2.5}
+
+
+def test_label_margins():
+    outputs = [
+        _output("good", [("good", -0.1), ("bad", -2.6)]),
+        _output("bad", [("bad", -0.2)]),
+        SimpleNamespace(outputs=[SimpleNamespace(text="good", logprobs=None)]),
+    ]
+
+    labels, margins = label_margins(outputs, ["good", "bad"])
+
+    assert labels == ["good", "bad", "good"]
+    assert margins[0] == pytest.approx(2.5)
+    assert math.isinf(margins[1])
+    assert margins[2] == 0.0
+
+
+def test_score_choices_uses_logprobs_of_first_token():
+    outputs = [
+        # the generated token is "go", but "bad" has the higher logprob
+        _output("go", [("go", -1.5), ("b", -0.3)]),
+        _output("b", [("b", -0.2)]),
+        SimpleNamespace(outputs=[SimpleNamespace(text="go", logprobs=None)]),
+    ]
+
+    labels, margins = score_choices(outputs, ["good", "bad"])
+
+    assert labels == ["bad", "bad", "good"]
+    assert margins[0] == pytest.approx(1.2)
+    assert math.isinf(margins[1])
+    assert margins[2] == 0.0
+
+
+def test_bad_probability():
+    labels = pd.Series(["bad", "good", "bad", None, "good"])
+    margins = pd.Series([0.0, math.log(3), float("inf"), np.nan, np.nan])
+
+    p_bad = bad_probability(labels, margins)
+
+    assert p_bad.dtype == np.float32
+    assert p_bad[:3].tolist() == pytest.approx([0.5, 0.25, 1.0])
+    assert np.isnan(p_bad[3:]).all()
+
+
+def _stage(threshold=2.0):
+    predictions = pd.DataFrame(
+        {
+            "small_prediction": ["good", "bad", "good"],
+            "small_margin": [3.0, 0.5, float("inf")],
+            "small_stage": ["model", "model", "rule:empty_or_short"],
+        },
+        index=pd.Index([0, 1, 2], name="row_id"),
+    )
+    return CascadeStage("small", predictions, threshold)
+
+
+def test_cascade_stage_decide():
+    stage = _stage()
+
+    labels, margins, stages = stage.decide(pd.Series([2, 1, 0], index=[10, 11, 12]))
+
+    assert labels.index.tolist() == [10, 11, 12]
+    assert labels.isna().tolist() == [False, True, False]
+    assert labels[10] == "good"
+    assert margins[11] == 0.5
+    assert stages[10] == "rule:empty_or_short"
+    assert stages[12] == "model:small"
+    assert stage.report()["escalation_rate"] == pytest.approx(1 / 3)
+
+
+def test_cascade_stage_unknown_rows_are_escalated():
+    labels, _, _ = _stage().decide(pd.Series([99]))
+
+    assert labels.isna().all()
+
+
+def test_cascade_stage_from_file(tmp_path):
+    pd.DataFrame(
+        {"row_id": [0, 1], "small_prediction": ["good", "bad"], "small_margin": [3.0, 0.1]}
+    ).to_parquet(tmp_path / "labeled_data_small.parquet")
+
+    stage = CascadeStage.from_file("small", 2.0, prediction_dir=str(tmp_path))
+
+    assert stage.margins(pd.Series([1, 0])).tolist() == [0.1, 3.0]
+
+
+def test_cascade_stage_from_file_without_margins(tmp_path):
+    pd.DataFrame({"row_id": [0], "small_prediction": ["good"]}).to_parquet(
+        tmp_path / "labeled_data_small.parquet"
+    )
+
+    with pytest.raises(ValueError, match="have no margins"):
+        CascadeStage.from_file("small", 2.0, prediction_dir=str(tmp_path))
+
+
+def test_cascade_stage_from_label_store(tmp_path):
+    store = LabelStore(str(tmp_path / "labels"))
+    store.add(
+        "small",
+        pd.DataFrame(
+            {
+                "row_id": [1, 0],
+                "small_prediction": ["bad", "good"],
+                "small_margin": [0.1, 3.0],
+                "small_stage": ["model", "rule:empty_or_short"],
+                "small_p_bad": [0.5, 0.1],
+            }
+        ),
+    )
+
+    stage = CascadeStage.from_label_store("small", 2.0, label_store=store)
+    labels, margins, stages = stage.decide(pd.Series([0, 1]))
+
+    assert "small_p_bad" not in stage.predictions.columns
+    assert labels.tolist()[0] == "good" and pd.isna(labels[1])
+    assert margins.tolist() == [3.0, 0.1]
+    assert stages[0] == "rule:empty_or_short"
+
+
+def test_cascade_stage_from_label_store_without_margins(tmp_path):
+    store = LabelStore(str(tmp_path / "labels"))
+    store.add("small", pd.DataFrame({"row_id": [0], "small_prediction": ["good"]}))
+
+    with pytest.raises(ValueError, match="have no margins"):
+        CascadeStage.from_label_store("small", 2.0, label_store=store)
+
+    with pytest.raises(FileNotFoundError):
+        CascadeStage.from_label_store("large", 2.0, label_store=store)
+
+
+def test_cascade_stage_save_report(tmp_path):
+    stage = _stage()
+    stage.decide(pd.Series([0, 1]))
+
+    stage.save_report("large", path=str(tmp_path / "report_{}.json"))
+
+    with open(tmp_path / "report_large.json") as f:
+        assert json.load(f)["escalated"] == 1
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.dedup import (
+    collapse_duplicates,
+    minhash_signatures,
+    near_duplicate_clusters,
+    ngram_hashes,
+    normalize_text,
+)
+
+TEMPLATE = "The football club {} sacked its manager after the defeat against {} on Sunday."
+
+
+def test_normalize_text():
+    texts = pd.Series(["  Hello   World ", "hello world", None])
+
+    assert normalize_text(texts).tolist() == ["hello world", "hello world", ""]
+
+
+def test_collapse_duplicates_exact():
+    df = pd.DataFrame({"before": ["a", "b", "a", "a"], "after": ["x", "y", "x", "z"]})
+
+    unique_df, codes = collapse_duplicates(df, ["before", "after"], mode="exact")
+
+    assert unique_df.index.tolist() == [0, 1, 3]
+    assert codes.tolist() == [0, 1, 0, 2]
+
+
+def test_collapse_duplicates_normalized():
+    df = pd.DataFrame({"before": ["A  text", "a text", "a text"], "after": ["x", "x ", "y"]})
+
+    exact_df, _ = collapse_duplicates(df, ["before", "after"], mode="exact")
+    unique_df, codes = collapse_duplicates(df, ["before", "after"], mode="normalized")
+
+    assert len(exact_df) == 3
+    assert unique_df.index.tolist() == [0, 2]
+    assert codes.tolist() == [0, 0, 1]
+
+
+def test_collapse_duplicates_broadcast_labels():
+    df = pd.DataFrame({"before": ["a", "b", "a"], "after": ["x", "y", "x"]})
+
+    unique_df, codes = collapse_duplicates(df, ["before", "after"])
+    unique_labels = pd.Series(["good", "bad"]).to_numpy()
+
+    assert unique_labels[codes].tolist() == ["good", "bad", "good"]
+
+
+def test_collapse_duplicates_none():
+    df = pd.DataFrame({"before": ["a", "a"], "after": ["x", "x"]})
+
+    unique_df, codes = collapse_duplicates(df, ["before", "after"], mode="none")
+
+    assert len(unique_df) == 2
+    assert codes.tolist() == [0, 1]
+
+
+def test_collapse_duplicates_invalid_mode():
+    df = pd.DataFrame({"before": ["a"], "after": ["x"]})
+
+    with pytest.raises(ValueError, match="Dedup mode fuzzy not supported"):
+        collapse_duplicates(df, ["before", "after"], mode="fuzzy")
+
+
+def test_ngram_hashes():
+    rows, hashes = ngram_hashes(pd.Series(["ab", "AB", None]), (2, 3))
+
+    # " ab " has three bigrams and two trigrams, the missing text only " ", " "
+    assert np.bincount(rows).tolist() == [5, 5, 1]
+    assert hashes[rows == 0].tolist() == hashes[rows == 1].tolist()
+    assert not set(ngram_hashes(pd.Series(["ab"]), (2, 3), salt=1)[1]) & set(hashes)
+
+
+def test_minhash_signatures_estimate_similarity():
+    df = pd.DataFrame(
+        {
+            "before": [TEMPLATE.format("Ajax", "Porto"), TEMPLATE.format("Ajax", "Porto!"), ""],
+            "after": ["sacked", "sacked", ""],
+        }
+    )
+
+    signatures = minhash_signatures(df, ["before", "after"], num_perm=64, batch_size=2)
+
+    assert signatures.shape == (3, 64)
+    assert (signatures[0] == signatures[1]).mean() > 0.8
+    assert (signatures[0] == signatures[2]).mean() < 0.1
+    assert (signatures[2] == np.iinfo(np.uint32).max).all()
+
+
+def test_near_duplicate_clusters():
+    clubs = ["Ajax", "Ajax", "Borussia Dortmund", "Ajax"]
+    df = pd.DataFrame(
+        {
+            "before": [TEMPLATE.format(club, "Porto") for club in clubs] + ["Something else."],
+            "after": ["x", "x", "x", "A completely different revision of the sentence.", "x"],
+        }
+    )
+    df.loc[1, "before"] += " "
+
+    signatures = minhash_signatures(df, ["before", "after"])
+
+    assert near_duplicate_clusters(signatures).tolist() == [0, 0, 2, 3, 4]
+    assert near_duplicate_clusters(signatures, threshold=0.5).tolist() == [0, 0, 0, 3, 4]
+
+    with pytest.raises(ValueError, match="5 bands do not divide"):
+        near_duplicate_clusters(signatures, num_bands=5)
+
+
+def test_collapse_duplicates_near():
+    df = pd.DataFrame(
+        {
+            "before": ["Other text.", TEMPLATE.format("Ajax", "Porto"), "Other text."],
+            "after": ["y", TEMPLATE.format("Ajax", "Porto"), "y"],
+        },
+        index=[10, 11, 12],
+    )
+    df = pd.concat([df, df.iloc[[1]].assign(after=TEMPLATE.format("Ajax", "FC Porto"))])
+
+    unique_df, codes = collapse_duplicates(df, ["before", "after"], mode="near")
+
+    assert unique_df.index.tolist() == [10, 11]
+    assert codes.tolist() == [0, 1, 0, 1]
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.distill import DistillStage, HashedNgramClassifier, hash_features
+
+
+def make_pairs(num_rows, seed=0):
+    """Revision pairs whose label depends on a marker word in the revised text."""
+    rng = np.random.default_rng(seed)
+    words = np.array(["the", "club", "planet", "moved", "season", "won", "space", "river"])
+    is_bad = rng.random(num_rows) < 0.3
+    before = [" ".join(rng.choice(words, size=6)) for _ in range(num_rows)]
+    after = [
+        text + (" zzqx junk" if bad else " today") for text, bad in zip(before, is_bad.tolist())
+    ]
+
+    df = pd.DataFrame({"row_id": np.arange(num_rows), "before": before, "after": after})
+    return df, pd.Series(np.where(is_bad, "bad", "good"))
+
+
+def test_hash_features_are_normalized_per_row():
+    df = pd.DataFrame({"before": ["abc abc", "", None], "after": ["xyz", "", "Hello"]})
+
+    features = hash_features(df, ["before", "after"], hash_bits=12, ngram_range=(2, 3))
+
+    norms = np.bincount(features.rows, features.values**2, minlength=3)
+    assert features.num_rows == 3
+    assert norms == pytest.approx([1.0, 1.0, 1.0])
+    assert (np.diff(features.rows) >= 0).all()
+    assert features.columns.max() < 2**12
+
+
+def test_hash_features_depend_on_column_and_case():
+    df = pd.DataFrame({"a": ["Some Text", "some text", ""], "b": ["", "", "some text"]})
+
+    features = hash_features(df, ["a", "b"], hash_bits=16)
+    columns = [set(features.columns[features.rows == row]) for row in range(3)]
+
+    assert columns[0] == columns[1]
+    assert not columns[0] & columns[2]
+
+
+def test_features_take():
+    df = pd.DataFrame({"text": ["aa", "bbb", "", "cccc"]})
+    features = hash_features(df, ["text"], hash_bits=10)
+
+    taken = features.take(np.array([3, 0, 2]))
+    expected = hash_features(df.iloc[[3, 0, 2]], ["text"], hash_bits=10)
+
+    assert taken.num_rows == 3
+    for actual, wanted in zip(taken[:3], expected[:3]):
+        np.testing.assert_array_equal(actual, wanted)
+
+
+def test_classifier_learns_labels():
+    df, labels = make_pairs(600)
+    classifier = HashedNgramClassifier(hash_bits=16)
+
+    classifier.fit(classifier.features(df[:400], ["before", "after"]), labels[:400] == "bad")
+    logits = classifier.predict_logits(df[400:], ["before", "after"], batch_size=64)
+
+    assert len(logits) == 200
+    assert ((logits >= 0) == (labels[400:] == "bad")).mean() > 0.95
+
+
+def test_distill_stage_select_sample():
+    stage = DistillStage(sample_size=5)
+    row_ids = pd.Series(np.arange(20), index=np.arange(100, 120))
+
+    sample = stage.select_sample(row_ids)
+
+    assert len(sample) == 5
+    assert sample.isin(row_ids.index).all()
+    assert stage.select_sample(row_ids[::-1]).sort_values().equals(sample.sort_values())
+
+    stage.add(
+        pd.DataFrame({"row_id": [1, 2], "text": ["a", "b"]}), ["text"], pd.Series(["good", None])
+    )
+    assert stage.needed == 4
+
+
+def test_distill_stage_fit_and_decide(tmp_path):
+    df, labels = make_pairs(800)
+    stage = DistillStage(
+        sample_size=500,
+        threshold=0.8,
+        holdout=0.2,
+        classifier=HashedNgramClassifier(hash_bits=16),
+    )
+    stage.add(df[:500], ["before", "after"], labels[:500])
+
+    evaluation = stage.fit(["before", "after"])
+    kept, margins = stage.decide(df[500:], ["before", "after"])
+
+    assert stage.trained
+    assert evaluation["train_rows"] + evaluation["holdout_rows"] == 500
+    assert 50 < evaluation["holdout_rows"] < 150
+    assert evaluation["holdout_agreement"] > 0.95
+    assert kept.index.equals(df[500:].index)
+    assert (margins >= 0).all()
+    assert (kept.dropna() == labels[500:][kept.notna()]).mean() > 0.95
+
+    stage.save_report("m1", path=str(tmp_path / "report_{}.json"))
+    with open(tmp_path / "report_m1.json") as f:
+        report = json.load(f)
+    assert report["rows"] == 300
+    assert report["kept"] + report["escalated"] == 300
+
+
+def test_distill_stage_invalid_threshold():
+    with pytest.raises(ValueError, match="between 0.5 and 1.0"):
+        DistillStage(threshold=0.3)
@@ -1,7 +1,30 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
 import pandas as pd
 import pytest
 
-from filter_dataset import get_prompts
+import filter_dataset
+from benchmarks.bench_pipeline import FakeModel, FakeModelLoader
+from filter_dataset import dry_run, get_prompts, iter_prompts, resolve_template
+from src.checkpoint import CheckpointStore
+from src.distill import DistillStage, HashedNgramClassifier
+from src.guide_cache import GuideCache
+from src.prompt_components import CLASSIFY_PROMPT, MULTI_CLASSIFY_PROMPT, SYSTEM_PROMPT
+from src.settings import PROMPT_FORMAT_OVERHEAD_TOKENS
+from src.telemetry import RunReport
+from src.token_lengths import LengthPolicy, count_tokens
+
+
+class WhitespaceTokenizer:
+    """Minimal tokenizer with the Hugging Face interface, one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [text.split() for text in texts]}
 
 
 def test_get_prompts_normal_case():
@@ -47,3 +70,304 @@ def test_get_prompts_empty_dataframe():
     prompts = get_prompts(df, columns_to_use, template)
 
     assert prompts == []
+
+
+def test_iter_prompts_is_lazy():
+    df = pd.DataFrame({"col_before": ["a", "b"], "col_after": ["c", "d"]})
+
+    prompts = iter_prompts(df, ["col_before", "col_after"], "{} -> {}")
+
+    assert next(prompts) == "a -> c"
+    assert list(prompts) == ["b -> d"]
+
+
+def test_iter_prompts_validates_eagerly():
+    df = pd.DataFrame({"col_before": ["a"]})
+
+    with pytest.raises(ValueError, match="columns_to_use should contain exactly 2 columns"):
+        iter_prompts(df, ["col_before"], "{} -> {}")
+
+
+def test_module_does_not_import_flex_infer():
+    code = "import sys, filter_dataset; print('flex_infer' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+    assert result.stdout.strip() == "False"
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_dry_run(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "input").mkdir(parents=True)
+    pd.DataFrame(
+        {
+            "before": ["a b", "a b", "c", "d e f g h", "x"],
+            "after": ["c", "c", "d", "i j k", "y"],
+        }
+    ).to_parquet("data/input/in.parquet")
+
+    plan = dry_run(
+        "gemma-2b",
+        ["before", "after"],
+        "{} {}",
+        chunk_size=chunk_size,
+        skip_row_ids=np.array([4]),
+        tokenizer=WhitespaceTokenizer(),
+        max_model_len=32 + 64 + 5,
+    )
+
+    # the system prompt is tokenized as part of every prompt
+    fixed = plan["max_prompt_tokens"] - 8
+    assert plan["rows"] == 5
+    assert plan["skipped"] == 1
+    assert plan["duplicates"] == 1
+    assert plan["rows_to_label"] == 3
+    assert plan["prefill_tokens"] == 3 + 2 + 8 + 3 * fixed
+    assert plan["estimate_source"] == "default"
+    with open("data/dry_run_gemma-2b.json") as f:
+        assert json.load(f) == plan
+
+
+def test_dry_run_uses_previous_run_report(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "input").mkdir(parents=True)
+    pd.DataFrame({"before": ["a b"], "after": ["c"]}).to_parquet("data/input/in.parquet")
+    with open("data/run_report_filter_gemma-2b.json", "w") as f:
+        json.dump({"counters": {"prompt_tokens": 100}, "stages": {"generation": {"seconds": 2}}}, f)
+
+    plan = dry_run(
+        "gemma-2b", ["before", "after"], "{} {}", tokenizer=WhitespaceTokenizer(), max_model_len=8
+    )
+
+    assert plan["prompt_tokens_per_second"] == 50
+    assert plan["estimated_seconds"] == plan["prefill_tokens"] / 50
+    assert plan["over_length"] == 1
+
+
+def test_resolve_template():
+    assert resolve_template("CLASSIFY_PROMPT") == CLASSIFY_PROMPT
+    assert resolve_template("{} -> {}") == "{} -> {}"
+
+    with pytest.raises(ValueError, match="exactly 2 {} placeholders"):
+        resolve_template("UNKNOWN_PROMPT")
+
+
+def test_model_loader_uses_guide_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTLINES_CACHE_DIR", "")
+    monkeypatch.setattr(filter_dataset, "load_model", lambda model_name, seed: "model")
+    guide_cache = GuideCache(str(tmp_path))
+    loader = filter_dataset.ModelLoader("gemma-2b", guide_cache=guide_cache)
+
+    assert loader().model == "model"
+    assert os.environ["OUTLINES_CACHE_DIR"].startswith(str(tmp_path))
+
+    loader.close()
+    [entry] = guide_cache.entries().values()
+    assert entry["description"] == {"model_name": "gemma-2b"}
+    assert guide_cache.stats()["misses"] == 1
+
+
+def test_get_run_settings_leaves_out_defaults():
+    assert filter_dataset.get_run_settings() == {}
+    assert filter_dataset.get_run_settings(with_margins=True, items_per_prompt=4) == {
+        "with_margins": True,
+        "items_per_prompt": 4,
+    }
+
+
+def test_generate_resumable_output_with_distill(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    # the fake model labels revisions with a marker word as bad
+    monkeypatch.setattr(
+        "src.stub_server.stub_label",
+        lambda text, choices: "bad" if "zzqx" in text else "good",
+    )
+    rng = np.random.default_rng(0)
+    is_bad = rng.random(600) < 0.3
+    df = pd.DataFrame(
+        {
+            "row_id": np.arange(600),
+            "before": [f"the club won the season {i}" for i in range(600)],
+            "after": [
+                f"the club won the season {i}" + (" zzqx" if bad else " today")
+                for i, bad in enumerate(is_bad)
+            ],
+        }
+    )
+    distill = DistillStage(
+        sample_size=200, threshold=0.8, classifier=HashedNgramClassifier(hash_bits=16)
+    )
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_resumable_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        CheckpointStore("gemma-2b", "distill", str(tmp_path)),
+        template="{} -> {}",
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        distill=distill,
+        report=report,
+    )
+
+    stages = output["gemma-2b_stage"]
+    assert (stages == "distill").sum() == distill.kept > 200
+    assert report.counters["generated_rows"] == (stages == "model").sum() < 400
+    assert report.counters["rows"] == 600
+    assert (output["gemma-2b_prediction"] == np.where(is_bad, "bad", "good")).mean() > 0.95
+
+
+def test_generate_resumable_output_with_distill_replaces_unlabeled_sample_rows(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    # every 50th row gets an answer that is neither good nor bad
+    monkeypatch.setattr(
+        "src.stub_server.stub_label",
+        lambda text, choices: (
+            "maybe"
+            if int(re.search(r"season (\d+)", text).group(1)) % 50 == 0
+            else "bad" if "zzqx" in text else "good"
+        ),
+    )
+    df = pd.DataFrame(
+        {
+            "row_id": np.arange(600),
+            "before": [f"the club won the season {i}" for i in range(600)],
+            "after": [
+                f"the club won the season {i}" + (" zzqx" if i % 3 == 0 else " today")
+                for i in range(600)
+            ],
+        }
+    )
+    distill = DistillStage(
+        sample_size=200, threshold=0.8, classifier=HashedNgramClassifier(hash_bits=16)
+    )
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_resumable_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        CheckpointStore("gemma-2b", "distill", str(tmp_path)),
+        template="{} -> {}",
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        distill=distill,
+        report=report,
+    )
+
+    assert distill.trained
+    assert distill.evaluation["train_rows"] + distill.evaluation["holdout_rows"] == 200
+    assert (output["gemma-2b_stage"] == "distill").sum() > 200
+    assert report.counters["rows"] == 600
+
+
+def test_generate_resumable_output_near_dedup_writes_clusters(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    template = "The football club {} sacked its manager after the defeat against Porto."
+    df = pd.DataFrame(
+        {
+            "row_id": [5, 6, 7, 8],
+            "before": [template.format(club) for club in ["Ajax", "Ajax", "Ajax", "Dortmund"]],
+            "after": ["short", "Short", "Short!", "short"],
+        }
+    )
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_resumable_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        CheckpointStore("gemma-2b", "near", str(tmp_path)),
+        template="{} -> {}",
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        dedup="near",
+        report=report,
+    )
+
+    assert output["gemma-2b_cluster"].tolist() == [5, 5, 5, 8]
+    assert output["gemma-2b_cluster"].dtype == "Int64"
+    assert output["gemma-2b_prediction"][:3].nunique() == 1
+    assert report.counters["generated_rows"] == 2
+
+
+def test_generate_output_multi_item(monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    # the fake model picks one of the answer choices by a hash of the prompt
+    df = pd.DataFrame({"before": [f"text {i}" for i in range(7)], "after": ["x"] * 7})
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        report=report,
+        items_per_prompt=3,
+    )
+
+    assert set(output["gemma-2b_prediction"]) <= {"good", "bad"}
+    assert report.counters["multi_item_prompts"] == 3
+    assert report.counters["generated_rows"] == 7
+    assert "multi_item_fallback_rows" not in report.counters
+
+
+def test_generate_output_multi_item_falls_back_to_single_rows(monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    # without guided decoding, the fake model answers with a single label
+    monkeypatch.setattr(filter_dataset, "MULTI_ITEM_MAX_GUIDED_ITEMS", 2)
+    df = pd.DataFrame({"before": [f"text {i}" for i in range(5)], "after": ["x"] * 5})
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        report=report,
+        items_per_prompt=3,
+    )
+
+    assert set(output["gemma-2b_prediction"]) <= {"good", "bad"}
+    assert report.counters["multi_item_prompts"] == 2
+    assert report.counters["multi_item_fallback_rows"] == 3
+
+
+def test_generate_output_multi_item_fits_context(monkeypatch):
+    monkeypatch.setitem(sys.modules, "flex_infer", None)
+    monkeypatch.setattr(filter_dataset, "USE_TQDM", False, raising=False)
+    tokenizer = WhitespaceTokenizer()
+    fixed = count_tokens(tokenizer, [MULTI_CLASSIFY_PROMPT.format(3, ""), SYSTEM_PROMPT]).sum()
+    # 8 tokens per pair and 32 output tokens, so that only 2 pairs fit into a prompt
+    length_policy = LengthPolicy(
+        tokenizer, 1_000, max_model_len=PROMPT_FORMAT_OVERHEAD_TOKENS + int(fixed) + 48
+    )
+    df = pd.DataFrame({"before": [f"text {i}" for i in range(5)], "after": ["x"] * 5})
+    df.loc[2, "before"] = "long " * 100
+    report = RunReport("filter_dataset", "gemma-2b")
+
+    output = filter_dataset.generate_output(
+        "gemma-2b",
+        df,
+        ["before", "after"],
+        model_loader=FakeModelLoader("gemma-2b", FakeModel()),
+        report=report,
+        items_per_prompt=3,
+        length_policy=length_policy,
+    )
+
+    assert set(output["gemma-2b_prediction"]) <= {"good", "bad"}
+    assert report.counters["multi_item_prompts"] == 2
+    assert report.counters["multi_item_fallback_rows"] == 1
+
+
+def test_generate_output_multi_item_without_margins():
+    with pytest.raises(ValueError, match="do not support margins"):
+        filter_dataset.generate_output(
+            "gemma-2b", pd.DataFrame(), ["a", "b"], scoring=True, items_per_prompt=2
+        )
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from src.guide_cache import GuideCache, guide_key, tokenizer_fingerprint
+
+
+def fill(path, num_bytes):
+    with open(os.path.join(path, "cache.db"), "wb") as f:
+        f.write(b"x" * num_bytes)
+
+
+def test_tokenizer_fingerprint(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    for name in ["a", "b"]:
+        (tmp_path / name / "tokenizer.json").write_text('{"vocab": 1}')
+
+    assert tokenizer_fingerprint(str(tmp_path / "a")) == tokenizer_fingerprint(str(tmp_path / "b"))
+
+    (tmp_path / "b" / "tokenizer.json").write_text('{"vocab": 2}')
+    assert tokenizer_fingerprint(str(tmp_path / "a")) != tokenizer_fingerprint(str(tmp_path / "b"))
+
+
+def test_guide_key_depends_on_choices():
+    assert guide_key("tok", ["good", "bad"]) == guide_key("tok", ["good", "bad"])
+    assert guide_key("tok", ["good", "bad"]) != guide_key("tok", ["bad", "good"])
+    assert guide_key("tok", ["good", "bad"]) != guide_key("other", ["good", "bad"])
+
+
+def test_hit_after_release(tmp_path):
+    cache = GuideCache(str(tmp_path))
+
+    path = cache.acquire("k1")
+    fill(path, 10)
+    cache.release("k1")
+    assert cache.acquire("k1") == path
+    cache.release("k1")
+
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5, "size": 10}
+    assert cache.entries()["k1"]["hits"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = GuideCache(str(tmp_path), max_bytes=25)
+
+    for key in ["k1", "k2", "k3"]:
+        fill(cache.acquire(key), 10)
+        cache.release(key)
+
+    assert set(cache.entries()) == {"k2", "k3"}
+    assert not os.path.exists(cache.path("k1"))
+    assert cache.evictions == 1
+
+
+def test_does_not_evict_entries_in_use(tmp_path):
+    other_job = GuideCache(str(tmp_path), max_bytes=5)
+    fill(other_job.acquire("k1"), 10)
+    other_job.release("k1")
+    other_job.acquire("k1")
+
+    cache = GuideCache(str(tmp_path), max_bytes=5)
+    fill(cache.acquire("k2"), 10)
+    cache.release("k2")
+
+    # k1 is held by the other job, so only k2 can be evicted
+    assert set(cache.entries()) == {"k1"}
+    assert os.path.exists(other_job.path("k1"))
+
+
+def test_invalid_max_bytes(tmp_path):
+    with pytest.raises(ValueError, match="max_bytes must be a positive integer"):
+        GuideCache(str(tmp_path), max_bytes=0)
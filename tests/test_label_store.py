@@ -0,0 +1,129 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.label_store import LabelStore, encode_labels, label_mask
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LabelStore(str(tmp_path / "labels"))
+
+
+def test_add_writes_only_the_label_columns(store):
+    store.add("m1", pd.DataFrame({"row_id": [1, 0], "m1_prediction": ["bad", "good"]}))
+
+    stored = pd.read_parquet(store.path("m1"))
+
+    assert stored.columns.tolist() == ["row_id", "m1_prediction"]
+    assert stored["row_id"].tolist() == [0, 1]
+
+
+def test_add_stores_dictionary_encoded_labels_and_metadata(store):
+    store.add(
+        "m1",
+        pd.DataFrame({"row_id": [0, 1, 2], "m1_prediction": ["bad", None, "good"]}),
+        metadata={"template": "{} -> {}", "fingerprint": "abc"},
+    )
+
+    schema = pq.read_schema(store.path("m1"))
+    stored = pd.read_parquet(store.path("m1"))
+
+    assert pa.types.is_dictionary(schema.field("m1_prediction").type)
+    assert store.metadata("m1") == {
+        "model_name": "m1",
+        "template": "{} -> {}",
+        "fingerprint": "abc",
+    }
+    assert stored["m1_prediction"].cat.codes.tolist() == [1, -1, 0]
+
+
+def test_encode_labels_keeps_unexpected_labels():
+    encoded = encode_labels(["good", "maybe", None, "bad"])
+
+    assert encoded.categories.tolist() == ["good", "bad", "maybe"]
+    assert encoded.codes.tolist() == [0, 2, -1, 1]
+
+
+def test_label_mask():
+    encoded = pa.chunked_array(
+        [
+            pa.DictionaryArray.from_arrays(
+                pa.array([1, None, 0], pa.int8()), pa.array(["good", "bad"])
+            ),
+            pa.DictionaryArray.from_arrays(pa.array([0, 1], pa.int8()), pa.array(["good", "x"])),
+        ]
+    )
+    plain = pa.chunked_array([["bad", None, "good", "good", "x"]])
+
+    for values in [encoded, plain]:
+        assert label_mask(values, "bad").tolist() == [True, False, False, False, False]
+        assert label_mask(values, "x").tolist() == [False, False, False, False, True]
+
+
+def test_add_requires_row_ids(store):
+    with pytest.raises(ValueError, match="no row_id column"):
+        store.add("m1", pd.DataFrame({"m1_prediction": ["bad"]}))
+
+
+def test_models_in_order_of_addition(store):
+    store.add("b", pd.DataFrame({"row_id": [0], "b_prediction": ["good"]}))
+    store.add("a", pd.DataFrame({"row_id": [0], "a_prediction": ["good"]}))
+    os.utime(store.path("b"), (0, 0))
+    os.utime(store.path("a"), (1, 1))
+
+    assert store.models() == ["b", "a"]
+
+    store.remove("b")
+
+    assert store.models() == ["a"]
+
+
+def test_read_joins_on_row_id(store):
+    store.add("m1", pd.DataFrame({"row_id": [2, 0, 1], "m1_prediction": ["bad", "good", "good"]}))
+    store.add(
+        "m2",
+        pd.DataFrame({"row_id": [0, 1], "m2_prediction": ["bad", "good"], "m2_margin": [1.0, 2.0]}),
+    )
+    df = pd.DataFrame({"text": ["a", "b", "c"]})
+
+    wide = store.read(df)
+
+    assert wide["text"].tolist() == ["a", "b", "c"]
+    assert wide["m1_prediction"].tolist() == ["good", "good", "bad"]
+    assert wide["m2_prediction"].tolist()[:2] == ["bad", "good"]
+    assert pd.isna(wide["m2_prediction"].iloc[2])
+
+
+def test_read_projects_columns(store):
+    store.add(
+        "m1",
+        pd.DataFrame({"row_id": [0], "m1_prediction": ["bad"], "m1_margin": [1.0]}),
+    )
+
+    wide = store.read(pd.DataFrame({"text": ["a"]}), columns=["m1_prediction"])
+
+    assert wide.columns.tolist() == ["row_id", "text", "m1_prediction"]
+
+
+def test_read_keeps_row_id_column_of_the_dataset(store):
+    store.add("m1", pd.DataFrame({"row_id": [10, 11], "m1_prediction": ["bad", "good"]}))
+    df = pd.DataFrame({"row_id": [11, 10], "text": ["b", "a"]})
+
+    wide = store.read(df)
+
+    assert wide["m1_prediction"].tolist() == ["good", "bad"]
+
+
+def test_flagged_row_ids(store):
+    store.add("m1", pd.DataFrame({"row_id": [0, 1, 2], "m1_prediction": ["good", "bad", "good"]}))
+    store.add("m2", pd.DataFrame({"row_id": [0, 1, 2], "m2_prediction": ["good", None, "bad"]}))
+
+    assert store.flagged_row_ids().tolist() == [1, 2]
+
+
+def test_flagged_row_ids_without_labels(store):
+    assert len(store.flagged_row_ids()) == 0
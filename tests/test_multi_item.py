@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+from src.multi_item import build_prompt, format_answer, label_choices, parse_labels, split_items
+from src.settings import PROMPT_FORMAT_OVERHEAD_TOKENS
+
+LABELS = ["good", "bad"]
+
+
+def test_label_choices():
+    choices = label_choices(2, LABELS)
+
+    assert choices == ["1: good\n2: good", "1: good\n2: bad", "1: bad\n2: good", "1: bad\n2: bad"]
+    assert len(label_choices(8, LABELS)) == 256
+
+
+def test_parse_labels_round_trip():
+    labels = ["bad", "good", "good"]
+
+    assert parse_labels(format_answer(labels), 3, LABELS) == labels
+
+
+def test_parse_labels_is_lenient_about_format():
+    assert parse_labels("**1.** Good\n\n2) bad.\n", 2, LABELS) == ["good", "bad"]
+    assert parse_labels("2: bad\n1: good", 2, LABELS) == ["good", "bad"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "1: good",
+        "1: good\n2: bad\n3: bad",
+        "1: good\n1: bad",
+        "1: good\n2: fine",
+        "good\nbad",
+        "",
+    ],
+)
+def test_parse_labels_rejects_invalid_answers(text):
+    assert parse_labels(text, 2, LABELS) is None
+
+
+def test_build_prompt():
+    df = pd.DataFrame({"before": ["a", "b"], "after": ["c", "d"]})
+
+    prompt = build_prompt(df, ["before", "after"], "{} pairs:\n{}", "{}. {} -> {}")
+
+    assert prompt == "2 pairs:\n1. a -> c\n2. b -> d"
+
+    with pytest.raises(ValueError, match="exactly 2 columns"):
+        build_prompt(df, ["before"])
+
+
+class WhitespaceTokenizer:
+    """Minimal tokenizer with the Hugging Face interface, one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def test_split_items_fits_context():
+    # 5 tokens per pair with the line break, the template and system prompt take 3 tokens
+    df = pd.DataFrame({"before": ["w w"] * 7, "after": ["x"] * 7})
+    df.loc[4, "before"] = "w " * 30
+
+    groups, oversized = split_items(
+        WhitespaceTokenizer(),
+        df,
+        ["before", "after"],
+        4,
+        PROMPT_FORMAT_OVERHEAD_TOKENS + 3 + 20,
+        "sys",
+        tokens_per_item=1,
+        min_output_tokens=2,
+        template="Classify {}:\n{}",
+        item_template="{} {} {}",
+    )
+
+    assert [group.tolist() for group in groups] == [[0, 1, 2], [3], [5, 6]]
+    assert oversized.tolist() == [4]
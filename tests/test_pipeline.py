@@ -0,0 +1,80 @@
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+from src.pipeline import SerialExecutor, prefetch
+
+
+def test_prefetch_keeps_order():
+    assert list(prefetch(range(100), depth=3)) == list(range(100))
+
+
+def test_prefetch_without_depth_runs_in_calling_thread():
+    threads = []
+
+    def produce():
+        for i in range(3):
+            threads.append(threading.current_thread())
+            yield i
+
+    assert list(prefetch(produce(), depth=0)) == [0, 1, 2]
+    assert set(threads) == {threading.current_thread()}
+
+
+def test_prefetch_applies_backpressure():
+    produced = []
+
+    def produce():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = prefetch(produce(), depth=2)
+    assert next(items) == 0
+    time.sleep(0.2)
+
+    # the queue holds 2 items and the producer waits with the next one
+    assert len(produced) <= 4
+    items.close()
+
+
+def test_prefetch_raises_producer_errors():
+    def produce():
+        yield 1
+        raise RuntimeError("read failed")
+
+    items = prefetch(produce(), depth=2)
+
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="read failed"):
+        next(items)
+
+
+def test_prefetch_stops_producer_on_close():
+    with closing(prefetch(iter(range(10**9)), depth=2)) as items:
+        assert next(items) == 0
+
+    assert not any(thread.name == "prefetch" for thread in threading.enumerate())
+
+
+def test_serial_executor_runs_in_order():
+    done = []
+
+    with SerialExecutor(depth=2) as executor:
+        for i in range(20):
+            executor.submit(lambda i: (time.sleep(0.001), done.append(i)), i)
+
+    assert done == list(range(20))
+
+
+def test_serial_executor_raises_errors():
+    def fail():
+        raise ValueError("write failed")
+
+    executor = SerialExecutor(depth=2)
+    executor.submit(fail)
+
+    with pytest.raises(ValueError, match="write failed"):
+        executor.close()
@@ -0,0 +1,125 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.rules import DEFAULT_RULES, RULES, apply_rules, get_rules, to_string_array
+
+
+def _decide(before, after, rule_names):
+    df = pd.DataFrame({"before": before, "after": after})
+    return apply_rules(df, ["before", "after"], get_rules(rule_names)).tolist()
+
+
+def test_empty_or_short():
+    decided = _decide(
+        ["A proper sentence here.", None, "Another proper sentence."],
+        ["A proper sentence there.", "Some text that is long", "   short  "],
+        ["empty_or_short"],
+    )
+
+    assert decided == [None, "empty_or_short", "empty_or_short"]
+
+
+def test_caption_artifact():
+    decided = _decide(
+        ["Yesterday, football club (BVB) sacked manager ."] * 2,
+        [
+            "File photo of Peter Stöger in 2011Yesterday, football club (BVB) sacked manager .",
+            "Yesterday, the football club (BVB) sacked its manager .",
+        ],
+        ["caption_artifact"],
+    )
+
+    assert decided == ["caption_artifact", None]
+
+
+def test_reference_list():
+    decided = _decide(
+        ["Category: Sports news", "References"],
+        ["Sports news of the day", "The club won the league title again."],
+        ["reference_list"],
+    )
+
+    assert decided == ["reference_list", "reference_list"]
+
+
+def test_run_together():
+    decided = _decide(
+        ["In at , , defeated the Netherlands to win the ."] * 2,
+        [
+            "on Sundayon SaturdayIn at , , defeated the Netherlands to win the .",
+            "On Sunday, they defeated the Netherlands to win the cup.",
+        ],
+        ["run_together"],
+    )
+
+    assert decided == ["run_together", None]
+
+
+def test_run_together_glued_sentences():
+    decided = _decide(
+        ["The club won the cup. The fans celebrated."] * 2,
+        ["The club won the cup.The fans celebrated in 2011Yesterday.", "The club won the cup."],
+        ["run_together"],
+    )
+
+    assert decided == ["run_together", None]
+
+
+def test_run_together_ignores_camel_case_names():
+    text = "The team released JavaScript and TypeScript tooling for PlayStation developers."
+
+    assert _decide([text], [text], ["run_together"]) == [None]
+
+
+def test_low_alpha_ratio():
+    decided = _decide(
+        ["--- 12345 ,,, ### 6789", "The space between planets is vast."],
+        ["Some normal text here", "The space between the planets is vast."],
+        ["low_alpha_ratio"],
+    )
+
+    assert decided == ["low_alpha_ratio", None]
+
+
+def test_low_alpha_ratio_of_chunked_arrays():
+    texts = ["--- 12345 ,,, ### 6789", "Some normal text here", "", "ab 12"]
+    matches = RULES["low_alpha_ratio"].matches
+    # columns of more than 2 GB of text come as chunked arrays or with 64-bit offsets
+    chunked = pa.chunked_array([pa.array(texts[:1]), pa.array(texts)[1:]])
+
+    expected = matches(to_string_array(pd.Series(texts)), to_string_array(pd.Series(texts)))
+
+    assert matches(chunked, chunked).tolist() == expected.tolist() == [True, False, True, False]
+
+
+def test_clean_sentence():
+    decided = _decide(
+        ["The space between the planets is vast and empty.", "In at , , defeated them ."],
+        ["The space between the planets is very vast and empty.", "In at , , defeated them ."],
+        ["clean_sentence"],
+    )
+
+    assert decided == ["clean_sentence", None]
+
+
+def test_first_matching_rule_decides():
+    decided = _decide(["File photo"], ["File photo"], ["caption_artifact", "empty_or_short"])
+
+    assert decided == ["caption_artifact"]
+
+
+def test_default_rules_only_label_bad():
+    assert all(RULES[name].label == "bad" for name in DEFAULT_RULES)
+
+
+def test_get_rules_unknown():
+    with pytest.raises(ValueError, match="Unknown rules"):
+        get_rules(["does_not_exist"])
+
+
+def test_to_string_array_fills_missing_values():
+    texts = to_string_array(pd.Series(["a", None]))
+
+    assert texts.to_pylist() == ["a", ""]
+    assert texts.type == pa.large_string()
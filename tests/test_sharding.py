@@ -0,0 +1,150 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.sharding import (
+    load_manifests,
+    merge_shards,
+    shard_mask,
+    shard_path,
+    write_manifest,
+)
+
+
+def test_shard_mask_partitions_rows():
+    row_ids = np.arange(1000)
+
+    masks = [shard_mask(row_ids, 4, i) for i in range(4)]
+
+    assert (np.sum(masks, axis=0) == 1).all()
+    assert all(150 < mask.sum() < 350 for mask in masks)
+
+
+def test_shard_mask_is_independent_of_chunks():
+    row_ids = np.arange(100)
+
+    mask = shard_mask(row_ids, 3, 1)
+    chunked = np.concatenate([shard_mask(row_ids[:40], 3, 1), shard_mask(row_ids[40:], 3, 1)])
+
+    assert (mask == chunked).all()
+
+
+def test_shard_mask_invalid_index():
+    with pytest.raises(ValueError, match="Invalid shard 2 of 2 shards."):
+        shard_mask(np.arange(3), 2, 2)
+
+
+def write_shards(
+    shard_dir, df, num_shards, model_name="m1", fingerprint="fp", input_path=None, filters=None
+):
+    for i in range(num_shards):
+        path = shard_path(model_name, i, num_shards, str(shard_dir))
+        (shard_dir / model_name).mkdir(parents=True, exist_ok=True)
+        shard = df[shard_mask(df["row_id"].to_numpy(), num_shards, i)]
+        shard.to_parquet(path, index=False)
+        write_manifest(
+            path,
+            model_name,
+            i,
+            num_shards,
+            fingerprint,
+            input_path=input_path or "./data/input",
+            filters=filters,
+        )
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    (tmp_path / "input").mkdir()
+    df = pd.DataFrame({"text": [f"text {i}" for i in range(50)]})
+    df.to_parquet(tmp_path / "input" / "in.parquet")
+
+    labeled = df.copy()
+    labeled.insert(0, "row_id", np.arange(50))
+    labeled["m1_prediction"] = ["bad" if i % 3 == 0 else "good" for i in range(50)]
+    labeled["m1_margin"] = np.arange(50, dtype=float)
+
+    return labeled
+
+
+def test_merge_shards_restores_input_order(tmp_path, dataset):
+    write_shards(tmp_path / "shards", dataset, 3)
+    output = str(tmp_path / "labeled_data_{}.parquet")
+
+    num_rows = merge_shards(
+        "m1", 16, path=output, shard_dir=str(tmp_path / "shards"), dir_path=str(tmp_path / "input")
+    )
+
+    merged = pd.read_parquet(output.format("m1"))
+    assert num_rows == 50
+    pd.testing.assert_frame_equal(merged, dataset)
+
+
+def test_merge_shards_uses_input_and_filters_of_manifests(tmp_path, dataset):
+    filtered = dataset[dataset["text"] >= "text 2"]
+    write_shards(
+        tmp_path / "shards",
+        filtered,
+        2,
+        input_path=str(tmp_path / "input" / "*.parquet"),
+        filters=[("text", ">=", "text 2")],
+    )
+    output = str(tmp_path / "labeled_data_{}.parquet")
+
+    num_rows = merge_shards("m1", 16, path=output, shard_dir=str(tmp_path / "shards"))
+
+    merged = pd.read_parquet(output.format("m1"))
+    assert num_rows == len(filtered)
+    assert merged["row_id"].tolist() == filtered["row_id"].tolist()
+
+
+def test_merge_shards_detects_missing_rows(tmp_path, dataset):
+    write_shards(tmp_path / "shards", dataset.drop(index=[7]), 3)
+
+    with pytest.raises(ValueError, match="cover"):
+        merge_shards(
+            "m1",
+            16,
+            path=str(tmp_path / "out_{}.parquet"),
+            shard_dir=str(tmp_path / "shards"),
+            dir_path=str(tmp_path / "input"),
+        )
+
+
+def test_merge_shards_detects_shards_out_of_input_order(tmp_path, dataset):
+    write_shards(tmp_path / "shards", dataset.iloc[::-1], 3)
+
+    with pytest.raises(ValueError, match="in the input order"):
+        merge_shards(
+            "m1",
+            16,
+            path=str(tmp_path / "out_{}.parquet"),
+            shard_dir=str(tmp_path / "shards"),
+            dir_path=str(tmp_path / "input"),
+        )
+
+
+def test_load_manifests_detects_missing_shard(tmp_path, dataset):
+    write_shards(tmp_path / "shards", dataset, 3)
+    (tmp_path / "shards" / "m1" / "shard-00001-of-00003.json").unlink()
+
+    with pytest.raises(ValueError, match=r"Missing shards \[1\] of 3"):
+        load_manifests("m1", str(tmp_path / "shards"))
+
+
+def test_load_manifests_detects_different_runs(tmp_path, dataset):
+    write_shards(tmp_path / "shards", dataset, 2)
+    manifest_file = tmp_path / "shards" / "m1" / "shard-00000-of-00002.json"
+    manifest = json.loads(manifest_file.read_text())
+    manifest["fingerprint"] = "other"
+    manifest_file.write_text(json.dumps(manifest))
+
+    with pytest.raises(ValueError, match="different fingerprint"):
+        load_manifests("m1", str(tmp_path / "shards"))
+
+
+def test_load_manifests_without_shards(tmp_path):
+    with pytest.raises(FileNotFoundError, match="No shard manifests found"):
+        load_manifests("m1", str(tmp_path))
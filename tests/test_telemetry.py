@@ -0,0 +1,74 @@
+import json
+from types import SimpleNamespace
+
+from src.telemetry import RunReport, count_output_tokens
+
+
+def test_stage_adds_up_calls():
+    report = RunReport("test")
+
+    for _ in range(3):
+        with report.stage("generation"):
+            pass
+
+    assert report.stages["generation"]["calls"] == 3
+    assert report.stages["generation"]["seconds"] >= 0
+
+
+def test_timed_iterates_lazily():
+    report = RunReport("test")
+
+    items = list(report.timed("data_load", iter([1, 2, 3])))
+
+    assert items == [1, 2, 3]
+    # one call per item and one for the end of the iterator
+    assert report.stages["data_load"]["calls"] == 4
+
+
+def test_count_output_tokens():
+    vllm_output = SimpleNamespace(
+        prompt_token_ids=[1, 2, 3], outputs=[SimpleNamespace(token_ids=[4, 5])]
+    )
+    api_output = SimpleNamespace(
+        outputs=[SimpleNamespace(text="good")],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=1),
+    )
+    unknown_output = SimpleNamespace(outputs=[SimpleNamespace(text="good")])
+
+    assert count_output_tokens([vllm_output, api_output, unknown_output]) == (13, 3)
+
+
+def test_advance_prints_progress(capsys):
+    report = RunReport("test", total_rows=10, progress_interval=0)
+
+    report.advance(4)
+
+    assert report.counters["rows"] == 4
+    assert "Progress: 4/10 rows (40.0%" in capsys.readouterr().out
+
+
+def test_advance_without_progress_interval(capsys):
+    report = RunReport("test", total_rows=10)
+
+    report.advance(4)
+
+    assert capsys.readouterr().out == ""
+
+
+def test_save(tmp_path):
+    report = RunReport("filter_dataset", "m1")
+    with report.stage("generation"):
+        report.count("prompt_tokens", 100)
+        report.count("output_tokens", 10)
+    report.advance(5)
+
+    report.save(str(tmp_path / "report.json"))
+
+    saved = json.loads((tmp_path / "report.json").read_text())
+    assert saved["script"] == "filter_dataset"
+    assert saved["model_name"] == "m1"
+    assert saved["counters"] == {"prompt_tokens": 100, "output_tokens": 10, "rows": 5}
+    assert saved["stages"]["generation"]["calls"] == 1
+    assert saved["rows_per_second"] > 0
+    assert 0 <= saved["generation_share"] <= 1
+    assert saved["peak_rss_mb"] > 0
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.token_lengths import LengthPolicy, count_tokens, text_token_budget
+
+
+class WhitespaceTokenizer:
+    """Minimal tokenizer with the Hugging Face interface, one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [text.split() for text in texts]}
+
+    def decode(self, ids):
+        return " ".join(ids)
+
+
+def test_count_tokens():
+    lengths = count_tokens(WhitespaceTokenizer(), ["a b c", "", "a"])
+
+    assert lengths.tolist() == [3, 0, 1]
+
+
+def test_text_token_budget():
+    budget = text_token_budget(
+        WhitespaceTokenizer(), "one two {} {}", "sys tem", max_model_len=200, max_tokens=32
+    )
+
+    assert budget == 200 - 32 - 64 - 4
+
+
+def test_truncate_pair_splits_budget():
+    policy = LengthPolicy(WhitespaceTokenizer(), max_text_tokens=4)
+
+    assert policy.truncate_pair("a b c d e", "f g h i j") == ("a b", "f g")
+    assert policy.truncate_pair("a", "f g h i j") == ("a", "f g h")
+
+
+def test_apply_sorts_by_length():
+    df = pd.DataFrame({"before": ["a b c", "a", "a b"], "after": ["x", "x", "x"]})
+    policy = LengthPolicy(WhitespaceTokenizer(), max_text_tokens=10)
+
+    ordered, permutation, num_to_label = policy.apply(df, ["before", "after"])
+
+    assert permutation.tolist() == [1, 2, 0]
+    assert ordered.index.tolist() == [1, 2, 0]
+    assert num_to_label == 3
+
+
+def test_apply_truncate_policy():
+    df = pd.DataFrame({"before": ["a b c d e", "a"], "after": ["f g h i j", "x"]})
+    policy = LengthPolicy(WhitespaceTokenizer(), max_text_tokens=4, policy="truncate")
+
+    ordered, _, num_to_label = policy.apply(df, ["before", "after"])
+
+    assert num_to_label == 2
+    assert ordered.loc[0, "before"] == "a b"
+    assert ordered.loc[0, "after"] == "f g"
+    assert df.loc[0, "before"] == "a b c d e"
+
+
+def test_apply_skip_policy():
+    df = pd.DataFrame({"before": ["a b c d e", "a", "a b"], "after": ["f", "x", None]})
+    policy = LengthPolicy(WhitespaceTokenizer(), max_text_tokens=4, policy="skip")
+
+    ordered, permutation, num_to_label = policy.apply(df, ["before", "after"])
+
+    assert num_to_label == 2
+    assert np.array_equal(permutation, [1, 2, 0])
+    assert ordered.iloc[num_to_label:].index.tolist() == [0]
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError, match="Length policy none not supported"):
+        LengthPolicy(WhitespaceTokenizer(), max_text_tokens=4, policy="none")
+
+
+def test_template_exceeds_context():
+    with pytest.raises(ValueError, match="exceeds the context length"):
+        LengthPolicy(WhitespaceTokenizer(), max_text_tokens=0)
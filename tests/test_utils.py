@@ -1,11 +1,19 @@
+import os
 from unittest import mock
 
 import pandas as pd
+import pyarrow.parquet as pq
 import pytest
 
 from src.utils import (
+    ParquetAppender,
+    add_row_ids,
+    batched,
     clean_up,
+    count_rows,
+    iter_data,
     parquet_exists,
+    parse_filter,
     read_data,
     read_model_predictions,
     save_output,
@@ -56,40 +64,108 @@ def test_clean_up(mock_remove):
     mock_remove.assert_any_call("./data/labeled_data_test_model.csv")
 
 
-@mock.patch("src.utils.os.listdir", return_value=[])
-def test_read_data_no_files(mock_listdir):
+def test_read_data_no_files(tmp_path):
     with pytest.raises(ValueError, match="No dataset file found"):
-        read_data()
+        read_data(str(tmp_path))
 
 
-@mock.patch("src.utils.os.listdir", return_value=["file1.csv", "file2.parquet"])
-def test_read_data_multiple_files(mock_listdir):
-    with pytest.raises(ValueError, match="Multiple dataset files found"):
-        read_data()
+def test_read_data_mixed_formats(tmp_path):
+    pd.DataFrame({"col1": [1]}).to_csv(tmp_path / "file1.csv", index=False)
+    pd.DataFrame({"col1": [2]}).to_parquet(tmp_path / "file2.parquet", index=False)
 
+    with pytest.raises(ValueError, match="Multiple dataset formats found"):
+        read_data(str(tmp_path))
 
-@mock.patch("src.utils.pd.read_csv")
-@mock.patch("src.utils.os.listdir", return_value=["file.csv"])
-def test_read_data_csv(mock_listdir, mock_read_csv):
-    mock_df = pd.DataFrame({"col1": [1, 2, 3]})
-    mock_read_csv.return_value = mock_df
 
-    df = read_data()
+def test_read_data_csv(tmp_path):
+    pd.DataFrame({"col1": [1, 2, 3]}).to_csv(tmp_path / "file.csv", index=False)
 
-    mock_read_csv.assert_called_once_with("./data/input/file.csv")
-    assert len(df) == 3
+    df = read_data(str(tmp_path))
 
+    assert df["col1"].tolist() == [1, 2, 3]
+    assert df["row_id"].tolist() == [0, 1, 2]
+
+
+def test_read_data_parquet(tmp_path):
+    pd.DataFrame({"col1": [1, 2, 3]}).to_parquet(tmp_path / "file.parquet", index=False)
+
+    df = read_data(str(tmp_path / "file.parquet"))
+
+    assert df["col1"].tolist() == [1, 2, 3]
+    assert df["row_id"].tolist() == [0, 1, 2]
+
+
+def write_parts(tmp_path):
+    for part in range(3):
+        pd.DataFrame(
+            {
+                "text": [f"text {part}-{i}" for i in range(4)],
+                "lang": ["en", "de", "en", "fr"],
+                "meta": ["x" * 10] * 4,
+            }
+        ).to_parquet(tmp_path / f"part-{part}.parquet", index=False, row_group_size=2)
+
+
+def test_read_data_reads_files_as_one_dataset(tmp_path):
+    write_parts(tmp_path)
+    (tmp_path / "notes.txt").write_text("not a dataset")
+
+    df = read_data(str(tmp_path))
+    from_glob = read_data(str(tmp_path / "part-*.parquet"))
+
+    assert df["row_id"].tolist() == list(range(12))
+    assert df["text"].tolist()[3:5] == ["text 0-3", "text 1-0"]
+    pd.testing.assert_frame_equal(df, from_glob)
+
+
+def test_read_data_projects_columns(tmp_path):
+    write_parts(tmp_path)
+
+    df = read_data(str(tmp_path), columns=["text"])
+
+    assert df.columns.tolist() == ["row_id", "text"]
 
-@mock.patch("src.utils.pd.read_parquet")
-@mock.patch("src.utils.os.listdir", return_value=["file.parquet"])
-def test_read_data_parquet(mock_listdir, mock_read_parquet):
-    mock_df = pd.DataFrame({"col1": [1, 2, 3]})
-    mock_read_parquet.return_value = mock_df
 
-    df = read_data()
+def test_read_data_filters_keep_row_ids(tmp_path):
+    write_parts(tmp_path)
 
-    mock_read_parquet.assert_called_once_with("./data/input/file.parquet")
-    assert len(df) == 3
+    df = read_data(str(tmp_path), columns=["text"], filters=[("lang", "==", "en")])
+
+    assert df.columns.tolist() == ["row_id", "text"]
+    assert df["row_id"].tolist() == [0, 2, 4, 6, 8, 10]
+    assert df["text"].tolist()[:2] == ["text 0-0", "text 0-2"]
+
+
+def test_iter_data_filters_keep_row_ids(tmp_path):
+    write_parts(tmp_path)
+    pd.concat([pd.read_parquet(tmp_path / f"part-{part}.parquet") for part in range(3)]).to_csv(
+        tmp_path / "all.csv", index=False
+    )
+    filters = [("lang", "!=", "en")]
+
+    parquet_chunks = list(iter_data(4, str(tmp_path / "*.parquet"), ["text"], filters))
+    csv_chunks = list(iter_data(4, str(tmp_path / "all.csv"), ["text"], filters))
+
+    for chunks in [parquet_chunks, csv_chunks]:
+        assert [len(chunk) for chunk in chunks] == [4, 2]
+        assert pd.concat(chunks)["row_id"].tolist() == [1, 3, 5, 7, 9, 11]
+        assert chunks[1].index.tolist() == [0, 1]
+
+
+def test_count_rows(tmp_path):
+    write_parts(tmp_path)
+
+    assert count_rows(str(tmp_path)) == 12
+    assert count_rows(str(tmp_path), [("lang", "==", "fr")]) == 3
+
+
+def test_parse_filter():
+    assert parse_filter("lang == en") == ("lang", "==", "en")
+    assert parse_filter("score>=0.5") == ("score", ">=", 0.5)
+    assert parse_filter("length < 10") == ("length", "<", 10)
+
+    with pytest.raises(ValueError, match="Invalid filter"):
+        parse_filter("lang en")
 
 
 @mock.patch("src.utils.pd.read_parquet")
@@ -114,3 +190,125 @@ def test_read_model_predictions_file_not_found(mock_exists):
         FileNotFoundError, match="Predictions file for non_existent_model not found"
     ):
         read_model_predictions(model_name)
+
+
+def test_iter_data_parquet_chunks(tmp_path):
+    pd.DataFrame({"col1": range(5)}).to_parquet(tmp_path / "file.parquet", index=False)
+
+    chunks = list(iter_data(2, dir_path=str(tmp_path)))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert pd.concat(chunks)["col1"].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_iter_data_csv_chunks(tmp_path):
+    pd.DataFrame({"col1": range(5)}).to_csv(tmp_path / "file.csv", index=False)
+
+    chunks = list(iter_data(3, dir_path=str(tmp_path)))
+
+    assert [len(chunk) for chunk in chunks] == [3, 2]
+    assert chunks[1].index.tolist() == [0, 1]
+
+
+def test_iter_data_invalid_chunk_size():
+    with pytest.raises(ValueError, match="chunk_size must be a positive integer"):
+        list(iter_data(0))
+
+
+def test_parquet_appender(tmp_path):
+    path = str(tmp_path / "out.parquet")
+
+    with ParquetAppender(path) as writer:
+        writer.write(pd.DataFrame({"col1": [1, 2], "col2": ["a", "b"]}))
+        writer.write(pd.DataFrame({"col1": [3], "col2": ["c"]}))
+
+    assert writer.num_rows == 3
+    assert pd.read_parquet(path)["col1"].tolist() == [1, 2, 3]
+
+
+def test_parquet_appender_metadata_and_categories(tmp_path):
+    path = str(tmp_path / "out.parquet")
+
+    with ParquetAppender(path, metadata={"model_name": "m1"}) as writer:
+        writer.write(pd.DataFrame({"label": pd.Categorical(["bad"], categories=["good", "bad"])}))
+        writer.write(
+            pd.DataFrame({"label": pd.Categorical(["x"], categories=["good", "bad", "x"])})
+        )
+
+    assert pq.read_schema(path).metadata[b"model_name"] == b"m1"
+    assert pd.read_parquet(path)["label"].tolist() == ["bad", "x"]
+
+
+def test_parquet_appender_empty_first_chunk(tmp_path):
+    path = str(tmp_path / "out.parquet")
+
+    with ParquetAppender(path) as writer:
+        writer.write(pd.DataFrame({"col1": pd.Series([], dtype=object)}))
+        writer.write(pd.DataFrame({"col1": ["a"]}))
+        writer.write(pd.DataFrame({"col1": pd.Series([], dtype=object)}))
+
+    assert pd.read_parquet(path)["col1"].tolist() == ["a"]
+
+
+def test_parquet_appender_only_empty_chunks(tmp_path):
+    path = str(tmp_path / "out.parquet")
+
+    with ParquetAppender(path) as writer:
+        writer.write(pd.DataFrame({"col1": pd.Series([], dtype=object)}))
+
+    df = pd.read_parquet(path)
+    assert len(df) == 0
+    assert df.columns.tolist() == ["col1"]
+
+
+def test_parquet_appender_keeps_previous_output_on_error(tmp_path):
+    path = str(tmp_path / "out.parquet")
+    pd.DataFrame({"col1": [0]}).to_parquet(path)
+
+    with pytest.raises(RuntimeError):
+        with ParquetAppender(path) as writer:
+            writer.write(pd.DataFrame({"col1": [1, 2]}))
+            raise RuntimeError("crash")
+
+    assert pd.read_parquet(path)["col1"].tolist() == [0]
+    assert sorted(os.listdir(tmp_path)) == ["out.parquet"]
+
+
+def test_add_row_ids_with_offset():
+    df = pd.DataFrame({"col1": ["a", "b"]})
+
+    df = add_row_ids(df, offset=10)
+
+    assert df.columns.tolist() == ["row_id", "col1"]
+    assert df["row_id"].tolist() == [10, 11]
+
+
+def test_add_row_ids_keeps_existing_ids():
+    df = pd.DataFrame({"row_id": [7, 3], "col1": ["a", "b"]})
+
+    df = add_row_ids(df)
+
+    assert df["row_id"].tolist() == [7, 3]
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_batched_consumes_lazily():
+    consumed = []
+
+    def items():
+        for i in range(10):
+            consumed.append(i)
+            yield i
+
+    batches = batched(items(), 3)
+    assert next(batches) == [0, 1, 2]
+    assert consumed == [0, 1, 2]
+
+
+def test_batched_invalid_size():
+    with pytest.raises(ValueError, match="size must be a positive integer"):
+        list(batched(range(3), 0))
@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+from src.worker import claim_job, finish_job, requeue_running_jobs, run_worker, submit_job
+
+
+def test_submit_and_claim_in_order(tmp_path):
+    spool_dir = str(tmp_path)
+    first = submit_job("a.parquet", ["before", "after"], spool_dir=spool_dir)
+    second = submit_job("b.parquet", ["before", "after"], template="{} {}", spool_dir=spool_dir)
+
+    job = claim_job(spool_dir)
+
+    assert job["id"] == first
+    assert job["input"] == os.path.abspath("a.parquet")
+    assert job["output"] == os.path.join(spool_dir, "results", f"{first}.parquet")
+    assert os.path.exists(os.path.join(spool_dir, "running", f"{first}.json"))
+    assert claim_job(spool_dir)["id"] == second
+    assert claim_job(spool_dir) is None
+
+
+def test_submit_job_validates_columns(tmp_path):
+    with pytest.raises(ValueError, match="columns should contain exactly 2 columns"):
+        submit_job("a.parquet", ["before"], spool_dir=str(tmp_path))
+
+
+def test_finish_job(tmp_path):
+    spool_dir = str(tmp_path)
+    submit_job("a.parquet", ["before", "after"], spool_dir=spool_dir)
+    job = claim_job(spool_dir)
+
+    path = finish_job(job, error="boom", spool_dir=spool_dir)
+
+    with open(path) as f:
+        assert json.load(f)["error"] == "boom"
+    assert path == os.path.join(spool_dir, "failed", f"{job['id']}.json")
+    assert os.listdir(os.path.join(spool_dir, "running")) == []
+
+
+def test_requeue_running_jobs(tmp_path):
+    spool_dir = str(tmp_path)
+    job_id = submit_job("a.parquet", ["before", "after"], spool_dir=spool_dir)
+    claim_job(spool_dir)
+
+    assert requeue_running_jobs(spool_dir) == [job_id]
+    assert claim_job(spool_dir)["id"] == job_id
+
+
+def test_run_worker_continues_after_failed_job(tmp_path):
+    spool_dir = str(tmp_path)
+    for name in ["a.parquet", "fail.parquet", "b.parquet"]:
+        submit_job(name, ["before", "after"], spool_dir=spool_dir)
+    handled = []
+
+    def handle_job(job):
+        if job["input"].endswith("fail.parquet"):
+            raise RuntimeError("cannot label")
+        handled.append(os.path.basename(job["input"]))
+        return {"rows": 1}
+
+    assert run_worker(handle_job, spool_dir, exit_when_idle=True) == (2, 1)
+    assert handled == ["a.parquet", "b.parquet"]
+    assert len(os.listdir(os.path.join(spool_dir, "done"))) == 2
+    [failed] = os.listdir(os.path.join(spool_dir, "failed"))
+    with open(os.path.join(spool_dir, "failed", failed)) as f:
+        assert "RuntimeError: cannot label" in json.load(f)["error"]